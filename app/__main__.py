@@ -1,5 +1,10 @@
+import time
+import uuid
+import signal
 import logging
 import argparse
+import threading
+from contextlib import ExitStack
 from dotenv import load_dotenv, find_dotenv
 import os
 
@@ -14,6 +19,7 @@ def setup_logging():
     )
 
 def main():
+    run_started = time.monotonic()
 
     # --- BƯỚC 1: LOAD .ENV ---
     dotenv_path = find_dotenv('.env.local')
@@ -42,25 +48,93 @@ def main():
         action='append',
         help="Run only specific reports (e.g., --report BRANCH_VPI_DOANHTHU). Can be used multiple times."
     )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help="Do not read or write the on-disk extraction result cache."
+    )
+    parser.add_argument(
+        '--refresh-cache',
+        action='store_true',
+        help="Ignore cached results, re-query the database and refresh the cache."
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help="Continue the last unfinished run of each report from its last committed chunk instead of starting over."
+    )
+    parser.add_argument(
+        '--capture-plans',
+        action='store_true',
+        help="Capture EXPLAIN (ANALYZE, BUFFERS) for one batch per report and database and flag changes against the previously stored plan. "
+             "ANALYZE executes the sampled batch query a second time, so that batch costs twice its DB time."
+    )
+    parser.add_argument(
+        '--extract-only',
+        action='store_true',
+        help="Dry run: query and transform every batch but never load the Google API stack or write to Sheets."
+    )
+    parser.add_argument(
+        '--daemon',
+        action='store_true',
+        help="Keep running and refresh each report on its own 'schedule', reusing DB connections and Sheets credentials between runs."
+    )
     args = parser.parse_args()
+    if args.daemon and (args.extract_only or args.resume):
+        parser.error("--daemon cannot be combined with --extract-only or --resume.")
 
     from .config.settings import load_config
-    from .connectors.postgres import PostgresConnector
-    from .connectors.sheets import GoogleSheetsClient
+    from .connectors.postgres import PostgresConnectionPool
+    from .connectors.sheets import GoogleSheetsClient, DryRunSheetsClient
     from .pipelines.report_pipeline import ReportPipeline
+    from .pipelines.shared_source import SharedSourcePipeline, group_shared_sources
+    from .pipelines.scheduler import ReportScheduler
+    from .pipelines.daemon import ReportDaemon
+    from .utils.metrics import metrics
+
+    app_config = None
+    report_results = {}
+    metrics_lock = threading.Lock()
+
+    def write_run_metrics():
+        # Ghi báo cáo chạy dạng JSON (và textfile Prometheus nếu cấu hình) để theo dõi theo thời gian
+        metrics_dir = app_config.metrics_dir or os.path.join(app_config.state_dir, 'metrics')
+        # Daemon ghi đè một file cố định thay vì sinh thêm file sau mỗi báo cáo
+        run_name = 'daemon_latest.json' if args.daemon else f"run_{time.strftime('%Y%m%d_%H%M%S')}.json"
+        run_file = os.path.join(metrics_dir, run_name)
+        with metrics_lock:
+            try:
+                metrics.write_json(run_file, reports=dict(report_results), extract_only=args.extract_only, daemon=args.daemon)
+                logger.info(f"Run metrics written to {run_file}")
+                if app_config.prometheus_textfile:
+                    metrics.write_prometheus(app_config.prometheus_textfile)
+            except OSError as e:
+                logger.warning(f"Could not write run metrics: {e}")
 
     try:
         # 2. Load configuration
         (app_config,
-         db_config,
+         db_configs,
          gs_config,
          all_report_configs) = load_config(args.config)
 
+        if args.no_cache:
+            app_config.result_cache = False
+        if args.refresh_cache:
+            app_config.refresh_cache = True
+        if args.resume:
+            app_config.resume = True
+            # Lần chạy tiếp cũng ghi nhật ký để có thể --resume lần nữa nếu lại lỗi
+            app_config.run_journal = True
+        if args.capture_plans:
+            app_config.capture_query_plans = True
+
         report_config_map = {rc.name: rc for rc in all_report_configs}
 
         # 3. Xác định thứ tự chạy và lọc các báo cáo cần chạy
         report_order = [
             'BRANCH_VPI_DOANHTHU',
+            'BRANCH_VPI_DOANHTHU_BSPHU1',
             'BRANCH_VPI_DUYETTHANHTOAN',
             'BRANCH_VPI_KHACHHANG'
         ]
@@ -74,31 +148,122 @@ def main():
             reports_to_process = [report_config_map[report_name] for report_name in report_order if report_name in report_config_map]
             logger.info(f"Running all configured reports in defined order: {[r.name for r in reports_to_process]}")
 
+        if args.daemon:
+            unscheduled = [r.name for r in reports_to_process if not r.schedule]
+            if unscheduled:
+                logger.warning(f"Daemon mode: reports without a 'schedule' are not run: {unscheduled}")
+            reports_to_process = [r for r in reports_to_process if r.schedule]
+
         if not reports_to_process:
             logger.warning("No reports selected or configured to run. Exiting.")
             return
 
-        # 4. Khởi tạo Google Sheets Client (dùng chung)
-        sheets_client = GoogleSheetsClient(gs_config)
+        # 4. Khởi tạo Google Sheets Client (dùng chung); import thư viện Google và xác thực hoãn tới lần gọi Sheets đầu tiên
+        if args.extract_only:
+            sheets_client = DryRunSheetsClient()
+            # Chạy thử không ghi gì lên sheet nên không được ghi đè nhật ký chạy
+            app_config.run_journal = False
+            for report_conf in reports_to_process:
+                if report_conf.incremental:
+                    # Trạng thái phân vùng phải khớp với sheet thật: chạy thử không được ghi đè nó
+                    logger.info(f"Extract-only mode: incremental state of '{report_conf.name}' is left untouched.")
+                    report_conf.incremental = False
+        else:
+            sheets_client = GoogleSheetsClient(gs_config)
 
-        # 5. Lặp qua từng báo cáo THEO THỨ TỰ ĐÃ XÁC ĐỊNH và chạy pipeline
-        for report_conf in reports_to_process:
+        # 5. Pool kết nối DB dùng chung cho mọi báo cáo (mỗi báo cáo: 1 kết nối chính + các worker trích xuất)
+        max_concurrent = min(app_config.max_concurrent_reports, len(reports_to_process))
+        # Báo cáo nhiều DB: kết nối chính vẫn giữ trong lúc truy vấn shard lấy thêm kết nối từ pool của từng chi nhánh
+        sharded = any(len(r.databases) > 1 for r in reports_to_process)
+        connections_per_report = app_config.extract_workers + 1 if app_config.extract_workers > 1 or sharded else 1
+        default_database = next(iter(db_configs))
+        used_databases = [name for name in db_configs
+                          if name == default_database or any(name in r.databases for r in reports_to_process)]
+
+        # Bảng TEMP của prelude được dựng một lần cho cả lần chạy và dùng chung giữa các báo cáo trên cùng kết nối.
+        # Daemon chạy lặp lại nên mỗi lượt báo cáo tự dựng lại (run_key = None) để không đọc dữ liệu cũ
+        run_key = None if args.daemon else uuid.uuid4().hex
+
+        def run_report(report_conf) -> bool:
             logger.info(f"===== Processing report: {report_conf.name} =====")
+            started = time.monotonic()
+            ok = False
+            if args.daemon:
+                # Metadata sheet chỉ đúng trong một lượt chạy: người dùng có thể sửa sheet giữa hai lượt
+                for spreadsheet_id in {r.spreadsheet_id for r in (report_conf.targets or [report_conf])}:
+                    sheets_client.metadata.invalidate(spreadsheet_id)
+            databases = report_conf.databases or [default_database]
+            db_pool = db_pools[databases[0]]
             try:
-                with PostgresConnector(db_config) as db_connector:
-                    pipeline = ReportPipeline(
-                        report_config=report_conf,
-                        app_config=app_config,
-                        db_connector=db_connector,
-                        sheets_client=sheets_client
-                    )
-                    pipeline.run()
+                with db_pool.connector() as db_connector:
+                    if report_conf.targets:
+                        pipeline = SharedSourcePipeline(
+                            report_config=report_conf,
+                            app_config=app_config,
+                            db_connector=db_connector,
+                            sheets_client=sheets_client,
+                            db_pool=db_pool,
+                            run_key=run_key
+                        )
+                    else:
+                        pipeline = ReportPipeline(
+                            report_config=report_conf,
+                            app_config=app_config,
+                            db_connector=db_connector,
+                            sheets_client=sheets_client,
+                            db_pool=db_pool,
+                            shard_pools=[db_pools[name] for name in databases] if len(databases) > 1 else None,
+                            run_key=run_key
+                        )
+                    ok = pipeline.run()
+                    return ok
             except Exception as e:
                 logger.error(f"Failed to process report '{report_conf.name}' due to a critical error: {e}", exc_info=True)
+                return False
+            finally:
+                elapsed = time.monotonic() - started
+                metrics.observe('report_seconds', elapsed, report=report_conf.name)
+                metrics.set('report_success', 1 if ok else 0, report=report_conf.name)
+                report_results[report_conf.name] = {'success': ok, 'seconds': round(elapsed, 3)}
+
+        # 6. Chạy các báo cáo theo thứ tự đã xác định, song song tối đa MaxConcurrentReports
+        validate_after_idle = 60.0 if args.daemon else None
+        with ExitStack() as stack:
+            # Mỗi DATABASE_* có báo cáo dùng tới được mở một pool riêng
+            db_pools = {
+                name: stack.enter_context(PostgresConnectionPool(db_configs[name], max_concurrent * connections_per_report, validate_after_idle=validate_after_idle))
+                for name in used_databases
+            }
+            startup_seconds = time.monotonic() - run_started
+            metrics.set('startup_seconds', startup_seconds)
+            logger.info(f"Startup finished in {startup_seconds:.2f}s.")
+            if args.daemon:
+                daemon = ReportDaemon(
+                    group_shared_sources(reports_to_process),
+                    max_concurrent,
+                    run_report,
+                    on_report_finished=lambda _: write_run_metrics()
+                )
+                # Ctrl+C / systemctl stop: chờ các báo cáo đang chạy xong rồi mới thoát
+                for signum in (signal.SIGINT, signal.SIGTERM):
+                    signal.signal(signum, lambda *_: daemon.stop())
+                logger.info(f"Daemon mode: scheduling {len(reports_to_process)} reports. Press Ctrl+C to stop.")
+                daemon.run()
+                results = {name: result['success'] for name, result in report_results.items()}
+            else:
+                results = ReportScheduler(max_concurrent).run(group_shared_sources(reports_to_process), run_report)
+
+        failed_reports = [name for name, ok in results.items() if not ok]
+        if failed_reports:
+            logger.warning(f"Reports finished with errors: {failed_reports}")
 
     except Exception as e:
         logger.critical(f"A fatal error occurred during initialization: {e}", exc_info=True)
 
+    # 7. Báo cáo chạy cuối cùng (daemon: trạng thái sau lượt gần nhất của từng báo cáo)
+    if app_config is not None:
+        write_run_metrics()
+
     logger.info("========== DATA PIPELINE RUN FINISHED ==========")
 
 if __name__ == "__main__":
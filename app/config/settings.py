@@ -2,15 +2,41 @@ import configparser
 import logging
 import os
 from dataclasses import dataclass, field
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 from configparser import ExtendedInterpolation
+from ..utils.sql import split_sql_prelude
+from ..utils.transform import parse_row_filter
+from ..utils.schedule import parse_schedule
 
 logger = logging.getLogger(__name__)
 
+EXTRACT_MODES = ['fetch', 'stream', 'copy']
+
 @dataclass
 class AppConfig:
     batch_days: int
     batch_rows: int
+    extract_workers: int = field(default=1)
+    extract_mode: str = field(default='fetch')
+    max_concurrent_reports: int = field(default=1)
+    max_payload_bytes: int = field(default=2_000_000)
+    state_dir: str = field(default='.state')
+    prepared_statements: bool = field(default=False)
+    result_cache: bool = field(default=False)
+    refresh_cache: bool = field(default=False)
+    cache_settle_days: int = field(default=3)
+    cache_ttl_hours: int = field(default=720)
+    cache_max_mb: int = field(default=512)
+    adaptive_batching: bool = field(default=False)
+    target_batch_rows: int = field(default=50_000)
+    target_batch_seconds: float = field(default=60.0)
+    max_batch_days: int = field(default=31)
+    prefetch_batches: int = field(default=0)
+    metrics_dir: str = field(default='')
+    run_journal: bool = field(default=False)
+    resume: bool = field(default=False)
+    prometheus_textfile: str = field(default='')
+    capture_query_plans: bool = field(default=False)
 
 @dataclass
 class DatabaseConfig:
@@ -19,12 +45,29 @@ class DatabaseConfig:
     dbname: str
     user: str
     password: str
+    name: str = field(default='DATABASE_VPI')
+    # Mã chi nhánh ghi vào cột đầu của mỗi dòng khi báo cáo trích xuất từ nhiều DATABASE_*
+    branch: str = field(default='VPI')
 
 @dataclass
 class GoogleSheetsConfig:
     token_file: str
     client_secret_file: str
     scopes: List[str]
+    read_requests_per_minute: int = field(default=60)
+    write_requests_per_minute: int = field(default=60)
+    project_read_requests_per_minute: int = field(default=300)
+    project_write_requests_per_minute: int = field(default=300)
+    quota_utilization: float = field(default=0.9)
+    discovery_cache_file: str = field(default='')
+
+@dataclass
+class SourceConfig:
+    name: str
+    sql_query: str
+    date_range_strategy: str
+    extract_mode: str = field(default='fetch')
+    sql_prelude: Optional[str] = field(default=None)
 
 @dataclass
 class ReportConfig:
@@ -37,8 +80,53 @@ class ReportConfig:
     load_strategy: str = field(default='overwrite')
     clear_end_column: Optional[str] = field(default=None)
     clear_method: str = field(default='clear_content')
+    extract_mode: str = field(default='fetch')
+    depends_on: List[str] = field(default_factory=list)
+    write_method: str = field(default='append')
+    overwrite_method: str = field(default='clear_first')
+    value_encoding: str = field(default='user_entered')
+    schedule: Optional[str] = field(default=None)
+    incremental: bool = field(default=False)
+    partition_column: Optional[str] = field(default=None)
+    sql_prelude: Optional[str] = field(default=None)
+    source: Optional[SourceConfig] = field(default=None)
+    columns: List[str] = field(default_factory=list)
+    row_filter: Optional[str] = field(default=None)
+    # Các mục DATABASE_* cần truy vấn (rỗng = DB mặc định); từ 2 mục trở lên là trích xuất theo shard
+    databases: List[str] = field(default_factory=list)
+    shard_order_by: List[str] = field(default_factory=list)
+    # Chỉ dùng cho job gộp của một SOURCE_*: các báo cáo đích dùng chung kết quả trích xuất
+    targets: List['ReportConfig'] = field(default_factory=list)
 
-def load_config(path: str) -> Tuple[AppConfig, DatabaseConfig, GoogleSheetsConfig, List[ReportConfig]]:
+def _read_sql_file(sql_file_path: str, section_name: str) -> Tuple[Optional[str], str]:
+    if not os.path.isabs(sql_file_path):
+         project_root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+         sql_file_path = os.path.join(project_root, sql_file_path)
+    if not os.path.exists(sql_file_path):
+         logger.error(f"SQL file path does not exist: '{sql_file_path}' for report '{section_name}'. Check config.ini.")
+         raise FileNotFoundError(f"SQL file not found at {sql_file_path}")
+    with open(sql_file_path, 'r', encoding='utf-8') as f:
+        sql_prelude, sql_query = split_sql_prelude(f.read())
+    if sql_prelude and 'scan_placeholder' in sql_prelude:
+        logger.warning(f"SQL prelude of report '{section_name}' contains date placeholders; preludes run once per session and are never date-filtered.")
+    return sql_prelude, sql_query
+
+def _load_database(config: configparser.ConfigParser, section_name: str) -> DatabaseConfig:
+    db_conf = config[section_name]
+    db_password = db_conf.get('password')
+    if not db_password:
+        raise ValueError(f"Database password ('password' in [{section_name}]) is not set.")
+    return DatabaseConfig(
+        host=db_conf['host'],
+        port=db_conf.getint('port', 5432),
+        dbname=db_conf['dbname'],
+        user=db_conf['user'],
+        password=db_password,
+        name=section_name,
+        branch=db_conf.get('branch', section_name[len('DATABASE_'):])
+    )
+
+def load_config(path: str) -> Tuple[AppConfig, Dict[str, DatabaseConfig], GoogleSheetsConfig, List[ReportConfig]]:
     if not os.path.exists(path):
         logger.error(f"Configuration file not found at: {path}")
         raise FileNotFoundError(f"config.ini not found at {path}")
@@ -51,32 +139,92 @@ def load_config(path: str) -> Tuple[AppConfig, DatabaseConfig, GoogleSheetsConfi
 
     # Load App config
     app_conf = config['APP']
+    default_extract_mode = app_conf.get('ExtractMode', 'fetch').lower()
+    if default_extract_mode not in EXTRACT_MODES:
+        logger.warning(f"Invalid ExtractMode '{default_extract_mode}' in [APP]. Defaulting to 'fetch'.")
+        default_extract_mode = 'fetch'
     app_config = AppConfig(
         batch_days=app_conf.getint('BatchDays', 5),
-        batch_rows=app_conf.getint('BatchRows', 1000)
+        batch_rows=app_conf.getint('BatchRows', 1000),
+        extract_workers=max(1, app_conf.getint('ExtractWorkers', 1)),
+        extract_mode=default_extract_mode,
+        max_concurrent_reports=max(1, app_conf.getint('MaxConcurrentReports', 1)),
+        max_payload_bytes=app_conf.getint('MaxPayloadBytes', 2_000_000),
+        state_dir=app_conf.get('StateDir', '.state'),
+        prepared_statements=app_conf.getboolean('PreparedStatements', False),
+        result_cache=app_conf.getboolean('ResultCache', False),
+        cache_settle_days=max(0, app_conf.getint('CacheSettleDays', 3)),
+        cache_ttl_hours=max(1, app_conf.getint('CacheTtlHours', 720)),
+        cache_max_mb=max(1, app_conf.getint('CacheMaxMB', 512)),
+        adaptive_batching=app_conf.getboolean('AdaptiveBatching', False),
+        target_batch_rows=max(1, app_conf.getint('TargetBatchRows', 50_000)),
+        target_batch_seconds=max(1.0, app_conf.getfloat('TargetBatchSeconds', 60.0)),
+        max_batch_days=max(1, app_conf.getint('MaxBatchDays', 31)),
+        prefetch_batches=max(0, app_conf.getint('PrefetchBatches', 0)),
+        metrics_dir=app_conf.get('MetricsDir', ''),
+        run_journal=app_conf.getboolean('RunJournal', False),
+        prometheus_textfile=app_conf.get('PrometheusTextfile', ''),
+        capture_query_plans=app_conf.getboolean('CaptureQueryPlans', False)
     )
 
-    # Load Database config
-    db_conf = config['DATABASE_VPI']
-    db_password = db_conf.get('password')
-    if not db_password:
-        logger.error("DB_PASS is not set in environment variables or .env file.")
-        raise ValueError("Database password ('password' in config, maps to DB_PASS env var) is not set.")
-    db_config = DatabaseConfig(
-        host=db_conf['host'],
-        port=db_conf.getint('port', 5432),
-        dbname=db_conf['dbname'],
-        user=db_conf['user'],
-        password=db_password
-    )
+    # Load Database configs: DATABASE_VPI (hoặc mục DATABASE_* đầu tiên) là DB mặc định, các mục khác là DB của chi nhánh khác
+    db_sections = [s for s in config.sections() if s.startswith('DATABASE_')]
+    if 'DATABASE_VPI' in db_sections:
+        db_sections.remove('DATABASE_VPI')
+        db_sections.insert(0, 'DATABASE_VPI')
+    db_configs: Dict[str, DatabaseConfig] = {}
+    for section_name in db_sections:
+        try:
+            db_configs[section_name] = _load_database(config, section_name)
+        except (ValueError, KeyError) as e:
+            # DB mặc định bắt buộc phải hợp lệ; DB chi nhánh lỗi chỉ làm các báo cáo dùng nó bị bỏ qua
+            if not db_configs:
+                logger.error(f"Invalid default database section '{section_name}' (is DB_PASS set in the environment or .env file?): {e}")
+                raise
+            logger.error(f"Skipping database '{section_name}': {e}")
+    if not db_configs:
+        raise ValueError("No valid [DATABASE_...] section found in config.")
+    default_database = next(iter(db_configs))
 
     # Load Google Sheets config
     gs_conf = config['GOOGLE_SHEETS']
     google_sheets_config = GoogleSheetsConfig(
         token_file=gs_conf['token_file'],
         client_secret_file=gs_conf['client_secret_file'],
-        scopes=[gs_conf['scopes']]
+        scopes=[gs_conf['scopes']],
+        read_requests_per_minute=max(1, gs_conf.getint('read_requests_per_minute', 60)),
+        write_requests_per_minute=max(1, gs_conf.getint('write_requests_per_minute', 60)),
+        project_read_requests_per_minute=max(1, gs_conf.getint('project_read_requests_per_minute', 300)),
+        project_write_requests_per_minute=max(1, gs_conf.getint('project_write_requests_per_minute', 300)),
+        quota_utilization=gs_conf.getfloat('quota_utilization', 0.9),
+        discovery_cache_file=gs_conf.get('discovery_cache_file', os.path.join(app_config.state_dir, 'sheets_v4_discovery.json'))
     )
+    if not 0 < google_sheets_config.quota_utilization < 1:
+        logger.warning(f"Invalid quota_utilization '{google_sheets_config.quota_utilization}' in [GOOGLE_SHEETS]. Defaulting to 0.9.")
+        google_sheets_config.quota_utilization = 0.9
+
+    # Load shared sources: một câu SQL trích xuất một lần cho mỗi lô ngày, nhiều BRANCH_* dùng chung
+    source_configs = {}
+    source_sections = [s for s in config.sections() if s.startswith('SOURCE_')]
+    for section_name in source_sections:
+        source_conf = config[section_name]
+        try:
+            sql_prelude, sql_query = _read_sql_file(source_conf['sql_file_path'], section_name)
+            extract_mode = source_conf.get('extract_mode', app_config.extract_mode).lower()
+            if extract_mode not in EXTRACT_MODES:
+                logger.warning(f"Invalid extract_mode '{extract_mode}' for source '{section_name}'. Defaulting to '{app_config.extract_mode}'.")
+                extract_mode = app_config.extract_mode
+            source_configs[section_name] = SourceConfig(
+                name=section_name,
+                sql_query=sql_query,
+                date_range_strategy=source_conf.get('date_range_strategy', 'month_to_date'),
+                extract_mode=extract_mode,
+                sql_prelude=sql_prelude
+            )
+        except FileNotFoundError as e:
+            logger.error(f"Skipping source '{section_name}': {e}")
+        except KeyError as e:
+            logger.error(f"Missing configuration key {e} in section '{section_name}'. Skipping.")
 
     # Load all Report configs (Branches)
     report_configs = []
@@ -84,15 +232,15 @@ def load_config(path: str) -> Tuple[AppConfig, DatabaseConfig, GoogleSheetsConfi
     for section_name in branch_sections:
         branch_config = config[section_name]
         try:
-            sql_file_path = branch_config['sql_file_path']
-            if not os.path.isabs(sql_file_path):
-                 project_root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-                 sql_file_path = os.path.join(project_root, sql_file_path)
-            if not os.path.exists(sql_file_path):
-                 logger.error(f"SQL file path does not exist: '{sql_file_path}' for report '{section_name}'. Check config.ini.")
-                 raise FileNotFoundError(f"SQL file not found at {sql_file_path}")
-            with open(sql_file_path, 'r', encoding='utf-8') as f:
-                sql_query = f.read()
+            source = None
+            source_name = branch_config.get('source', None)
+            if source_name:
+                source = source_configs.get(source_name.strip().upper())
+                if source is None:
+                    raise KeyError(f"source '{source_name}' (no valid [SOURCE_...] section with that name)")
+                sql_prelude, sql_query = source.sql_prelude, source.sql_query
+            else:
+                sql_prelude, sql_query = _read_sql_file(branch_config['sql_file_path'], section_name)
 
             load_strategy = branch_config.get('load_strategy', 'overwrite').lower()
             if load_strategy not in ['overwrite', 'append']:
@@ -107,25 +255,116 @@ def load_config(path: str) -> Tuple[AppConfig, DatabaseConfig, GoogleSheetsConfi
                  logger.warning(f"Invalid clear_method '{clear_method}' for report '{section_name}'. Defaulting to 'clear_content'.")
                  clear_method = 'clear_content'
 
+            extract_mode = branch_config.get('extract_mode', app_config.extract_mode).lower()
+            if extract_mode not in EXTRACT_MODES:
+                logger.warning(f"Invalid extract_mode '{extract_mode}' for report '{section_name}'. Defaulting to '{app_config.extract_mode}'.")
+                extract_mode = app_config.extract_mode
+
+            date_range_strategy = branch_config.get('date_range_strategy', 'month_to_date')
+            if source is not None:
+                # Khoảng ngày và cách trích xuất do nguồn chung quyết định
+                if 'date_range_strategy' in branch_config and date_range_strategy != source.date_range_strategy:
+                    logger.warning(f"Report '{section_name}' reads from {source.name}; using its date_range_strategy '{source.date_range_strategy}'.")
+                date_range_strategy = source.date_range_strategy
+                extract_mode = source.extract_mode
+
+            columns_value = branch_config.get('columns', '')
+            columns = [c.strip() for c in columns_value.split(',') if c.strip()]
+            row_filter = branch_config.get('row_filter', '').strip() or None
+            if (columns or row_filter) and source is None:
+                logger.warning(f"Report '{section_name}': columns / row_filter only apply to reports with a source. Ignoring them.")
+                columns, row_filter = [], None
+            if row_filter:
+                parse_row_filter(row_filter)
+
+            write_method = branch_config.get('write_method', 'append').lower()
+            if write_method not in ['append', 'batch_update']:
+                logger.warning(f"Invalid write_method '{write_method}' for report '{section_name}'. Defaulting to 'append'.")
+                write_method = 'append'
+
+            overwrite_method = branch_config.get('overwrite_method', 'clear_first').lower()
+            if overwrite_method not in ['clear_first', 'write_then_trim', 'shadow_swap']:
+                logger.warning(f"Invalid overwrite_method '{overwrite_method}' for report '{section_name}'. Defaulting to 'clear_first'.")
+                overwrite_method = 'clear_first'
+
+            value_encoding = branch_config.get('value_encoding', 'user_entered').lower()
+            if value_encoding not in ['user_entered', 'typed']:
+                logger.warning(f"Invalid value_encoding '{value_encoding}' for report '{section_name}'. Defaulting to 'user_entered'.")
+                value_encoding = 'user_entered'
+            if value_encoding == 'typed' and source is not None:
+                # row_filter so sánh trên dòng đã chuyển đổi chung của nguồn (ngày dạng text)
+                logger.warning(f"Report '{section_name}': value_encoding = typed is not supported for reports with a shared source. Using 'user_entered'.")
+                value_encoding = 'user_entered'
+
+            incremental = branch_config.getboolean('incremental', False)
+            partition_column_value = branch_config.get('partition_column', None)
+            partition_column = partition_column_value.upper() if partition_column_value else None
+            if incremental and (load_strategy != 'overwrite' or not partition_column):
+                logger.warning(f"Report '{section_name}': incremental mode requires load_strategy = overwrite and a partition_column. Disabling it.")
+                incremental = False
+            if incremental and source is not None:
+                logger.warning(f"Report '{section_name}': incremental mode is not supported for reports with a shared source. Disabling it.")
+                incremental = False
+
+            databases_value = branch_config.get('databases', '')
+            databases = [d.strip().upper() for d in databases_value.split(',') if d.strip()]
+            unknown = [d for d in databases if d not in db_configs]
+            if unknown:
+                raise KeyError(f"databases {unknown} (no valid [DATABASE_...] section with that name)")
+            if databases and source is not None:
+                logger.warning(f"Report '{section_name}': databases only apply to reports without a source; {source.name} reads from {default_database}. Ignoring them.")
+                databases = []
+            shard_order_by_value = branch_config.get('shard_order_by', '')
+            shard_order_by = [c.strip() for c in shard_order_by_value.split(',') if c.strip()]
+            if len(databases) > 1 and extract_mode != 'fetch':
+                # Các shard được gộp theo từng lô ngày nên cần kết quả đầy đủ của mỗi lô
+                logger.warning(f"Report '{section_name}': extract_mode '{extract_mode}' is not supported across several databases. Using 'fetch'.")
+                extract_mode = 'fetch'
+            if shard_order_by and len(databases) < 2:
+                logger.warning(f"Report '{section_name}': shard_order_by only applies to reports with several databases. Ignoring it.")
+                shard_order_by = []
+
+            # Lịch chạy cho --daemon; kiểm tra cú pháp ngay khi đọc cấu hình
+            schedule = branch_config.get('schedule', '').strip() or None
+            if schedule:
+                parse_schedule(schedule)
+
+            depends_on_value = branch_config.get('depends_on', '')
+            depends_on = [d.strip() for d in depends_on_value.split(',') if d.strip()]
+
             report = ReportConfig(
                 name=section_name,
                 sql_query=sql_query,
                 spreadsheet_id=branch_config['spreadsheet_id'],
                 sheet_name=branch_config['sheet_name'],
                 update_column_letter=branch_config['update_column_letter'],
-                date_range_strategy=branch_config.get('date_range_strategy', 'month_to_date'),
+                date_range_strategy=date_range_strategy,
                 load_strategy=load_strategy,
                 clear_end_column=clear_end_column_upper,
-                clear_method=clear_method
+                clear_method=clear_method,
+                extract_mode=extract_mode,
+                depends_on=depends_on,
+                write_method=write_method,
+                overwrite_method=overwrite_method,
+                value_encoding=value_encoding,
+                incremental=incremental,
+                partition_column=partition_column,
+                sql_prelude=sql_prelude,
+                source=source,
+                columns=columns,
+                row_filter=row_filter,
+                schedule=schedule,
+                databases=databases,
+                shard_order_by=shard_order_by
             )
             report_configs.append(report)
-        except FileNotFoundError as e:
+        except (FileNotFoundError, ValueError) as e:
             logger.error(f"Skipping report '{section_name}': {e}")
         except KeyError as e:
             logger.error(f"Missing configuration key {e} in section '{section_name}'. Skipping.")
         except Exception as e:
             logger.error(f"Error loading config for report '{section_name}': {e}", exc_info=True)
 
-    log_report_info = [f'{r.name}(load={r.load_strategy}, clear={r.clear_method}, end_col={r.clear_end_column or "Default"})' for r in report_configs]
+    log_report_info = [f'{r.name}(load={r.load_strategy}, clear={r.clear_method}, end_col={r.clear_end_column or "Default"}, extract={r.extract_mode}, write={r.write_method}, values={r.value_encoding}, db={",".join(r.databases) or default_database})' for r in report_configs]
     logger.info(f"Loaded {len(report_configs)} reports: {log_report_info}")
-    return app_config, db_config, google_sheets_config, report_configs
\ No newline at end of file
+    return app_config, db_configs, google_sheets_config, report_configs
\ No newline at end of file
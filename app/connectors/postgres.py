@@ -1,26 +1,139 @@
+import os
+import csv
 import psycopg2
+import psycopg2.pool
+import psycopg2.errors
+import psycopg2.extensions
 import logging
-from typing import Tuple, List
+import time
+import threading
+import uuid
+import weakref
+from typing import Any, Dict, Tuple, List, Optional, Iterator, Sequence
 from ..config.settings import DatabaseConfig
+from ..utils.metrics import metrics
+from ..utils.sql import prelude_tables
 
 logger = logging.getLogger(__name__)
 
-class PostgresConnector:
-    def __init__(self, config: DatabaseConfig):
+# Bảng TEMP đang có hiệu lực trên từng phiên DB (theo đối tượng connection): tên bảng -> "<run>:<dấu vân tay>"
+_SESSION_PRELUDES = weakref.WeakKeyDictionary()
+# Tên các prepared statement đã PREPARE trên từng phiên DB
+_SESSION_STATEMENTS = weakref.WeakKeyDictionary()
+
+def _estimate_bytes(rows: Sequence[tuple], sample_size: int = 20) -> int:
+    # psycopg2 không cho biết số byte đã nhận: ước lượng từ độ dài text của vài dòng mẫu
+    if not rows:
+        return 0
+    step = max(1, len(rows) // sample_size)
+    sample = rows[::step][:sample_size]
+    sample_bytes = sum(len(str(value)) for row in sample for value in row if value is not None)
+    return int(sample_bytes / len(sample) * len(rows))
+
+def _record_fetch(kind: str, seconds: float, rows: int, byte_count: int):
+    metrics.observe('db_query_seconds', seconds, kind=kind)
+    metrics.inc('db_rows_fetched', rows, kind=kind)
+    metrics.inc('db_bytes_fetched', byte_count, kind=kind)
+
+class PostgresConnectionPool:
+    def __init__(self, config: DatabaseConfig, max_connections: int, validate_after_idle: Optional[float] = None):
         self.config = config
-        self._connection = None
-        self._cursor = None
-        logger.debug(f"PostgresConnector initialized for db: {config.dbname}")
+        self.max_connections = max(1, max_connections)
+        self._pool = None
+        # --daemon: kết nối nằm lâu trong pool có thể đã bị server/firewall cắt, kiểm tra bằng SELECT 1 trước khi dùng lại
+        self.validate_after_idle = validate_after_idle
+        self._returned_at: Dict[int, float] = {}
+        # ThreadedConnectionPool raise PoolError khi hết kết nối, semaphore giúp các luồng chờ thay vì lỗi
+        self._slots = threading.BoundedSemaphore(self.max_connections)
 
     def __enter__(self):
         try:
-            self._connection = psycopg2.connect(
+            self._pool = psycopg2.pool.ThreadedConnectionPool(
+                1,
+                self.max_connections,
                 host=self.config.host,
                 port=self.config.port,
                 dbname=self.config.dbname,
                 user=self.config.user,
                 password=self.config.password
             )
+            logger.info(f"DB connection pool (max {self.max_connections}) opened to {self.config.host}.")
+            return self
+        except psycopg2.Error as e:
+            logger.error(f"Failed to open connection pool to {self.config.dbname} at {self.config.host}: {e}")
+            raise
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._pool:
+            self._pool.closeall()
+            self._pool = None
+        logger.debug(f"DB connection pool to {self.config.host} closed.")
+
+    def connector(self) -> 'PostgresConnector':
+        return PostgresConnector(self.config, pool=self)
+
+    def getconn(self):
+        if not self._pool:
+            raise ConnectionError("Connection pool is not open. Use 'with' statement.")
+        self._slots.acquire()
+        try:
+            connection = self._pool.getconn()
+            if self.validate_after_idle is not None and not self._is_alive(connection):
+                logger.info(f"Discarding a stale pooled connection to {self.config.host}.")
+                self._pool.putconn(connection, close=True)
+                connection = self._pool.getconn()
+            return connection
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _is_alive(self, connection) -> bool:
+        returned_at = self._returned_at.pop(id(connection), None)
+        if connection.closed:
+            return False
+        if returned_at is None or time.monotonic() - returned_at < self.validate_after_idle:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def putconn(self, connection, close: bool = False):
+        try:
+            if self._pool:
+                if close:
+                    self._returned_at.pop(id(connection), None)
+                else:
+                    self._returned_at[id(connection)] = time.monotonic()
+                self._pool.putconn(connection, close=close)
+        finally:
+            self._slots.release()
+
+class PostgresConnector:
+    def __init__(self, config: DatabaseConfig, pool: Optional[PostgresConnectionPool] = None):
+        self.config = config
+        self._pool = pool
+        self._connection = None
+        self._cursor = None
+        # type_code (OID) của từng cột trong kết quả truy vấn gần nhất
+        self.column_types: Optional[List[int]] = None
+        logger.debug(f"PostgresConnector initialized for db: {config.dbname}")
+
+    def __enter__(self):
+        try:
+            if self._pool:
+                self._connection = self._pool.getconn()
+            else:
+                self._connection = psycopg2.connect(
+                    host=self.config.host,
+                    port=self.config.port,
+                    dbname=self.config.dbname,
+                    user=self.config.user,
+                    password=self.config.password
+                )
             self._cursor = self._connection.cursor()
             logger.debug(f"DB connection established to {self.config.host}.")
             return self
@@ -31,21 +144,251 @@ class PostgresConnector:
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self._cursor:
             self._cursor.close()
+            self._cursor = None
         if self._connection:
-            self._connection.close()
-        logger.debug(f"DB connection to {self.config.host} closed.")
+            if self._pool:
+                self._pool.putconn(self._connection, close=bool(self._connection.closed))
+                logger.debug(f"DB connection to {self.config.host} returned to pool.")
+            else:
+                self._connection.close()
+                logger.debug(f"DB connection to {self.config.host} closed.")
+            self._connection = None
 
     def execute_query(self, query: str) -> Tuple[List[tuple], int]:
         if not self._connection or not self._cursor:
             raise ConnectionError("Database connection is not open. Use 'with' statement.")
 
         try:
+            started = time.monotonic()
             self._cursor.execute(query)
             result = self._cursor.fetchall()
+            _record_fetch('query', time.monotonic() - started, len(result), _estimate_bytes(result))
             num_columns = len(self._cursor.description) if self._cursor.description else 0
+            self.column_types = self._column_types(self._cursor)
             logger.debug(f"Query returned {len(result)} rows and {num_columns} columns.")
             return result, num_columns
         except psycopg2.Error as e:
             logger.error(f"Error executing SQL query: {e}", exc_info=True)
             self._connection.rollback()
-            raise
\ No newline at end of file
+            raise
+
+    def describe(self, query: str) -> List[str]:
+        if not self._connection or not self._cursor:
+            raise ConnectionError("Database connection is not open. Use 'with' statement.")
+
+        # LIMIT 0: planner dựng kế hoạch nhưng không trả dòng nào, chỉ lấy tên và kiểu cột
+        query = query.strip().rstrip(';')
+        try:
+            self._cursor.execute(f"SELECT * FROM ({query}\n) AS etl_describe_source LIMIT 0")
+            self.column_types = self._column_types(self._cursor)
+            return [column.name for column in self._cursor.description]
+        except psycopg2.Error as e:
+            logger.error(f"Error describing SQL query: {e}", exc_info=True)
+            self._connection.rollback()
+            raise
+
+    def explain(self, statement: str, params: Optional[Sequence] = None) -> Any:
+        if not self._connection or not self._cursor:
+            raise ConnectionError("Database connection is not open. Use 'with' statement.")
+
+        # ANALYZE chạy thật câu truy vấn (kết quả bị bỏ đi) để có thời gian và số block thực tế của từng nút.
+        # Bọc trong savepoint: lỗi chỉ hủy phần EXPLAIN, không rollback cả phiên đang dùng chung với pipeline
+        try:
+            self._cursor.execute("SAVEPOINT etl_explain")
+            with metrics.timer('db_explain_seconds'):
+                self._cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}", params)
+                plan = self._cursor.fetchone()[0]
+            self._cursor.execute("RELEASE SAVEPOINT etl_explain")
+            return plan
+        except psycopg2.Error as e:
+            logger.error(f"Error capturing query plan: {e}")
+            try:
+                self._cursor.execute("ROLLBACK TO SAVEPOINT etl_explain")
+            except psycopg2.Error:
+                self._connection.rollback()
+            raise
+
+    @staticmethod
+    def _column_types(cursor) -> Optional[List[int]]:
+        if not cursor.description:
+            return None
+        return [column.type_code for column in cursor.description]
+
+    def prepare(self, name: str, sql: str) -> bool:
+        if not self._connection or not self._cursor:
+            raise ConnectionError("Database connection is not open. Use 'with' statement.")
+        prepared = _SESSION_STATEMENTS.setdefault(self._connection, set())
+        if name in prepared:
+            return False
+
+        try:
+            with metrics.timer('db_prepare_seconds'):
+                self._cursor.execute(f"PREPARE {name} AS {sql}")
+            logger.debug(f"Prepared statement '{name}' on backend PID {self._connection.get_backend_pid()}.")
+        except psycopg2.errors.DuplicatePreparedStatement:
+            # Tên được băm từ nội dung SQL nên statement đã có sẵn chính là câu lệnh này
+            self._connection.rollback()
+        except psycopg2.Error as e:
+            logger.error(f"Error preparing statement '{name}': {e}")
+            self._connection.rollback()
+            raise
+        prepared.add(name)
+        return True
+
+    def execute_prepared(self, name: str, sql: str, params: Sequence) -> Tuple[List[tuple], int]:
+        if not self._connection or not self._cursor:
+            raise ConnectionError("Database connection is not open. Use 'with' statement.")
+
+        placeholders = ', '.join(['%s'] * len(params))
+        execute_sql = f"EXECUTE {name} ({placeholders})" if params else f"EXECUTE {name}"
+        try:
+            self.prepare(name, sql)
+            started = time.monotonic()
+            try:
+                self._cursor.execute(execute_sql, params)
+            except psycopg2.errors.InvalidSqlStatementName:
+                # Phiên đã mất statement (DISCARD ALL, ...): PREPARE lại một lần
+                self._connection.rollback()
+                _SESSION_STATEMENTS[self._connection].discard(name)
+                self.prepare(name, sql)
+                self._cursor.execute(execute_sql, params)
+            result = self._cursor.fetchall()
+            _record_fetch('prepared', time.monotonic() - started, len(result), _estimate_bytes(result))
+            num_columns = len(self._cursor.description) if self._cursor.description else 0
+            self.column_types = self._column_types(self._cursor)
+            logger.debug(f"Prepared statement '{name}' returned {len(result)} rows and {num_columns} columns.")
+            return result, num_columns
+        except psycopg2.Error as e:
+            logger.error(f"Error executing prepared statement '{name}': {e}", exc_info=True)
+            self._connection.rollback()
+            raise
+
+    def run_prelude(self, run_key: str, sql: str) -> bool:
+        # Bỏ qua khi mọi bảng TEMP của prelude đã được dựng trong cùng lần chạy (run_key) với đúng định nghĩa,
+        # kể cả khi do báo cáo khác dựng: kết nối chuyển qua lại giữa các báo cáo không phải quét lại tb_treatment
+        if not self._connection or not self._cursor:
+            raise ConnectionError("Database connection is not open. Use 'with' statement.")
+        wanted = {table: f"{run_key}:{fingerprint}" for table, fingerprint in prelude_tables(sql).items()}
+        built = _SESSION_PRELUDES.setdefault(self._connection, {})
+        if all(built.get(table) == state for table, state in wanted.items()):
+            return False
+
+        try:
+            with metrics.timer('db_prelude_seconds'):
+                self._cursor.execute(sql)
+            # Commit để bảng TEMP tồn tại qua các lần rollback/trả kết nối về pool
+            self._connection.commit()
+            built.update(wanted)
+            logger.debug(f"Prelude for run '{run_key}' ({', '.join(wanted)}) executed on backend PID {self._connection.get_backend_pid()}.")
+            return True
+        except psycopg2.Error as e:
+            logger.error(f"Error executing SQL prelude for run '{run_key}': {e}", exc_info=True)
+            self._connection.rollback()
+            _SESSION_PRELUDES.pop(self._connection, None)
+            raise
+
+    def iter_query(self, query: str, fetch_size: int) -> Iterator[tuple]:
+        if not self._connection:
+            raise ConnectionError("Database connection is not open. Use 'with' statement.")
+
+        # Named cursor = server-side cursor, chỉ giữ tối đa `fetch_size` dòng trong bộ nhớ
+        cursor = self._connection.cursor(name=f"etl_stream_{uuid.uuid4().hex[:12]}")
+        cursor.itersize = fetch_size
+        total_rows = 0
+        total_bytes = 0
+        # Chỉ tính thời gian chờ DB, không tính thời gian phía tiêu thụ (ghi Sheets)
+        db_seconds = 0.0
+        try:
+            started = time.monotonic()
+            cursor.execute(query)
+            db_seconds += time.monotonic() - started
+            while True:
+                started = time.monotonic()
+                rows = cursor.fetchmany(fetch_size)
+                db_seconds += time.monotonic() - started
+                if self.column_types is None or total_rows == 0:
+                    self.column_types = self._column_types(cursor)
+                if not rows:
+                    break
+                total_rows += len(rows)
+                total_bytes += _estimate_bytes(rows)
+                yield from rows
+            _record_fetch('stream', db_seconds, total_rows, total_bytes)
+            logger.debug(f"Streamed query returned {total_rows} rows.")
+        except psycopg2.Error as e:
+            logger.error(f"Error streaming SQL query after {total_rows} rows: {e}", exc_info=True)
+            self._connection.rollback()
+            raise
+        finally:
+            if not cursor.closed and not self._connection.closed:
+                try:
+                    cursor.close()
+                except psycopg2.Error:
+                    pass
+
+    def iter_copy(self, query: str) -> Iterator[List[str]]:
+        if not self._connection:
+            raise ConnectionError("Database connection is not open. Use 'with' statement.")
+
+        # Xuống dòng trước ')' phòng khi câu SQL kết thúc bằng comment '--'
+        query = query.strip().rstrip(';')
+        cursor = self._connection.cursor()
+        try:
+            # Lấy kiểu cột (không trả dòng nào) để chuyển đổi text ở phía pipeline
+            cursor.execute(f"SELECT * FROM ({query}\n) AS etl_copy_source LIMIT 0")
+            self.column_types = self._column_types(cursor)
+            cursor.execute("SET LOCAL DateStyle = 'ISO, YMD'")
+        except psycopg2.Error as e:
+            logger.error(f"Error preparing COPY extraction: {e}", exc_info=True)
+            cursor.close()
+            self._connection.rollback()
+            raise
+
+        # COPY ghi vào đầu ghi của pipe trong luồng nền, csv.reader đọc đầu kia: không dựng date/Decimal theo từng ô
+        read_fd, write_fd = os.pipe()
+        encoding = psycopg2.extensions.encodings.get(self._connection.encoding, 'utf-8')
+        reader = os.fdopen(read_fd, 'r', encoding=encoding, newline='')
+        writer = os.fdopen(write_fd, 'wb')
+        copy_errors = []
+        copied = {'bytes': 0, 'seconds': 0.0}
+
+        class _CountingWriter:
+            def write(self, data):
+                copied['bytes'] += len(data)
+                return writer.write(data)
+
+        def _copy():
+            started = time.monotonic()
+            try:
+                cursor.copy_expert(f"COPY ({query}\n) TO STDOUT WITH (FORMAT csv)", _CountingWriter())
+            except (psycopg2.Error, OSError) as e:
+                copy_errors.append(e)
+            finally:
+                copied['seconds'] = time.monotonic() - started
+                try:
+                    writer.close()
+                except OSError:
+                    pass
+
+        copy_thread = threading.Thread(target=_copy, name=f"etl-copy-{uuid.uuid4().hex[:8]}", daemon=True)
+        copy_thread.start()
+        total_rows = 0
+        completed = False
+        try:
+            for row in csv.reader(reader):
+                total_rows += 1
+                yield row
+            completed = True
+        finally:
+            reader.close()
+            copy_thread.join()
+            cursor.close()
+            if copy_errors:
+                if completed:
+                    logger.error(f"Error in COPY extraction after {total_rows} rows: {copy_errors[0]}")
+                self._connection.rollback()
+        if copy_errors:
+            raise copy_errors[0]
+        # Thời gian COPY gồm cả lúc chờ pipe khi phía ghi Sheets chậm hơn
+        _record_fetch('copy', copied['seconds'], total_rows, copied['bytes'])
+        logger.debug(f"COPY query returned {total_rows} rows.")
@@ -1,19 +1,62 @@
 import os
+import re
+import copy
+import json
 import time
 import random
 import logging
-from typing import List, Any, Callable, Optional
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+import threading
+from typing import List, Any, Callable, Optional, Dict, Tuple
 from ..config.settings import GoogleSheetsConfig
+from ..utils.helpers import number_to_column, column_to_number
+from ..utils.rate_limit import SheetsQuotaScheduler
+from ..utils.metrics import metrics
 from socket import gaierror
 from http.client import HTTPException
 
 logger = logging.getLogger(__name__)
 
+# Thư viện Google (google-auth, googleapiclient: ~0.3s import) chỉ được import khi thực sự gọi Sheets lần đầu
+DISCOVERY_URL = 'https://sheets.googleapis.com/$discovery/rest?version=v4'
+DISCOVERY_CACHE_MAX_AGE = 7 * 24 * 3600
+# Giới hạn số ô (tổng rowCount * columnCount của mọi tab) của một spreadsheet
+SPREADSHEET_CELL_LIMIT = 10_000_000
+_discovery_lock = threading.Lock()
+_discovery_document: Optional[str] = None
+
+def _load_discovery_document(cache_file: str) -> str:
+    # Thứ tự: tài liệu đóng gói sẵn trong googleapiclient (>= 2.0) -> bản cache trên đĩa -> tải qua mạng rồi lưu cache
+    global _discovery_document
+    with _discovery_lock:
+        if _discovery_document is not None:
+            return _discovery_document
+        document = None
+        try:
+            from googleapiclient.discovery_cache import get_static_doc
+            document = get_static_doc('sheets', 'v4')
+        except ImportError:
+            pass
+        if document is None and cache_file and os.path.exists(cache_file) \
+                and time.time() - os.path.getmtime(cache_file) < DISCOVERY_CACHE_MAX_AGE:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                document = f.read()
+            logger.debug(f"Loaded Sheets discovery document from {cache_file}.")
+        if document is None:
+            from googleapiclient.http import build_http
+            logger.info("Downloading Sheets discovery document...")
+            response, content = build_http().request(DISCOVERY_URL)
+            if response.status != 200:
+                raise ConnectionError(f"Could not download Sheets discovery document (HTTP {response.status}).")
+            document = content.decode('utf-8')
+            if cache_file:
+                os.makedirs(os.path.dirname(cache_file) or '.', exist_ok=True)
+                tmp_path = f"{cache_file}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(document)
+                os.replace(tmp_path, cache_file)
+        _discovery_document = document
+        return document
+
 NETWORK_RETRY_ERRORS = (
     ConnectionAbortedError,
     ConnectionResetError,
@@ -22,16 +65,227 @@ NETWORK_RETRY_ERRORS = (
     HTTPException,
 )
 
+_A1_RE = re.compile(r"^([A-Za-z]*)(\d*)(?::([A-Za-z]*)(\d*))?$")
+
+def _split_a1(range_str: str) -> Tuple[str, Optional[int], Optional[int]]:
+    # 'Sheet'!B2:Z10 -> ('Sheet', 2 (cột B), 10); None khi range không giới hạn cột/dòng
+    sheet, _, cells = range_str.rpartition('!')
+    if not sheet:
+        sheet, cells = cells, ''
+    if sheet.startswith("'") and sheet.endswith("'"):
+        sheet = sheet[1:-1].replace("''", "'")
+    match = _A1_RE.match(cells)
+    if not cells or not match:
+        return sheet, None, None
+    start_col, start_row, end_col, end_row = match.groups()
+    last_row = end_row if end_col is not None or end_row else start_row
+    return sheet, column_to_number(start_col) if start_col else None, int(last_row) if last_row else None
+
+class SheetMetadataCache:
+    # sheets.properties (sheetId, title, gridProperties) của từng spreadsheet: một spreadsheets.get cho mỗi spreadsheet trong
+    # lần chạy, sau đó cập nhật cục bộ theo các thao tác append/xóa/clear của chính pipeline thay vì đọc lại.
+    # last_row = dòng cuối của khối dữ liệu bắt đầu từ cột A khi biết chắc; thao tác không tính được thì quên giá trị đó
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sheets: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._last_rows: Dict[Tuple[str, str], int] = {}
+
+    def loaded(self, spreadsheet_id: str) -> bool:
+        with self._lock:
+            return spreadsheet_id in self._sheets
+
+    def store(self, spreadsheet_id: str, sheets: List[Dict[str, Any]]):
+        with self._lock:
+            self._sheets[spreadsheet_id] = {p['title']: copy.deepcopy(p) for p in sheets if 'title' in p}
+            self._last_rows = {k: v for k, v in self._last_rows.items() if k[0] != spreadsheet_id or k[1] in self._sheets[spreadsheet_id]}
+
+    def invalidate(self, spreadsheet_id: str):
+        with self._lock:
+            self._sheets.pop(spreadsheet_id, None)
+            self._last_rows = {k: v for k, v in self._last_rows.items() if k[0] != spreadsheet_id}
+
+    def properties(self, spreadsheet_id: str, title: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            properties = self._sheets.get(spreadsheet_id, {}).get(title)
+            return copy.deepcopy(properties) if properties is not None else None
+
+    def cell_count(self, spreadsheet_id: str) -> Optional[int]:
+        with self._lock:
+            if spreadsheet_id not in self._sheets:
+                return None
+            return sum(p.get('gridProperties', {}).get('rowCount', 0) * p.get('gridProperties', {}).get('columnCount', 0)
+                       for p in self._sheets[spreadsheet_id].values())
+
+    def last_row(self, spreadsheet_id: str, title: str) -> Optional[int]:
+        with self._lock:
+            return self._last_rows.get((spreadsheet_id, title))
+
+    def set_last_row(self, spreadsheet_id: str, title: str, row: int):
+        with self._lock:
+            self._last_rows[(spreadsheet_id, title)] = row
+
+    def row_bound(self, spreadsheet_id: str, title: str) -> Optional[int]:
+        # Cận trên của dòng có dữ liệu: last_row nếu đã biết, không thì số dòng của lưới
+        with self._lock:
+            known = self._last_rows.get((spreadsheet_id, title))
+            if known is not None:
+                return known
+            properties = self._sheets.get(spreadsheet_id, {}).get(title)
+            return properties.get('gridProperties', {}).get('rowCount', 0) if properties is not None else None
+
+    def values_written(self, spreadsheet_id: str, range_str: str):
+        title, first_col, last_row = _split_a1(range_str)
+        key = (spreadsheet_id, title)
+        with self._lock:
+            if first_col == 1 and last_row is not None and key in self._last_rows:
+                self._last_rows[key] = max(self._last_rows[key], last_row)
+
+    def values_appended(self, spreadsheet_id: str, title: str, updated_range: Optional[str], count: int):
+        with self._lock:
+            properties = self._sheets.get(spreadsheet_id, {}).get(title)
+            if properties is not None:
+                # insertDataOption=INSERT_ROWS chèn đúng số dòng vừa append vào lưới
+                self._resize(properties, 'ROWS', count)
+            _, _, last_row = _split_a1(updated_range or '')
+            if last_row is not None:
+                self._last_rows[(spreadsheet_id, title)] = last_row
+            else:
+                self._last_rows.pop((spreadsheet_id, title), None)
+
+    def values_cleared(self, spreadsheet_id: str, range_str: str):
+        title, first_col, _ = _split_a1(range_str)
+        if first_col in (None, 1):
+            with self._lock:
+                self._last_rows.pop((spreadsheet_id, title), None)
+
+    @staticmethod
+    def _resize(properties: Dict[str, Any], dimension: str, delta: int):
+        grid = properties.setdefault('gridProperties', {})
+        key = 'rowCount' if dimension == 'ROWS' else 'columnCount'
+        grid[key] = max(grid.get(key, 0) + delta, 0)
+
+    def apply_requests(self, spreadsheet_id: str, requests: List[Dict[str, Any]], replies: List[Dict[str, Any]]):
+        with self._lock:
+            sheets = self._sheets.get(spreadsheet_id)
+            if sheets is None:
+                return
+            by_id = {p.get('sheetId'): p for p in sheets.values()}
+            for index, request in enumerate(requests):
+                kind, spec = next(iter(request.items()))
+                if kind == 'addSheet':
+                    reply = replies[index] if index < len(replies) else {}
+                    properties = reply.get('addSheet', {}).get('properties')
+                    if properties is None:
+                        # Không có reply (vd. chạy thử): lần đọc sau lấy lại từ API
+                        self._sheets.pop(spreadsheet_id, None)
+                        return
+                    sheets[properties['title']] = copy.deepcopy(properties)
+                    by_id[properties.get('sheetId')] = sheets[properties['title']]
+                    continue
+                if kind == 'appendDimension':
+                    properties = by_id.get(spec.get('sheetId'))
+                    if properties is not None:
+                        self._resize(properties, spec.get('dimension', 'ROWS'), spec.get('length', 0))
+                    continue
+                if kind in ('insertDimension', 'deleteDimension'):
+                    r = spec.get('range', {})
+                    properties = by_id.get(r.get('sheetId'))
+                    if properties is not None:
+                        delta = r.get('endIndex', 0) - r.get('startIndex', 0)
+                        self._resize(properties, r.get('dimension', 'ROWS'), delta if kind == 'insertDimension' else -delta)
+                        self._last_rows.pop((spreadsheet_id, properties['title']), None)
+                    continue
+                if kind == 'updateSheetProperties':
+                    update = spec.get('properties', {})
+                    properties = by_id.get(update.get('sheetId'))
+                    fields = spec.get('fields', '')
+                    row_count = update.get('gridProperties', {}).get('rowCount')
+                    if properties is not None and row_count is not None and fields == 'gridProperties.rowCount':
+                        properties.setdefault('gridProperties', {})['rowCount'] = row_count
+                        key = (spreadsheet_id, properties['title'])
+                        if key in self._last_rows:
+                            self._last_rows[key] = min(self._last_rows[key], row_count)
+                        continue
+                elif kind == 'deleteSheet':
+                    properties = by_id.pop(spec.get('sheetId'), None)
+                    if properties is not None:
+                        sheets.pop(properties['title'], None)
+                        self._last_rows.pop((spreadsheet_id, properties['title']), None)
+                    continue
+                elif kind == 'repeatCell':
+                    # Chỉ đổi định dạng: không ảnh hưởng lưới hay dữ liệu
+                    continue
+                elif kind in ('updateCells', 'copyPaste'):
+                    target = spec.get('range') or spec.get('destination') or {}
+                    properties = by_id.get(target.get('sheetId'))
+                    if properties is not None:
+                        self._last_rows.pop((spreadsheet_id, properties['title']), None)
+                        continue
+                # Loại request chưa theo dõi được: đọc lại metadata của spreadsheet ở lần cần tiếp theo
+                self._sheets.pop(spreadsheet_id, None)
+                self._last_rows = {k: v for k, v in self._last_rows.items() if k[0] != spreadsheet_id}
+                return
+
 class GoogleSheetsClient:
-    def __init__(self, config: GoogleSheetsConfig, max_retries: int = 5):
+    def __init__(self,
+                 config: GoogleSheetsConfig,
+                 max_retries: int = 5,
+                 quota: Optional[SheetsQuotaScheduler] = None,
+                 service_factory: Optional[Callable[[], Any]] = None):
         self.config = config
         self.max_retries = max_retries
         self.connection_max_retries = 5
-        self.service = self._authenticate()
-        self._sheet_id_cache = {}
-        logger.info("Successfully connected to Google Sheets API.")
+        # Một client (và một bộ điều phối quota) dùng chung cho mọi báo cáo trong lần chạy
+        self.quota = quota or SheetsQuotaScheduler(
+            read_per_minute=config.read_requests_per_minute,
+            write_per_minute=config.write_requests_per_minute,
+            project_read_per_minute=config.project_read_requests_per_minute,
+            project_write_per_minute=config.project_write_requests_per_minute,
+            utilization=config.quota_utilization
+        )
+        # service_factory (vd. benchmark với server Sheets giả) thay cho OAuth + discovery thật
+        self._service_factory = service_factory
+        # Xác thực (đọc/refresh token) hoãn tới lần gọi Sheets đầu tiên để truy vấn SQL không phải chờ
+        self._credentials = None
+        self._auth_lock = threading.Lock()
+        # httplib2 không thread-safe: mỗi luồng giữ riêng một service object. Service của luồng đã kết thúc
+        # (luồng job của daemon, worker của pool) được trả về pool và dùng lại thay vì dựng lại ở mỗi lượt chạy
+        self._services_lock = threading.Lock()
+        self._services: Dict[threading.Thread, Any] = {}
+        self._idle_services: List[Any] = []
+        # Metadata các sheet, dùng chung cho mọi báo cáo trong lần chạy
+        self.metadata = SheetMetadataCache()
+
+    @property
+    def service(self):
+        thread = threading.current_thread()
+        with self._services_lock:
+            service = self._services.get(thread)
+            if service is not None:
+                return service
+            for finished in [t for t in self._services if not t.is_alive()]:
+                self._idle_services.append(self._services.pop(finished))
+            service = self._idle_services.pop() if self._idle_services else None
+        if service is None:
+            service = self._build_service()
+        with self._services_lock:
+            self._services[thread] = service
+        return service
+
+    def _get_credentials(self):
+        with self._auth_lock:
+            if self._credentials is None:
+                with metrics.timer('sheets_startup_seconds', stage='auth'):
+                    self._credentials = self._authenticate()
+                logger.info("Successfully authenticated with Google Sheets API.")
+            return self._credentials
 
     def _authenticate(self):
+        with metrics.timer('sheets_startup_seconds', stage='import'):
+            from google.oauth2.credentials import Credentials
+            from google.auth.transport.requests import Request
+            from google_auth_oauthlib.flow import InstalledAppFlow
+
         creds = None
         if os.path.exists(self.config.token_file):
             creds = Credentials.from_authorized_user_file(self.config.token_file, self.config.scopes)
@@ -46,31 +300,42 @@ class GoogleSheetsClient:
                 creds = flow.run_local_server(port=0)
             with open(self.config.token_file, 'w') as token:
                 token.write(creds.to_json())
+        return creds
 
-        try:
-            return build('sheets', 'v4', credentials=creds, cache_discovery=False)
-        except HttpError as err:
-            logger.error(f"Error building Google Sheets service: {err}", exc_info=True)
-            raise
+    def _build_service(self):
+        if self._service_factory:
+            return self._service_factory()
+        credentials = self._get_credentials()
+        from googleapiclient.discovery import build_from_document
+        with metrics.timer('sheets_startup_seconds', stage='discovery'):
+            document = _load_discovery_document(self.config.discovery_cache_file)
+            return build_from_document(document, credentials=credentials)
 
-    def _execute_with_retry(self, operation: Callable) -> Any:
+    def _execute_with_retry(self, operation: Callable, quota_group: str = 'write', method: str = 'unknown') -> Any:
+        from googleapiclient.errors import HttpError
         last_exception = None
         for attempt in range(self.connection_max_retries):
             try:
                 quota_attempt = 0
                 while quota_attempt < self.max_retries:
+                    self.quota.acquire(quota_group)
+                    metrics.inc('sheets_api_calls', method=method)
                     try:
-                        return operation()
+                        with metrics.timer('sheets_api_seconds', method=method):
+                            return operation()
                     except HttpError as err:
                         last_exception = err
                         if err.resp and err.resp.status == 429:
                             quota_attempt += 1
                             wait_time = (2 ** quota_attempt) + random.uniform(0, 1)
+                            metrics.inc('sheets_retries', kind='quota')
+                            metrics.observe('sheets_backoff_seconds', wait_time, kind='quota')
                             logger.warning(
                                 f"Quota exceeded. Retrying operation after {wait_time:.2f} seconds... "
                                 f"(Quota Attempt {quota_attempt}/{self.max_retries})"
                             )
-                            time.sleep(wait_time)
+                            # Tạm dừng cả nhóm quota để các luồng khác cũng lùi lại; acquire() tiếp theo sẽ chờ
+                            self.quota.pause(quota_group, wait_time)
                         else:
                             logger.error(f"An unrecoverable Google API error occurred: {err}", exc_info=True)
                             raise err
@@ -85,37 +350,121 @@ class GoogleSheetsClient:
                     f"(Connection Attempt {attempt + 1}/{self.connection_max_retries})"
                 )
                 connection_wait_time = (2 ** attempt) + random.uniform(0, 1)
+                metrics.inc('sheets_retries', kind='network')
+                metrics.observe('sheets_backoff_seconds', connection_wait_time, kind='network')
                 time.sleep(connection_wait_time)
 
         logger.error(f"Max retries ({self.connection_max_retries}) exceeded for connection/network error.")
         raise last_exception
 
-    def get_sheet_id_by_name(self, spreadsheet_id: str, sheet_name: str) -> Optional[int]:
-        cache_key = (spreadsheet_id, sheet_name)
-        if cache_key in self._sheet_id_cache:
-            return self._sheet_id_cache[cache_key]
-
-        logger.debug(f"Fetching sheet ID for sheet '{sheet_name}' in spreadsheet '{spreadsheet_id}'")
+    def _load_metadata(self, spreadsheet_id: str, refresh: bool = False):
+        if self.metadata.loaded(spreadsheet_id) and not refresh:
+            return
+        logger.debug(f"Fetching sheet metadata for spreadsheet '{spreadsheet_id}'")
         operation = lambda: self.service.spreadsheets().get(
-            spreadsheetId=spreadsheet_id, fields='sheets(properties(sheetId,title))'
+            spreadsheetId=spreadsheet_id,
+            fields='sheets(properties(sheetId,title,hidden,gridProperties(rowCount,columnCount)))'
         ).execute()
+        spreadsheet = self._execute_with_retry(operation, quota_group='read', method='spreadsheets.get')
+        self.metadata.store(spreadsheet_id, [sheet.get('properties', {}) for sheet in spreadsheet.get('sheets', [])])
 
+    def get_sheet_id_by_name(self, spreadsheet_id: str, sheet_name: str, log_missing: bool = True) -> Optional[int]:
         try:
-            spreadsheet = self._execute_with_retry(operation)
-            for sheet in spreadsheet.get('sheets', []):
-                properties = sheet.get('properties', {})
-                if properties.get('title') == sheet_name:
-                    sheet_id = properties.get('sheetId')
-                    if sheet_id is not None:
-                        self._sheet_id_cache[cache_key] = sheet_id
-                        logger.debug(f"Found sheet ID: {sheet_id}")
-                        return sheet_id
-            logger.error(f"Sheet with name '{sheet_name}' not found in spreadsheet '{spreadsheet_id}'.")
+            self._load_metadata(spreadsheet_id)
+            properties = self.metadata.properties(spreadsheet_id, sheet_name)
+            if properties is not None and properties.get('sheetId') is not None:
+                return properties['sheetId']
+            if log_missing:
+                logger.error(f"Sheet with name '{sheet_name}' not found in spreadsheet '{spreadsheet_id}'.")
             return None
         except Exception as e:
             logger.error(f"Failed to get sheet ID for '{sheet_name}' after multiple retries: {e}", exc_info=True)
             raise
 
+    def get_sheet_properties(self, spreadsheet_id: str, sheet_name: str, refresh: bool = False) -> Optional[Dict[str, Any]]:
+        try:
+            self._load_metadata(spreadsheet_id, refresh=refresh)
+            properties = self.metadata.properties(spreadsheet_id, sheet_name)
+            if properties is None:
+                logger.error(f"Sheet with name '{sheet_name}' not found in spreadsheet '{spreadsheet_id}'.")
+            return properties
+        except Exception as e:
+            logger.error(f"Failed to get properties for sheet '{sheet_name}' after multiple retries: {e}", exc_info=True)
+            raise
+
+    def get_cell_count(self, spreadsheet_id: str, refresh: bool = False) -> int:
+        self._load_metadata(spreadsheet_id, refresh=refresh)
+        return self.metadata.cell_count(spreadsheet_id) or 0
+
+    def get_row_bound(self, spreadsheet_id: str, sheet_name: str) -> int:
+        # Dòng cuối đã biết, không thì số dòng của lưới: luôn phủ hết dữ liệu cũ (xóa/clear thêm phần lưới trống
+        # không hại gì) và lấy từ metadata đã cache nên không tốn thêm lệnh đọc cột A
+        self._load_metadata(spreadsheet_id)
+        bound = self.metadata.row_bound(spreadsheet_id, sheet_name)
+        if bound is None:
+            raise ValueError(f"Sheet '{sheet_name}' not found in spreadsheet '{spreadsheet_id}'.")
+        return bound
+
+    def append_grid_rows(self, spreadsheet_id: str, sheet_id: int, count: int):
+        if count <= 0:
+            return
+        body = {'requests': [{
+            'appendDimension': {
+                'sheetId': sheet_id,
+                'dimension': 'ROWS',
+                'length': count
+            }
+        }]}
+        operation = lambda: self.service.spreadsheets().batchUpdate(
+            spreadsheetId=spreadsheet_id, body=body
+        ).execute()
+        try:
+            self._execute_with_retry(operation, method='spreadsheets.batchUpdate')
+            self.metadata.apply_requests(spreadsheet_id, body['requests'], [])
+            logger.debug(f"Added {count} rows to the grid of sheet ID {sheet_id}.")
+        except Exception as e:
+            logger.error(f"Failed to add {count} grid rows to sheet ID {sheet_id} after multiple retries: {e}", exc_info=True)
+            raise
+
+    def batch_update(self, spreadsheet_id: str, requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if not requests:
+            logger.debug("batch_update called with no requests. Skipping API call.")
+            return []
+        body = {'requests': requests}
+        operation = lambda: self.service.spreadsheets().batchUpdate(
+            spreadsheetId=spreadsheet_id, body=body
+        ).execute()
+        try:
+            response = self._execute_with_retry(operation, method='spreadsheets.batchUpdate')
+            logger.info(f"Applied {len(requests)} sheet requests in one batchUpdate call.")
+            replies = response.get('replies', [])
+            self.metadata.apply_requests(spreadsheet_id, requests, replies)
+            return replies
+        except Exception as e:
+            logger.error(f"Failed to apply {len(requests)} sheet requests after multiple retries: {e}", exc_info=True)
+            raise
+
+    def batch_update_values(self, spreadsheet_id: str, value_ranges: List[Dict[str, Any]], value_input_option: str = 'USER_ENTERED'):
+        if not value_ranges:
+            logger.debug("batch_update_values called with no ranges. Skipping API call.")
+            return
+        body = {
+            "valueInputOption": value_input_option,
+            "data": value_ranges
+        }
+        operation = lambda: self.service.spreadsheets().values().batchUpdate(
+            spreadsheetId=spreadsheet_id, body=body
+        ).execute()
+        total_rows = sum(len(vr['values']) for vr in value_ranges)
+        try:
+            self._execute_with_retry(operation, method='values.batchUpdate')
+            for value_range in value_ranges:
+                self.metadata.values_written(spreadsheet_id, value_range['range'])
+            logger.info(f"Wrote {total_rows} rows in {len(value_ranges)} ranges with one batchUpdate call.")
+        except Exception as e:
+            logger.error(f"Failed to write {total_rows} rows via batchUpdate after multiple retries: {e}", exc_info=True)
+            raise
+
     def delete_rows(self, spreadsheet_id: str, sheet_id: int, start_index: int, end_index: int):
         if start_index >= end_index:
             logger.info(f"No rows to delete (start_index {start_index} >= end_index {end_index}).")
@@ -139,21 +488,29 @@ class GoogleSheetsClient:
         ).execute()
 
         try:
-            self._execute_with_retry(operation)
+            self._execute_with_retry(operation, method='spreadsheets.batchUpdate')
+            self.metadata.apply_requests(spreadsheet_id, requests, [])
             logger.info(f"Successfully deleted rows {start_index} to {end_index-1}.")
             time.sleep(1) # Chờ một chút sau khi xóa
+            metrics.observe('sheets_sleep_seconds', 1.0, reason='delete_rows')
         except Exception as e:
             logger.error(f"Failed to delete rows {start_index}-{end_index-1} after multiple retries: {e}", exc_info=True)
             raise
 
     def get_last_row(self, spreadsheet_id: str, sheet_name: str) -> int:
+        # Chỉ tải cột A khi chưa biết dòng cuối trong lần chạy này; sau đó metadata tự theo dõi qua các lần ghi
+        known = self.metadata.last_row(spreadsheet_id, sheet_name)
+        if known is not None:
+            return known
+        from googleapiclient.errors import HttpError
         try:
             range_str = f"{sheet_name}!A:A"
             operation = lambda: self.service.spreadsheets().values().get(
                 spreadsheetId=spreadsheet_id, range=range_str
             ).execute()
-            result = self._execute_with_retry(operation)
+            result = self._execute_with_retry(operation, quota_group='read', method='values.get')
             values = result.get('values', [])
+            self.metadata.set_last_row(spreadsheet_id, sheet_name, len(values))
             return len(values)
         except HttpError as err:
              if err.resp and 'Unable to parse range' in str(err.content):
@@ -171,14 +528,16 @@ class GoogleSheetsClient:
             spreadsheetId=spreadsheet_id, range=range_to_clear
         ).execute()
         try:
-            self._execute_with_retry(operation)
+            self._execute_with_retry(operation, method='values.clear')
+            self.metadata.values_cleared(spreadsheet_id, range_to_clear)
             logger.info(f"Cleared range {range_to_clear}.")
             time.sleep(0.5)
+            metrics.observe('sheets_sleep_seconds', 0.5, reason='clear_range')
         except Exception as e:
             logger.error(f"Failed to clear range {range_to_clear} after multiple retries: {e}", exc_info=True)
             raise
 
-    def append_range(self, spreadsheet_id: str, sheet_name: str, data: List[List[Any]]):
+    def append_range(self, spreadsheet_id: str, sheet_name: str, data: List[List[Any]], value_input_option: str = 'USER_ENTERED'):
         if not data:
              logger.debug("append_range called with empty data list. Skipping API call.")
              return
@@ -187,13 +546,133 @@ class GoogleSheetsClient:
         operation = lambda: self.service.spreadsheets().values().append(
             spreadsheetId=spreadsheet_id,
             range=range_to_append,
-            valueInputOption="USER_ENTERED",
+            valueInputOption=value_input_option,
             insertDataOption="INSERT_ROWS",
             body=body
         ).execute()
         try:
-            self._execute_with_retry(operation)
+            response = self._execute_with_retry(operation, method='values.append')
+            self.metadata.values_appended(spreadsheet_id, sheet_name, response.get('updates', {}).get('updatedRange'), len(data))
             logger.info(f"Appended {len(data)} rows to sheet '{sheet_name}'.")
         except Exception as e:
             logger.error(f"Failed to append {len(data)} rows to sheet '{sheet_name}' after multiple retries: {e}", exc_info=True)
-            raise
\ No newline at end of file
+            raise
+
+class DryRunSheetsClient:
+    # --extract-only: cùng giao diện với GoogleSheetsClient nhưng không gọi API và không import thư viện Google.
+    # Mọi sheet được coi như chỉ có dòng tiêu đề; dữ liệu ghi bị bỏ qua (vẫn được đếm trong metrics của pipeline)
+    def __init__(self):
+        self.quota = None
+        self.metadata = SheetMetadataCache()
+        logger.info("Extract-only mode: Google Sheets calls are skipped.")
+
+    def get_sheet_id_by_name(self, spreadsheet_id: str, sheet_name: str, log_missing: bool = True) -> Optional[int]:
+        return 0
+
+    def get_sheet_properties(self, spreadsheet_id: str, sheet_name: str, refresh: bool = False) -> Optional[Dict[str, Any]]:
+        return {'sheetId': 0, 'title': sheet_name, 'gridProperties': {'rowCount': 1}}
+
+    def get_cell_count(self, spreadsheet_id: str, refresh: bool = False) -> int:
+        return 0
+
+    def get_row_bound(self, spreadsheet_id: str, sheet_name: str) -> int:
+        return 1
+
+    def get_last_row(self, spreadsheet_id: str, sheet_name: str) -> int:
+        return 1
+
+    def append_grid_rows(self, spreadsheet_id: str, sheet_id: int, count: int):
+        pass
+
+    def batch_update(self, spreadsheet_id: str, requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        logger.debug(f"[extract-only] Skipping batchUpdate with {len(requests)} requests.")
+        return []
+
+    def batch_update_values(self, spreadsheet_id: str, value_ranges: List[Dict[str, Any]], value_input_option: str = 'USER_ENTERED'):
+        logger.debug(f"[extract-only] Skipping values.batchUpdate of {len(value_ranges)} ranges.")
+
+    def delete_rows(self, spreadsheet_id: str, sheet_id: int, start_index: int, end_index: int):
+        pass
+
+    def clear_range(self, spreadsheet_id: str, range_to_clear: str):
+        logger.debug(f"[extract-only] Skipping clear of {range_to_clear}.")
+
+    def append_range(self, spreadsheet_id: str, sheet_name: str, data: List[List[Any]], value_input_option: str = 'USER_ENTERED'):
+        logger.debug(f"[extract-only] Skipping append of {len(data)} rows to '{sheet_name}'.")
+
+class SheetRangeWriter:
+    def __init__(self,
+                 client: GoogleSheetsClient,
+                 spreadsheet_id: str,
+                 sheet_name: str,
+                 start_row: int,
+                 start_column: str = 'A',
+                 max_payload_bytes: int = 2_000_000,
+                 value_input_option: str = 'USER_ENTERED'):
+        self.client = client
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet_name = sheet_name
+        self.next_row = start_row
+        self.start_column = start_column.upper()
+        self.max_payload_bytes = max_payload_bytes
+        self.value_input_option = value_input_option
+        self._pending: List[Dict[str, Any]] = []
+        self._pending_bytes = 0
+        self._grid_rows: Optional[int] = None
+        self._sheet_id: Optional[int] = None
+        self._last_row = 0
+        self.max_columns = 0
+        # Dòng cuối cùng chắc chắn đã nằm trên sheet (sau lần flush gần nhất)
+        self.flushed_through = start_row - 1
+
+    def write(self, data: List[List[Any]]):
+        if not data:
+            return
+        first_row = self.next_row
+        last_row = first_row + len(data) - 1
+        self.max_columns = max(self.max_columns, max(len(r) for r in data))
+        end_column = number_to_column(column_to_number(self.start_column) + max(len(r) for r in data) - 1)
+        value_range = {
+            "range": f"{self.sheet_name}!{self.start_column}{first_row}:{end_column}{last_row}",
+            "values": data
+        }
+        # Ước lượng kích thước payload theo JSON thực tế gửi đi
+        size = len(json.dumps(value_range, default=str, ensure_ascii=False).encode('utf-8'))
+        if self._pending and self._pending_bytes + size > self.max_payload_bytes:
+            self.flush()
+        self._pending.append(value_range)
+        self._pending_bytes += size
+        self.next_row = last_row + 1
+        self._last_row = max(self._last_row, last_row)
+
+    def seek(self, row: int):
+        self.next_row = row
+
+    def reset_grid(self):
+        # Gọi sau khi chèn/xóa dòng bên ngoài writer để đọc lại kích thước lưới
+        self._grid_rows = None
+
+    def load_grid(self) -> Tuple[int, int]:
+        if self._grid_rows is None:
+            properties = self.client.get_sheet_properties(self.spreadsheet_id, self.sheet_name)
+            if properties is None:
+                raise ValueError(f"Sheet '{self.sheet_name}' not found in spreadsheet '{self.spreadsheet_id}'.")
+            self._sheet_id = properties.get('sheetId')
+            self._grid_rows = properties.get('gridProperties', {}).get('rowCount', 0)
+        return self._sheet_id, self._grid_rows
+
+    def _ensure_grid_rows(self, required_rows: int):
+        self.load_grid()
+        # values.batchUpdate không tự mở rộng lưới như values.append
+        if required_rows > self._grid_rows:
+            self.client.append_grid_rows(self.spreadsheet_id, self._sheet_id, required_rows - self._grid_rows)
+            self._grid_rows = required_rows
+
+    def flush(self):
+        if not self._pending:
+            return
+        self._ensure_grid_rows(self._last_row)
+        self.client.batch_update_values(self.spreadsheet_id, self._pending, self.value_input_option)
+        self.flushed_through = max(self.flushed_through, self._last_row)
+        self._pending = []
+        self._pending_bytes = 0
@@ -0,0 +1,99 @@
+import logging
+import threading
+from datetime import date, timedelta
+from typing import Iterator, Optional, Tuple
+from ..storage.batch_history import BatchHistory, BatchHistoryStore
+
+# Trọng số của lô mới nhất khi làm mượt tốc độ rows/ngày và giây/ngày
+_SMOOTHING = 0.5
+# Mỗi bước chỉ được nới cửa sổ tối đa bấy nhiêu lần
+_MAX_GROWTH = 4
+
+class AdaptiveDateBatcher:
+    def __init__(self,
+                 store: BatchHistoryStore,
+                 report_name: str,
+                 start_date: date,
+                 end_date: date,
+                 initial_days: int,
+                 target_rows: int,
+                 target_seconds: float,
+                 max_days: int,
+                 logger: logging.Logger):
+        self.store = store
+        self.report_name = report_name
+        self.start_date = start_date
+        self.end_date = end_date
+        self.target_rows = target_rows
+        self.target_seconds = target_seconds
+        self.max_days = max(1, max_days)
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._observed = False
+
+        history = store.load(report_name)
+        if history:
+            self.batch_days = self._clamp(history.batch_days)
+            self.rows_per_day = history.rows_per_day
+            self.seconds_per_day = history.seconds_per_day
+            self.logger.info(f"Adaptive batching: starting with {self.batch_days}-day windows learned from previous runs.")
+        else:
+            self.batch_days = self._clamp(initial_days)
+            self.rows_per_day = None
+            self.seconds_per_day = None
+
+    def _clamp(self, days: int) -> int:
+        return max(1, min(self.max_days, int(days)))
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        current_start = self.start_date
+        while current_start <= self.end_date:
+            with self._lock:
+                days = self.batch_days
+            current_end = min(current_start + timedelta(days=days - 1), self.end_date)
+            yield (
+                current_start.strftime('%Y-%m-%d'),
+                current_end.strftime('%Y-%m-%d')
+            )
+            current_start = current_end + timedelta(days=1)
+
+    def record(self, start_batch: str, end_batch: str, rows: int, seconds: Optional[float]):
+        days = (date.fromisoformat(end_batch) - date.fromisoformat(start_batch)).days + 1
+        with self._lock:
+            self.rows_per_day = self._smooth(self.rows_per_day, rows / days)
+            if seconds is not None:
+                self.seconds_per_day = self._smooth(self.seconds_per_day, seconds / days)
+            self._observed = True
+
+            within_rows = rows <= self.target_rows
+            within_time = seconds is None or seconds <= self.target_seconds
+            # Giữ nguyên cửa sổ khi lô đã nằm trong khoảng [1/2, 1] mục tiêu để các lô ổn định giữa các lần chạy
+            if within_rows and within_time and (rows * 2 >= self.target_rows
+                                                or (seconds is not None and seconds * 2 >= self.target_seconds)):
+                return
+
+            limits = [self.target_rows / max(self.rows_per_day, 1e-9)]
+            if self.seconds_per_day is not None:
+                limits.append(self.target_seconds / max(self.seconds_per_day, 1e-9))
+            wanted = self._clamp(min(min(limits), self.batch_days * _MAX_GROWTH))
+            if wanted != self.batch_days:
+                self.logger.info(
+                    f"Adaptive batching: {start_batch}..{end_batch} returned {rows} rows"
+                    f"{f' in {seconds:.1f}s' if seconds is not None else ''}; window {self.batch_days} -> {wanted} days."
+                )
+                self.batch_days = wanted
+
+    @staticmethod
+    def _smooth(previous: Optional[float], value: float) -> float:
+        return value if previous is None else _SMOOTHING * value + (1 - _SMOOTHING) * previous
+
+    def save(self):
+        with self._lock:
+            if not self._observed:
+                return
+            history = BatchHistory(
+                batch_days=self.batch_days,
+                rows_per_day=self.rows_per_day or 0.0,
+                seconds_per_day=self.seconds_per_day or 0.0
+            )
+        self.store.save(self.report_name, history)
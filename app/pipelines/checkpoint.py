@@ -0,0 +1,112 @@
+import uuid
+import logging
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Any, List, Optional, Tuple
+from ..storage.run_journal import RunJournalStore, JournalRun, JournalBatch, JournalChunk
+from .incremental import fingerprint_rows
+
+@dataclass
+class ResumePlan:
+    run: JournalRun
+    resume_from: date
+    next_row: int
+    # Lô ngày đang ghi dở khi lần chạy trước lỗi và các chunk của nó đã ghi xong
+    partial_window: Optional[Tuple[str, str]] = None
+    partial_chunks: List[JournalChunk] = field(default_factory=list)
+
+class RunCheckpoint:
+    def __init__(self,
+                 store: RunJournalStore,
+                 report_name: str,
+                 period_start: date,
+                 period_end: date,
+                 sql_hash: str,
+                 load_strategy: str,
+                 batch_rows: int,
+                 logger: logging.Logger):
+        self.store = store
+        self.report_name = report_name
+        self.period_start = period_start
+        self.period = f"{period_start.isoformat()}..{period_end.isoformat()}"
+        self.sql_hash = sql_hash
+        self.load_strategy = load_strategy
+        self.batch_rows = batch_rows
+        self.logger = logger
+        # Chunk/lô đã gửi đi nhưng chưa chắc đã nằm trên sheet (writer batch_update còn giữ trong bộ đệm)
+        self._pending_chunks: List[Tuple[int, JournalChunk]] = []
+        self._pending_batches: List[Tuple[int, JournalBatch]] = []
+
+    def plan_resume(self) -> Optional[ResumePlan]:
+        previous = self.store.load(self.report_name)
+        if previous is None or previous.status == 'completed':
+            self.logger.info("No unfinished run in the journal. Starting a full run.")
+            return None
+        mismatch = None
+        if previous.period != self.period:
+            mismatch = f"date range changed ({previous.period} -> {self.period})"
+        elif previous.sql_hash != self.sql_hash:
+            mismatch = "SQL query changed"
+        elif previous.load_strategy != self.load_strategy:
+            mismatch = "load_strategy changed"
+        if mismatch:
+            self.logger.warning(f"Cannot resume the previous run: {mismatch}. Starting a full run.")
+            return None
+
+        completed = {b.start_batch for b in previous.batches}
+        resume_from, next_row = self.period_start, previous.start_row
+        if previous.batches:
+            last = previous.batches[-1]
+            resume_from = date.fromisoformat(last.end_batch) + timedelta(days=1)
+            next_row = last.next_row
+        plan = ResumePlan(run=previous, resume_from=resume_from, next_row=next_row)
+
+        partial = [c for c in previous.chunks if c.start_batch not in completed]
+        if partial and partial[0].start_batch == resume_from.isoformat():
+            plan.partial_window = (partial[0].start_batch, partial[0].end_batch)
+            # Chunk chỉ so khớp được khi cách chia chunk không đổi
+            if previous.batch_rows == self.batch_rows:
+                plan.partial_chunks = [c for c in partial if (c.start_batch, c.end_batch) == plan.partial_window]
+        self.logger.info(
+            f"Resuming run {previous.run_id} ({previous.status}): {len(previous.batches)} date batches already loaded, "
+            f"continuing from {resume_from} at row {next_row}"
+            f"{f' with {len(plan.partial_chunks)} chunks of batch {plan.partial_window[0]} to {plan.partial_window[1]} to verify' if plan.partial_chunks else ''}."
+        )
+        return plan
+
+    def start(self, start_row: int):
+        previous = self.store.load(self.report_name)
+        if previous is not None and previous.status != 'completed':
+            self.logger.warning(f"Previous run {previous.run_id} did not finish ({previous.status}); starting over. Use --resume to continue it instead.")
+        self.store.start(self.report_name, JournalRun(
+            run_id=uuid.uuid4().hex,
+            period=self.period,
+            sql_hash=self.sql_hash,
+            load_strategy=self.load_strategy,
+            batch_rows=self.batch_rows,
+            start_row=start_row,
+            status='running',
+            updated_at=0.0
+        ))
+
+    def resume(self):
+        self.store.set_status(self.report_name, 'running')
+
+    def chunk_written(self, window: Tuple[str, str], chunk_index: int, start_row: int, rows: List[List[Any]]):
+        chunk = JournalChunk(window[0], window[1], chunk_index, start_row, len(rows), fingerprint_rows(rows))
+        self._pending_chunks.append((start_row + len(rows) - 1, chunk))
+
+    def batch_written(self, window: Tuple[str, str], row_count: int, next_row: int):
+        self._pending_batches.append((next_row - 1, JournalBatch(window[0], window[1], row_count, next_row)))
+
+    def durable_through(self, row: int):
+        chunks = [c for end_row, c in self._pending_chunks if end_row <= row]
+        batches = [b for end_row, b in self._pending_batches if end_row <= row]
+        if not chunks and not batches:
+            return
+        self.store.commit(self.report_name, chunks, batches)
+        self._pending_chunks = [(end_row, c) for end_row, c in self._pending_chunks if end_row > row]
+        self._pending_batches = [(end_row, b) for end_row, b in self._pending_batches if end_row > row]
+
+    def finish(self, success: bool):
+        self.store.set_status(self.report_name, 'completed' if success else 'failed')
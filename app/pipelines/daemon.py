@@ -0,0 +1,131 @@
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from ..config.settings import ReportConfig
+from ..utils.schedule import ReportSchedule, parse_schedule
+from .scheduler import ReportScheduler
+
+logger = logging.getLogger(__name__)
+
+# Thời gian ngủ tối đa giữa hai lần kiểm tra lịch (đồng hồ hệ thống có thể bị chỉnh)
+MAX_IDLE_SECONDS = 60.0
+
+# --daemon: mỗi job chạy theo lịch riêng trong cùng một tiến trình nên pool DB và token Sheets được giữ nguyên giữa các lần chạy.
+# Một job không bao giờ chạy chồng lên chính nó; hai job cùng ghi một sheet không chạy song song
+class ReportDaemon:
+    def __init__(self,
+                 jobs: List[ReportConfig],
+                 max_concurrent: int,
+                 run_report: Callable[[ReportConfig], bool],
+                 on_report_finished: Optional[Callable[[Dict[str, bool]], None]] = None):
+        self.jobs = jobs
+        self.max_concurrent = max(1, max_concurrent)
+        self.run_report = run_report
+        self.on_report_finished = on_report_finished
+        # Job SOURCE_* chạy khi bất kỳ báo cáo đích nào đến hạn
+        self._schedules: Dict[str, List[ReportSchedule]] = {
+            job.name: [parse_schedule(r.schedule) for r in (job.targets or [job])] for job in jobs
+        }
+        self._job_names = {name: job.name for job in jobs for name in ReportScheduler._report_names(job)}
+        self._next_due: Dict[str, datetime] = {}
+        self._running: Set[str] = set()
+        self._busy_targets: Set[Tuple[str, str]] = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        # MaxConcurrentReports áp dụng cho cả daemon
+        self._slots = threading.BoundedSemaphore(self.max_concurrent)
+        self._threads: List[threading.Thread] = []
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+
+    def run(self):
+        now = datetime.now()
+        for job in self.jobs:
+            self._next_due[job.name] = min(s.first_run(now) for s in self._schedules[job.name])
+            logger.info(f"Daemon: '{job.name}' ({', '.join(s.text for s in self._schedules[job.name])}) first runs at {self._next_due[job.name]:%Y-%m-%d %H:%M:%S}.")
+
+        while not self._stopping:
+            now = datetime.now()
+            for job in self._take_due(now):
+                thread = threading.Thread(target=self._run_job, args=(job, now), name=f"daemon-{job.name}")
+                self._threads = [t for t in self._threads if t.is_alive()] + [thread]
+                thread.start()
+            self._wake.wait(self._seconds_until_next_due(datetime.now()))
+            self._wake.clear()
+
+        logger.info("Daemon stopping: waiting for running reports to finish...")
+        for thread in self._threads:
+            thread.join()
+
+    def _dependencies(self, job: ReportConfig) -> Set[str]:
+        # depends_on chỉ có nghĩa giữa các báo cáo đến hạn / đang chạy cùng lúc; báo cáo khác lịch chạy độc lập
+        return {self._job_names[d] for d in job.depends_on if d in self._job_names} - {job.name}
+
+    def _take_due(self, now: datetime) -> List[ReportConfig]:
+        started = []
+        with self._lock:
+            candidates = [job for job in self.jobs if job.name not in self._running and self._next_due[job.name] <= now]
+            progress = True
+            while candidates and progress:
+                progress = False
+                waiting = {job.name for job in candidates}
+                for job in list(candidates):
+                    if self._dependencies(job) & (self._running | waiting):
+                        continue
+                    targets = ReportScheduler._target_keys(job)
+                    if targets & self._busy_targets:
+                        # Sheet đang được job khác ghi: vẫn đến hạn, chạy ngay khi job kia xong
+                        continue
+                    self._running.add(job.name)
+                    self._busy_targets |= targets
+                    candidates.remove(job)
+                    started.append(job)
+                    progress = True
+            if candidates and not self._running:
+                logger.error(f"Daemon: unresolvable dependencies (cycle?) between {[job.name for job in candidates]}. Running them without ordering.")
+                for job in candidates:
+                    targets = ReportScheduler._target_keys(job)
+                    if not targets & self._busy_targets:
+                        self._running.add(job.name)
+                        self._busy_targets |= targets
+                        started.append(job)
+        return started
+
+    def _seconds_until_next_due(self, now: datetime) -> float:
+        with self._lock:
+            waiting = [self._next_due[job.name] for job in self.jobs if job.name not in self._running]
+        if not waiting:
+            return MAX_IDLE_SECONDS
+        return min(max((min(waiting) - now).total_seconds(), 0.0), MAX_IDLE_SECONDS)
+
+    def _run_job(self, job: ReportConfig, started: datetime):
+        ok = False
+        try:
+            with self._slots:
+                ok = bool(self.run_report(job))
+        except Exception as e:
+            logger.error(f"Daemon: report '{job.name}' raised an unhandled error: {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self._running.discard(job.name)
+                self._busy_targets -= ReportScheduler._target_keys(job)
+                self._next_due[job.name] = self._next_run(job, started, datetime.now())
+                logger.info(f"Daemon: '{job.name}' {'succeeded' if ok else 'failed'}; next run at {self._next_due[job.name]:%Y-%m-%d %H:%M:%S}.")
+            self._wake.set()
+        if self.on_report_finished:
+            try:
+                self.on_report_finished({name: ok for name in ReportScheduler._report_names(job)})
+            except Exception as e:
+                logger.warning(f"Daemon: post-run hook failed: {e}")
+
+    def _next_run(self, job: ReportConfig, started: datetime, finished: datetime) -> datetime:
+        # Lượt chạy kéo dài quá chu kỳ thì bỏ qua các mốc đã lỡ thay vì chạy dồn
+        schedules = self._schedules[job.name]
+        due = min(s.next_after(started) for s in schedules)
+        while due <= finished:
+            due = min(s.next_after(due) for s in schedules)
+        return due
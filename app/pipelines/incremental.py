@@ -0,0 +1,176 @@
+import json
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+from ..storage.partition_state import PartitionState, PartitionStateStore, ReportState
+
+@dataclass
+class PartitionBlock:
+    partition_key: str
+    row_count: int
+    content_hash: str
+    rows: Optional[List[List[Any]]]
+    changed: bool = True
+
+def fingerprint_rows(rows: List[List[Any]]) -> str:
+    payload = json.dumps(rows, default=str, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class IncrementalPlanner:
+    def __init__(self,
+                 store: PartitionStateStore,
+                 report_name: str,
+                 period: str,
+                 sql_hash: str,
+                 partition_index: int,
+                 spreadsheet_id: str,
+                 sheet_id: int,
+                 grid_rows: int,
+                 logger: logging.Logger):
+        self.store = store
+        self.report_name = report_name
+        self.period = period
+        self.sql_hash = sql_hash
+        self.partition_index = partition_index
+        self.sheet_id = sheet_id
+        self.target = f"{spreadsheet_id}/{sheet_id}"
+        self.logger = logger
+        self.blocks: List[PartitionBlock] = []
+        self._occurrences: Dict[str, int] = {}
+
+        previous = store.load(report_name)
+        self.full_rewrite_reason = self._check_previous_state(previous, grid_rows)
+        self.full_rewrite = self.full_rewrite_reason is not None
+        self._previous_order = [] if self.full_rewrite else previous.partitions
+        self._previous = {p.partition_key: p for p in self._previous_order}
+        if self.full_rewrite:
+            self.logger.info(f"Incremental mode: full rewrite required ({self.full_rewrite_reason}).")
+        else:
+            self.logger.info(f"Incremental mode: loaded fingerprints for {len(self._previous_order)} partitions.")
+
+    def _check_previous_state(self, previous: Optional[ReportState], grid_rows: int) -> Optional[str]:
+        if previous is None or not previous.partitions:
+            return "no previous state"
+        if previous.target != self.target:
+            return f"target sheet changed from '{previous.target or 'unknown'}' to '{self.target}'"
+        if previous.period != self.period:
+            return f"report period changed from {previous.period} to {self.period}"
+        if previous.sql_hash != self.sql_hash:
+            return "SQL query changed"
+        if previous.grid_rows != grid_rows:
+            return f"sheet has {grid_rows} rows but {previous.grid_rows} were recorded; it was modified outside the pipeline"
+        expected_row = 2
+        for partition in previous.partitions:
+            if partition.start_row != expected_row:
+                return "stored partitions are not contiguous"
+            expected_row += partition.row_count
+        return None
+
+    def _split_runs(self, rows: List[List[Any]]) -> List[Tuple[str, List[List[Any]]]]:
+        # Chỉ cắt khối khi giá trị phân vùng đổi giữa hai dòng liền kề: giữ nguyên thứ tự ORDER BY của câu SQL
+        runs: List[Tuple[str, List[List[Any]]]] = []
+        for row in rows:
+            value = row[self.partition_index] if len(row) > self.partition_index else None
+            value = '' if value is None else str(value)
+            if runs and runs[-1][0] == value:
+                runs[-1][1].append(row)
+            else:
+                runs.append((value, [row]))
+        return runs
+
+    def add_batch(self, rows: List[List[Any]]) -> List[List[Any]]:
+        ordered_rows = []
+        for value, block_rows in self._split_runs(rows):
+            # Cùng một giá trị xuất hiện lại (xen kẽ trong kết quả hoặc ở lô ngày khác) thì đánh số khối thứ 2, 3...
+            occurrence = self._occurrences.get(value, 0) + 1
+            self._occurrences[value] = occurrence
+            partition_key = value if occurrence == 1 else f"{value}#{occurrence}"
+            content_hash = fingerprint_rows(block_rows)
+
+            previous = self._previous.get(partition_key)
+            changed = (previous is None
+                       or previous.content_hash != content_hash
+                       or previous.row_count != len(block_rows))
+            # Chế độ delta giữ cả khối không đổi để có thể ghi lại toàn bộ ngay trong lượt này nếu bố cục sheet không còn khớp
+            self.blocks.append(PartitionBlock(partition_key, len(block_rows), content_hash,
+                                              None if self.full_rewrite else block_rows, changed))
+            if self.full_rewrite:
+                ordered_rows.extend(block_rows)
+        return ordered_rows
+
+    def _dimension_request(self, kind: str, at_row: int, count: int) -> Dict[str, Any]:
+        request = {
+            'range': {
+                'sheetId': self.sheet_id,
+                'dimension': 'ROWS',
+                'startIndex': at_row - 1,
+                'endIndex': at_row - 1 + count
+            }
+        }
+        if kind == 'insertDimension':
+            request['inheritFromBefore'] = at_row > 2
+        return {kind: request}
+
+    def plan(self) -> Optional[Tuple[List[Dict[str, Any]], List[Tuple[int, List[List[Any]]]]]]:
+        if not self.blocks:
+            return None
+        new_keys = {b.partition_key for b in self.blocks}
+        previous = self._previous_order
+        if ([p.partition_key for p in previous if p.partition_key in new_keys]
+                != [b.partition_key for b in self.blocks if b.partition_key in self._previous]):
+            return None
+
+        requests: List[Dict[str, Any]] = []
+        writes: List[Tuple[int, List[List[Any]]]] = []
+        row = 2
+        i = 0
+        # Duyệt theo thứ tự mới; các chỉ số dòng tính theo trạng thái sheet sau các request trước đó
+        for block in self.blocks:
+            while i < len(previous) and previous[i].partition_key not in new_keys:
+                requests.append(self._dimension_request('deleteDimension', row, previous[i].row_count))
+                i += 1
+            at_tail = i >= len(previous)
+            old = self._previous.get(block.partition_key)
+            if old is None:
+                if not at_tail:
+                    requests.append(self._dimension_request('insertDimension', row, block.row_count))
+            else:
+                i += 1
+                delta = block.row_count - old.row_count
+                if delta > 0 and i < len(previous):
+                    requests.append(self._dimension_request('insertDimension', row + old.row_count, delta))
+                elif delta < 0:
+                    requests.append(self._dimension_request('deleteDimension', row + block.row_count, -delta))
+            if block.changed and block.rows is not None:
+                writes.append((row, block.rows))
+            row += block.row_count
+
+        while i < len(previous):
+            requests.append(self._dimension_request('deleteDimension', row, previous[i].row_count))
+            i += 1
+
+        changed_rows = sum(len(rows) for _, rows in writes)
+        self.logger.info(
+            f"Incremental plan: {len(writes)}/{len(self.blocks)} partitions changed ({changed_rows} rows), "
+            f"{len(requests)} row insert/delete requests."
+        )
+        return requests, writes
+
+    def fall_back_to_full_rewrite(self) -> List[List[Any]]:
+        # Bỏ kế hoạch delta: trả lại toàn bộ dòng theo thứ tự khối để ghi lại sheet từ dòng 2
+        self.full_rewrite = True
+        self.full_rewrite_reason = "partition layout no longer matches the stored state"
+        rows = [row for block in self.blocks for row in (block.rows or [])]
+        for block in self.blocks:
+            block.rows = None
+        return rows
+
+    def commit(self, grid_rows: int):
+        partitions = []
+        row = 2
+        for block in self.blocks:
+            partitions.append(PartitionState(block.partition_key, row, block.row_count, block.content_hash))
+            row += block.row_count
+        self.store.save(self.report_name, ReportState(self.period, self.sql_hash, grid_rows, partitions, self.target))
+        self.logger.info(f"Saved fingerprints for {len(partitions)} partitions ({row - 2} rows).")
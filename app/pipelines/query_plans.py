@@ -0,0 +1,107 @@
+import json
+import time
+import logging
+from collections import Counter
+from typing import Any, Dict, List, Optional
+from ..storage.query_plans import QueryPlanStore, QueryPlanRecord
+from ..utils.metrics import metrics
+
+# Ngưỡng coi là thay đổi đáng kể so với plan đã lưu lần trước
+COST_CHANGE_RATIO = 2.0
+BUFFER_CHANGE_RATIO = 2.0
+# Bỏ qua dao động số block đọc khi cả hai lần đều nhỏ (cache của OS/Postgres khác nhau giữa các lần chạy)
+MIN_BUFFER_BLOCKS = 1000
+
+def _node_signature(node: Dict[str, Any]) -> str:
+    signature = node.get('Node Type', '?')
+    if node.get('Relation Name'):
+        signature += f" on {node['Relation Name']}"
+    subplan = node.get('Subplan Name') or ''
+    if subplan:
+        # "hashed SubPlan 2" -> "hashed SubPlan": IN (select ...) chuyển giữa hashed và từng dòng là kiểu lật plan hay gặp
+        signature = f"{'hashed ' if subplan.startswith('hashed') else ''}SubPlan: {signature}"
+    return signature
+
+def summarize_plan(report: str, database: str, start_batch: str, end_batch: str, sql_hash: str, explain_output: Any) -> QueryPlanRecord:
+    if isinstance(explain_output, str):
+        explain_output = json.loads(explain_output)
+    top = explain_output[0] if isinstance(explain_output, list) else explain_output
+    root = top['Plan']
+    node_types = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        node_types.append(_node_signature(node))
+        stack.extend(node.get('Plans', []))
+    # Số block của nút gốc đã cộng dồn các nút con
+    return QueryPlanRecord(
+        report=report,
+        database=database,
+        captured_at=time.time(),
+        start_batch=start_batch,
+        end_batch=end_batch,
+        sql_hash=sql_hash,
+        total_cost=float(root.get('Total Cost', 0.0)),
+        execution_ms=float(top.get('Execution Time', 0.0)),
+        actual_rows=int(root.get('Actual Rows', 0)),
+        shared_read_blocks=int(root.get('Shared Read Blocks', 0)),
+        shared_hit_blocks=int(root.get('Shared Hit Blocks', 0)),
+        node_types=sorted(node_types),
+        plan=explain_output
+    )
+
+def _ratio(previous: float, current: float) -> float:
+    low, high = sorted((previous, current))
+    return high / low if low > 0 else (float('inf') if high > 0 else 1.0)
+
+def compare_plans(previous: QueryPlanRecord, current: QueryPlanRecord) -> List[str]:
+    changes = []
+    if previous.sql_hash != current.sql_hash:
+        changes.append("SQL changed since the previous plan")
+    if _ratio(previous.total_cost, current.total_cost) >= COST_CHANGE_RATIO:
+        changes.append(f"total cost {previous.total_cost:.0f} -> {current.total_cost:.0f}")
+    if (max(previous.shared_read_blocks, current.shared_read_blocks) >= MIN_BUFFER_BLOCKS
+            and _ratio(previous.shared_read_blocks, current.shared_read_blocks) >= BUFFER_CHANGE_RATIO):
+        changes.append(f"shared blocks read {previous.shared_read_blocks} -> {current.shared_read_blocks}")
+    added = Counter(current.node_types) - Counter(previous.node_types)
+    removed = Counter(previous.node_types) - Counter(current.node_types)
+    if added or removed:
+        changes.append(f"plan nodes changed: +{sorted(added.elements())} -{sorted(removed.elements())}")
+    return changes
+
+# Lưu plan EXPLAIN (ANALYZE, BUFFERS) của một lô mẫu mỗi lần chạy và so với plan lần trước của cùng báo cáo / DB
+class QueryPlanTracker:
+    def __init__(self, store: QueryPlanStore, report_name: str, sql_hash: str, logger: logging.Logger):
+        self.store = store
+        self.report_name = report_name
+        self.sql_hash = sql_hash
+        self.logger = logger
+
+    def record(self, database: str, start_batch: str, end_batch: str, explain_output: Any) -> List[str]:
+        current = summarize_plan(self.report_name, database, start_batch, end_batch, self.sql_hash, explain_output)
+        previous = self.store.latest(self.report_name, database)
+        self.store.add(current)
+
+        labels = {'report': self.report_name, 'database': database}
+        metrics.set('query_plan_total_cost', current.total_cost, **labels)
+        metrics.set('query_plan_execution_ms', current.execution_ms, **labels)
+        metrics.set('query_plan_shared_read_blocks', current.shared_read_blocks, **labels)
+        summary = (f"cost {current.total_cost:.0f}, {current.execution_ms:.0f} ms, {current.actual_rows} rows,"
+                   f" blocks read/hit {current.shared_read_blocks}/{current.shared_hit_blocks}")
+        if previous is None:
+            self.logger.info(f"Captured first query plan on {database} for batch {start_batch} to {end_batch}: {summary}.")
+            return []
+
+        changes = compare_plans(previous, current)
+        if changes:
+            metrics.inc('query_plan_changes', **labels)
+            # Kèm số dòng và cửa sổ ngày để phân biệt lật plan với dữ liệu tăng
+            self.logger.warning(
+                f"Query plan on {database} changed since {time.strftime('%Y-%m-%d %H:%M', time.localtime(previous.captured_at))}: "
+                f"{'; '.join(changes)}. Rows {previous.actual_rows} -> {current.actual_rows}"
+                f" (batch {previous.start_batch}..{previous.end_batch} vs {start_batch}..{end_batch}),"
+                f" execution {previous.execution_ms:.0f} -> {current.execution_ms:.0f} ms."
+            )
+        else:
+            self.logger.info(f"Query plan on {database} unchanged: {summary}.")
+        return changes
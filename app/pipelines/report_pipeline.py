@@ -1,10 +1,33 @@
+import os
+import uuid
+import time
+import hashlib
 import logging
-from typing import Tuple, List, Optional
+import threading
+import psycopg2
+from collections import deque
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import Any, Dict, Tuple, List, Optional, Iterator, Iterable
 from ..config.settings import ReportConfig, AppConfig
-from ..connectors.postgres import PostgresConnector
-from ..connectors.sheets import GoogleSheetsClient
+from ..connectors.postgres import PostgresConnector, PostgresConnectionPool
+from ..connectors.sheets import GoogleSheetsClient, SheetRangeWriter, SPREADSHEET_CELL_LIMIT
+from .incremental import IncrementalPlanner, fingerprint_rows
+from .batching import AdaptiveDateBatcher
+from .checkpoint import RunCheckpoint, ResumePlan
+from .query_plans import QueryPlanTracker
+from ..storage.partition_state import PartitionStateStore
+from ..storage.result_cache import ResultCache
+from ..storage.batch_history import BatchHistoryStore
+from ..storage.run_journal import RunJournalStore, JournalChunk
+from ..storage.query_plans import QueryPlanStore
+from ..utils.sql import to_prepared_query, prepared_statement_name
 from ..utils.dates import get_report_date_range, generate_date_batches
-from ..utils.helpers import convert_dates_to_string, chunk_data, number_to_column, column_to_number
+from ..utils.transform import (build_converters, build_text_converters, build_typed_converters, build_typed_text_converters,
+                               date_column_indices, transform_rows, SHEETS_DATE_PATTERN, TEXT_OID)
+from ..utils.metrics import metrics
+from ..utils.helpers import chunk_data, chunk_iterable, prefetch_iterable, number_to_column, column_to_number, sort_rows_nulls_last
 
 class ReportPipeline:
 
@@ -12,14 +35,51 @@ class ReportPipeline:
                  report_config: ReportConfig,
                  app_config: AppConfig,
                  db_connector: PostgresConnector,
-                 sheets_client: GoogleSheetsClient):
+                 sheets_client: GoogleSheetsClient,
+                 db_pool: Optional[PostgresConnectionPool] = None,
+                 shard_pools: Optional[List[PostgresConnectionPool]] = None,
+                 run_key: Optional[str] = None):
 
         self.report_config = report_config
         self.app_config = app_config
         self.db = db_connector
         self.sheets = sheets_client
+        self.db_pool = db_pool
+        # Một pool cho mỗi DATABASE_* khi báo cáo trích xuất từ nhiều chi nhánh
+        self.shard_pools = shard_pools or []
+        # Định danh lần chạy của cả tiến trình: các báo cáo có cùng run_key dùng chung bảng TEMP của prelude
+        self.run_key = run_key
+        self._shard_sort_indices: Optional[List[int]] = None
         self.logger = logging.getLogger(f"ReportPipeline.{self.report_config.name}")
         self._sheet_id: Optional[int] = None # Cache sheet_id
+        self._writer: Optional[SheetRangeWriter] = None
+        self._prelude_key: Optional[str] = None
+        self._prepared = self._build_prepared_query()
+        self._batcher: Optional[AdaptiveDateBatcher] = None
+        self._converters: Optional[list] = None
+        # value_encoding = typed: các cột ngày (theo thứ tự cột kết quả) chờ đặt định dạng sau khi ghi xong
+        self._pending_date_columns: List[int] = []
+        self._journal: Optional[RunCheckpoint] = None
+        # (sheetId tab thật, sheetId tab ẩn) khi overwrite_method = shadow_swap
+        self._shadow: Optional[Tuple[int, int]] = None
+        # Vị trí ghi khi không dùng writer (values.append) và lô ngày / chunk đang ghi, phục vụ nhật ký chạy
+        self._next_row = 0
+        self._batch_window: Optional[Tuple[str, str]] = None
+        self._chunk_index = 0
+        self._batch_rows_written = 0
+        self._resume_window: Optional[Tuple[str, str]] = None
+        self._resume_chunks: Dict[int, JournalChunk] = {}
+        # CaptureQueryPlans: một lô mẫu mỗi DB trong mỗi lần chạy (các worker trích xuất / shard chạy song song)
+        self._plan_tracker: Optional[QueryPlanTracker] = None
+        self._plans_captured = set()
+        self._plan_lock = threading.Lock()
+        self._cache: Optional[ResultCache] = None
+        if self.app_config.result_cache:
+            self._cache = ResultCache(
+                os.path.join(self.app_config.state_dir, 'result_cache'),
+                ttl_seconds=self.app_config.cache_ttl_hours * 3600,
+                max_bytes=self.app_config.cache_max_mb * 1024 * 1024
+            )
 
     def _prepare_query(self, start_batch: str, end_batch: str) -> str:
         return self.report_config.sql_query.replace(
@@ -28,33 +88,351 @@ class ReportPipeline:
             'date_end_scan_placeholder', end_batch
         )
 
-    def _extract(self, start_batch: str, end_batch: str) -> Tuple[List[tuple], int]:
+    def _build_prepared_query(self) -> Optional[Tuple[str, str, List[str]]]:
+        if not self.app_config.prepared_statements:
+            return None
+        translated = to_prepared_query(self.report_config.sql_query)
+        if translated is None:
+            self.logger.warning("Date placeholders could not be bound as parameters. Using text substitution for batch queries.")
+            return None
+        sql, params = translated
+        return prepared_statement_name(sql), sql, params
+
+    def _execute_batch(self, db: PostgresConnector, start_batch: str, end_batch: str) -> Tuple[List[tuple], int]:
+        prepared = self._prepared
+        if prepared:
+            name, sql, params = prepared
+            try:
+                if db.prepare(name, sql):
+                    self.logger.info(f"Prepared batch query as '{name}' on this DB session.")
+            except psycopg2.Error as e:
+                self.logger.warning(f"Could not prepare batch query ({e}). Falling back to text substitution.")
+                self._prepared = None
+            else:
+                values = {'date_start_scan_placeholder': start_batch, 'date_end_scan_placeholder': end_batch}
+                return db.execute_prepared(name, sql, [values[p] for p in params])
+        return db.execute_query(self._prepare_query(start_batch, end_batch))
+
+    def _capture_plan(self, db: PostgresConnector, start_batch: str, end_batch: str, use_prepared: bool = True):
+        if self._plan_tracker is None:
+            return
+        database = db.config.name
+        with self._plan_lock:
+            if database in self._plans_captured:
+                return
+            self._plans_captured.add(database)
+        prepared = self._prepared if use_prepared else None
+        if prepared:
+            # EXPLAIN EXECUTE: đúng plan (generic/custom) mà prepared statement đang dùng cho các lô
+            name, _, params = prepared
+            values = {'date_start_scan_placeholder': start_batch, 'date_end_scan_placeholder': end_batch}
+            statement, args = f"EXECUTE {name} ({', '.join(['%s'] * len(params))})" if params else f"EXECUTE {name}", [values[p] for p in params]
+        else:
+            statement, args = self._prepare_query(start_batch, end_batch), None
+        self.logger.info(f"Capturing query plan on {database} for batch {start_batch} to {end_batch} (runs the query once more).")
+        try:
+            self._plan_tracker.record(database, start_batch, end_batch, db.explain(statement, args))
+        except Exception as e:
+            # Thu thập plan chỉ phục vụ điều tra, không làm hỏng lần chạy báo cáo
+            self.logger.warning(f"Could not capture query plan on {database}: {e}")
+
+    def _ensure_prelude(self, db: PostgresConnector):
+        if not self.report_config.sql_prelude:
+            return
+        if db.run_prelude(self._prelude_key, self.report_config.sql_prelude):
+            self.logger.info("Materialized SQL prelude into TEMP tables for this DB session.")
+
+    def _cache_key(self, start_batch: str, end_batch: str) -> Optional[str]:
+        if self._cache is None:
+            return None
+        # Chỉ cache lô ngày đã "đóng": tháng trước, hoặc đã qua CacheSettleDays ngày
+        settled_before = date.today() - timedelta(days=self.app_config.cache_settle_days)
+        if self.report_config.date_range_strategy != 'previous_month' and end_batch >= settled_before.isoformat():
+            return None
+        # Cùng câu SQL trên DB chi nhánh khác (databases = DATABASE_CN2) là kết quả khác: khóa luôn gồm DB nguồn
+        database = lambda config: f"{config.host}:{config.port}/{config.dbname}"
+        sql = f"{self.report_config.sql_prelude or ''}\n{self.report_config.sql_query}"
+        if self.shard_pools:
+            # Kết quả đã gộp phụ thuộc vào tập DB, mã chi nhánh và thứ tự gộp
+            shards = ','.join(f"{database(pool.config)}={pool.config.branch}" for pool in self.shard_pools)
+            sql = f"{sql}\n-- shards: {shards} order: {','.join(self.report_config.shard_order_by)}"
+        else:
+            sql = f"{sql}\n-- database: {database(self.db.config)}"
+        return ResultCache.make_key(sql, start_batch, end_batch)
+
+    def _load_cached_batch(self, start_batch: str, end_batch: str) -> Optional[Tuple[List[tuple], int]]:
+        key = self._cache_key(start_batch, end_batch)
+        if key is None or self.app_config.refresh_cache:
+            return None
+        cached = self._cache.get(key)
+        if cached is None:
+            return None
+        data, num_columns, column_types = cached
+        self._remember_column_types(column_types)
+        metrics.inc('cache_hits', report=self.report_config.name)
+        metrics.inc('rows_extracted', len(data), report=self.report_config.name, source='cache')
+        self.logger.info(f"Batch {start_batch} to {end_batch} loaded {len(data)} records from result cache.")
+        return data, num_columns
+
+    def _query_batch(self, start_batch: str, end_batch: str, db: Optional[PostgresConnector]) -> Tuple[List[tuple], int]:
         self.logger.info(f"Extracting data for batch: {start_batch} to {end_batch}")
-        query = self._prepare_query(start_batch, end_batch)
-        data, num_columns = self.db.execute_query(query)
-        self.logger.info(f"Batch returned {len(data)} records.")
+        started = time.monotonic()
+        if self.shard_pools:
+            data, num_columns, column_types = self._execute_shards(start_batch, end_batch)
+        else:
+            self._ensure_prelude(db)
+            data, num_columns = self._execute_batch(db, start_batch, end_batch)
+            column_types = db.column_types
+            self._capture_plan(db, start_batch, end_batch)
+        elapsed = time.monotonic() - started
+        metrics.observe('batch_query_seconds', elapsed, report=self.report_config.name)
+        metrics.inc('rows_extracted', len(data), report=self.report_config.name, source='db')
+        self._remember_column_types(column_types)
+        self.logger.info(f"Batch {start_batch} to {end_batch} returned {len(data)} records in {elapsed:.1f}s.")
+        if self._batcher:
+            self._batcher.record(start_batch, end_batch, len(data), elapsed)
+        key = self._cache_key(start_batch, end_batch)
+        if key is not None:
+            try:
+                self._cache.put(key, data, num_columns, column_types)
+            except OSError as e:
+                self.logger.warning(f"Could not write result cache for batch {start_batch} to {end_batch}: {e}")
         return data, num_columns
 
+    def _extract(self, start_batch: str, end_batch: str, db: Optional[PostgresConnector] = None) -> Tuple[List[tuple], int]:
+        cached = self._load_cached_batch(start_batch, end_batch)
+        if cached is not None:
+            return cached
+        return self._query_batch(start_batch, end_batch, db or self.db)
+
+    def _execute_shards(self, start_batch: str, end_batch: str) -> Tuple[List[tuple], int, Optional[List[int]]]:
+        # Mọi chi nhánh truy vấn song song trên pool riêng: thời gian lô ~ chi nhánh chậm nhất thay vì tổng các chi nhánh
+        with ThreadPoolExecutor(max_workers=len(self.shard_pools), thread_name_prefix=f"shard-{self.report_config.name}") as executor:
+            futures = [executor.submit(self._query_shard, pool, start_batch, end_batch) for pool in self.shard_pools]
+            results = [future.result() for future in futures]
+
+        num_columns = next((n for _, n, _ in results if n), 0)
+        column_types = next((types for _, _, types in results if types), None)
+        # Cột mã chi nhánh (text) đứng đầu mỗi dòng
+        data = [(pool.config.branch,) + tuple(row) for pool, (rows, _, _) in zip(self.shard_pools, results) for row in rows]
+        if self._shard_sort_indices:
+            # Không dựa vào ORDER BY của từng shard (câu SQL có thể sắp theo cột khác): sắp lại cả lô theo shard_order_by.
+            # Sort ổn định (Timsort tận dụng các đoạn đã sắp sẵn của từng shard), khóa bằng nhau giữ thứ tự databases
+            data = sort_rows_nulls_last(data, [i + 1 for i in self._shard_sort_indices])
+        return data, num_columns + 1, ([TEXT_OID] + list(column_types)) if column_types else None
+
+    def _query_shard(self, pool: PostgresConnectionPool, start_batch: str, end_batch: str) -> Tuple[List[tuple], int, Optional[List[int]]]:
+        with pool.connector() as db:
+            self._ensure_prelude(db)
+            started = time.monotonic()
+            data, num_columns = self._execute_batch(db, start_batch, end_batch)
+            elapsed = time.monotonic() - started
+            metrics.observe('shard_query_seconds', elapsed, report=self.report_config.name, database=pool.config.name)
+            self.logger.debug(f"Shard {pool.config.name} returned {len(data)} records for {start_batch} to {end_batch} in {elapsed:.1f}s.")
+            column_types = db.column_types
+            self._capture_plan(db, start_batch, end_batch)
+            return data, num_columns, column_types
+
+    def _resolve_shard_order(self):
+        if not self.shard_pools or not self.report_config.shard_order_by:
+            return
+        # Tên cột lấy từ kết quả thật của câu SQL (LIMIT 0) trên DB đầu tiên, cấu hình sai báo lỗi trước khi đụng vào sheet
+        self._ensure_prelude(self.db)
+        today = date.today().isoformat()
+        column_names = [name.lower() for name in self.db.describe(self._prepare_query(today, today))]
+        missing = [c for c in self.report_config.shard_order_by if c.lower() not in column_names]
+        if missing:
+            raise ValueError(f"shard_order_by columns {missing} are not returned by the query. Available: {column_names}")
+        self._shard_sort_indices = [column_names.index(c.lower()) for c in self.report_config.shard_order_by]
+
+    def _extract_pooled(self, start_batch: str, end_batch: str) -> Tuple[List[tuple], int]:
+        cached = self._load_cached_batch(start_batch, end_batch)
+        if cached is not None:
+            return cached
+        if self.shard_pools:
+            # Truy vấn shard tự lấy kết nối từ pool của từng chi nhánh
+            return self._query_batch(start_batch, end_batch, None)
+        with self.db_pool.connector() as db:
+            return self._query_batch(start_batch, end_batch, db)
+
+    def _iter_extracted_batches(self, date_batches: Iterable[Tuple[str, str]]) -> Iterator[Tuple[Tuple[str, str], Tuple[List[tuple], int]]]:
+        workers = self.app_config.extract_workers
+        if workers <= 1 or self.db_pool is None:
+            for (start_batch, end_batch) in date_batches:
+                yield (start_batch, end_batch), self._extract(start_batch, end_batch)
+            return
+
+        self.logger.info(f"Extracting date batches in parallel with {workers} workers.")
+        # Giữ tối đa `workers` lô đang chạy; trả kết quả theo đúng thứ tự ngày
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"extract-{self.report_config.name}") as executor:
+            try:
+                for batch in date_batches:
+                    pending.append((batch, executor.submit(self._extract_pooled, *batch)))
+                    if len(pending) >= workers:
+                        batch, future = pending.popleft()
+                        yield batch, future.result()
+                while pending:
+                    batch, future = pending.popleft()
+                    yield batch, future.result()
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+    def _remember_column_types(self, column_types: Optional[List[int]], text_values: bool = False):
+        # Cùng một câu SQL nên kiểu cột giống nhau ở mọi lô: chỉ dựng converter một lần
+        if self._converters is None and column_types:
+            typed = self.report_config.value_encoding == 'typed'
+            if text_values:
+                self._converters = build_typed_text_converters(column_types) if typed else build_text_converters(column_types)
+            else:
+                self._converters = build_typed_converters(column_types) if typed else build_converters(column_types)
+            self._note_date_columns(date_column_indices(column_types))
+
+    def _note_date_columns(self, date_columns: List[int]):
+        # typed ghi số serial nên luôn cần định dạng cột; user_entered qua tab ẩn cũng cần vì copyPaste chỉ chép giá trị,
+        # bỏ mất định dạng ngày Sheets tự gán khi phân tích chuỗi ngày (ô sẽ hiện số serial)
+        if self.report_config.value_encoding == 'typed' or self._shadow:
+            self._pending_date_columns = date_columns
+
+    def _value_input_option(self) -> str:
+        # typed: giá trị đã đúng kiểu nên ghi RAW, Sheets không phải phân tích lại từng ô theo locale
+        return 'RAW' if self.report_config.value_encoding == 'typed' else 'USER_ENTERED'
+
+    def _take_column_format_requests(self, sheet_id: int) -> List[Dict[str, Any]]:
+        # Định dạng ngày đặt một lần cho cả cột (từ dòng 2 tới hết lưới) thay vì để Sheets đoán theo từng ô
+        date_columns, self._pending_date_columns = self._pending_date_columns, []
+        start_col_index = column_to_number(self.report_config.update_column_letter) - 1
+        return [{'repeatCell': {
+            'range': {'sheetId': sheet_id, 'startRowIndex': 1,
+                      'startColumnIndex': start_col_index + i, 'endColumnIndex': start_col_index + i + 1},
+            'cell': {'userEnteredFormat': {'numberFormat': {'type': 'DATE', 'pattern': SHEETS_DATE_PATTERN}}},
+            'fields': 'userEnteredFormat.numberFormat'
+        }} for i in date_columns]
+
+    def _apply_column_formats(self):
+        if not self._pending_date_columns:
+            return
+        sheet_id = self.sheets.get_sheet_id_by_name(self.report_config.spreadsheet_id, self.report_config.sheet_name)
+        if sheet_id is None:
+            return
+        requests = self._take_column_format_requests(sheet_id)
+        self.logger.info(f"Applying date format to {len(requests)} columns.")
+        self.sheets.batch_update(self.report_config.spreadsheet_id, requests)
+
+    def _transform(self, data: List[tuple]) -> List[List[Any]]:
+        with metrics.timer('transform_seconds', report=self.report_config.name):
+            rows = transform_rows(data, self._converters)
+        metrics.inc('rows_transformed', len(rows), report=self.report_config.name)
+        return rows
+
     def _load_and_transform(self, data: List[tuple]):
         if not data:
             self.logger.info("No data received in _load_and_transform. Skipping.")
             return
         self.logger.debug(f"Transforming {len(data)} records...")
-        data_to_write = convert_dates_to_string(data)
+        data_to_write = self._transform(data)
         self.logger.info(f"Splitting {len(data_to_write)} records into chunks of {self.app_config.batch_rows}...")
-        for data_chunk in chunk_data(data_to_write, self.app_config.batch_rows):
-            if not data_chunk: continue
-            self.logger.debug(f"Appending chunk of {len(data_chunk)} rows.")
-            self.sheets.append_range(
-                spreadsheet_id=self.report_config.spreadsheet_id,
-                sheet_name=self.report_config.sheet_name,
-                data=data_chunk
-            )
+        self._write_chunks(chunk_data(data_to_write, self.app_config.batch_rows))
         self.logger.info("Finished loading data for this date batch.")
 
+    def _write_chunks(self, chunks: Iterable[List[list]]) -> Tuple[int, int]:
+        rows_written = 0
+        num_columns = 0
+        for data_chunk in chunks:
+            if not data_chunk: continue
+            chunk_index = self._chunk_index
+            self._chunk_index += 1
+            num_columns = num_columns or len(data_chunk[0])
+            if self._skip_resumed_chunk(chunk_index, data_chunk):
+                rows_written += len(data_chunk)
+                self._batch_rows_written += len(data_chunk)
+                continue
+            start_row = self._writer.next_row if self._writer else self._next_row
+            with metrics.timer('sheet_write_seconds', report=self.report_config.name):
+                if self._writer:
+                    self.logger.debug(f"Queueing chunk of {len(data_chunk)} rows at row {self._writer.next_row}.")
+                    self._writer.write(data_chunk)
+                else:
+                    self.logger.debug(f"Appending chunk of {len(data_chunk)} rows.")
+                    self.sheets.append_range(
+                        spreadsheet_id=self.report_config.spreadsheet_id,
+                        sheet_name=self.report_config.sheet_name,
+                        data=data_chunk,
+                        value_input_option=self._value_input_option()
+                    )
+            rows_written += len(data_chunk)
+            self._batch_rows_written += len(data_chunk)
+            self._next_row = start_row + len(data_chunk)
+            metrics.inc('rows_written', len(data_chunk), report=self.report_config.name)
+            if self._journal:
+                self._journal.chunk_written(self._batch_window, chunk_index, start_row, data_chunk)
+                self._journal.durable_through(self._durable_row())
+        return rows_written, num_columns
+
+    def _durable_row(self) -> int:
+        # values.append xong là đã nằm trên sheet; writer batch_update chỉ chắc chắn tới lần flush gần nhất
+        return self._writer.flushed_through if self._writer else self._next_row - 1
+
+    def _begin_batch(self, start_batch: str, end_batch: str):
+        self._batch_window = (start_batch, end_batch)
+        self._chunk_index = 0
+        self._batch_rows_written = 0
+
+    def _end_batch(self):
+        if self._journal:
+            next_row = self._writer.next_row if self._writer else self._next_row
+            self._journal.batch_written(self._batch_window, self._batch_rows_written, next_row)
+            self._journal.durable_through(self._durable_row())
+
+    def _skip_resumed_chunk(self, chunk_index: int, data_chunk: List[list]) -> bool:
+        if not self._resume_chunks or self._batch_window != self._resume_window:
+            return False
+        expected = self._resume_chunks.get(chunk_index)
+        if expected is not None and expected.row_count == len(data_chunk) and expected.content_hash == fingerprint_rows(data_chunk):
+            # Chunk đã ghi ở lần chạy lỗi và dữ liệu không đổi: bỏ qua, ghi tiếp sau nó
+            self._writer.seek(expected.start_row + expected.row_count)
+            self._writer.max_columns = max(self._writer.max_columns, max(len(r) for r in data_chunk))
+            metrics.inc('resume_chunks_skipped', report=self.report_config.name)
+            return True
+        row = expected.start_row if expected is not None else self._writer.next_row
+        self.logger.info(f"Chunk {chunk_index} of batch {self._batch_window[0]} to {self._batch_window[1]} differs from the journal; rewriting from row {row}.")
+        self._writer.seek(row)
+        self._resume_chunks = {}
+        return False
+
+    def _transform_streamed(self, rows: List[tuple]) -> List[List[Any]]:
+        # Server-side cursor chỉ có description sau lần fetch đầu tiên
+        self._remember_column_types(self.db.column_types, text_values=self.report_config.extract_mode == 'copy')
+        return self._transform(rows)
+
+    def _stream_and_load(self, start_batch: str, end_batch: str) -> Tuple[int, int]:
+        self._ensure_prelude(self.db)
+        self._begin_batch(start_batch, end_batch)
+        self.logger.info(f"Streaming data ({self.report_config.extract_mode}) for batch: {start_batch} to {end_batch}")
+        query = self._prepare_query(start_batch, end_batch)
+        # Stream/COPY không dùng prepared statement: lấy plan của câu SQL text trước khi mở cursor
+        self._capture_plan(self.db, start_batch, end_batch, use_prepared=False)
+        if self.report_config.extract_mode == 'copy':
+            rows = self.db.iter_copy(query)
+        else:
+            rows = self.db.iter_query(query, self.app_config.batch_rows)
+        # Generator xuyên suốt: cursor -> chuyển đổi -> chia chunk -> Sheets, chỉ giữ ~BatchRows dòng
+        chunks = (self._transform_streamed(chunk) for chunk in chunk_iterable(rows, self.app_config.batch_rows))
+        with metrics.timer('batch_stream_seconds', report=self.report_config.name):
+            rows_written, num_columns = self._write_chunks(chunks)
+        metrics.inc('rows_extracted', rows_written, report=self.report_config.name, source='db')
+        self._end_batch()
+        self.logger.info(f"Batch {start_batch} to {end_batch} streamed {rows_written} records.")
+        if self._batcher:
+            # Thời gian stream gồm cả ghi Sheets nên chỉ dùng số dòng để điều chỉnh cửa sổ
+            self._batcher.record(start_batch, end_batch, rows_written, None)
+        return rows_written, num_columns
+
     def _clear_sheet_content(self):
          self.logger.warning(f"Clearing content (from row 2) in sheet: {self.report_config.sheet_name}")
-         last_row = self.sheets.get_last_row(
+         # Cận trên từ metadata (dòng cuối đã biết hoặc số dòng lưới) thay vì tải cả cột A
+         last_row = self.sheets.get_row_bound(
              self.report_config.spreadsheet_id,
              self.report_config.sheet_name
          )
@@ -73,7 +451,7 @@ class ReportPipeline:
     def _delete_sheet_rows(self):
         self.logger.warning(f"Preparing to delete rows (from row 2) in sheet: {self.report_config.sheet_name}")
 
-        last_row = self.sheets.get_last_row(
+        last_row = self.sheets.get_row_bound(
             self.report_config.spreadsheet_id,
             self.report_config.sheet_name
         )
@@ -109,7 +487,298 @@ class ReportPipeline:
             range_to_clear_row2
         )
 
-    def run(self):
+    def _trim_sheet_tail(self):
+        # Ghi đè tại chỗ xong thì chỉ dọn phần đuôi cũ, gộp trong một lệnh batchUpdate
+        last_written_row = self._writer.next_row - 1
+        sheet_id, grid_rows = self._writer.load_grid()
+        requests = self._tail_trim_requests(sheet_id, grid_rows, last_written_row, self._writer.max_columns)
+        if requests:
+            self.logger.info(f"Trimming leftover rows after row {last_written_row} (grid had {grid_rows} rows).")
+            self.sheets.batch_update(self.report_config.spreadsheet_id, requests)
+        else:
+            self.logger.info("No leftover rows to trim.")
+
+    def _tail_trim_requests(self, sheet_id: int, grid_rows: int, last_written_row: int, max_columns: int) -> List[Dict[str, Any]]:
+        start_col_index = column_to_number(self.report_config.update_column_letter) - 1
+        data_end_col_index = start_col_index + max_columns
+        clear_end_col = self.report_config.clear_end_column if self.report_config.clear_end_column else "Z"
+        clear_end_col_index = max(column_to_number(clear_end_col), data_end_col_index)
+
+        def clear_cells(start_row_index, end_row_index, start_column_index, end_column_index):
+            return {'updateCells': {
+                'range': {
+                    'sheetId': sheet_id,
+                    'startRowIndex': start_row_index,
+                    'endRowIndex': end_row_index,
+                    'startColumnIndex': start_column_index,
+                    'endColumnIndex': end_column_index
+                },
+                'fields': 'userEnteredValue'
+            }}
+
+        requests = []
+        # Các cột thừa bên phải dữ liệu mới trên những dòng vừa ghi
+        # Chạy tiếp (--resume) mà không ghi dòng nào thì chưa biết số cột dữ liệu: không dọn cột
+        if last_written_row >= 2 and max_columns and clear_end_col_index > data_end_col_index:
+            requests.append(clear_cells(1, last_written_row, data_end_col_index, clear_end_col_index))
+
+        if grid_rows > last_written_row:
+            if self.report_config.clear_method == 'delete_rows':
+                # Google Sheets không cho xóa hết các dòng không cố định: giữ tối thiểu dòng 2
+                keep_rows = max(last_written_row, 2)
+                if last_written_row < 2:
+                    requests.append(clear_cells(1, 2, start_col_index, clear_end_col_index))
+                if grid_rows > keep_rows:
+                    requests.append({'updateSheetProperties': {
+                        'properties': {'sheetId': sheet_id, 'gridProperties': {'rowCount': keep_rows}},
+                        'fields': 'gridProperties.rowCount'
+                    }})
+            else:
+                requests.append(clear_cells(max(last_written_row, 1), grid_rows, start_col_index, clear_end_col_index))
+        return requests
+
+    def _staging_sheet_name(self) -> str:
+        return f"{self.report_config.sheet_name}__staging"
+
+    def _prepare_shadow_sheet(self) -> bool:
+        # Nạp vào tab ẩn với tốc độ tối đa (không clear, không sleep), tab thật chỉ đổi một lần lúc cuối.
+        # Trả về False nếu tab ẩn làm spreadsheet vượt giới hạn số ô; khi đó báo cáo quay về cách clear_first
+        live = self.sheets.get_sheet_properties(self.report_config.spreadsheet_id, self.report_config.sheet_name)
+        if live is None:
+            raise ValueError(f"Sheet '{self.report_config.sheet_name}' not found in spreadsheet '{self.report_config.spreadsheet_id}'.")
+        staging_name = self._staging_sheet_name()
+        # Lưới ban đầu bằng tab thật để hầu như không phải mở rộng trong lúc nạp
+        grid = live.get('gridProperties', {})
+        staging_grid = {'rowCount': max(grid.get('rowCount', 0), 2), 'columnCount': max(grid.get('columnCount', 0), 26)}
+        requests = []
+        cells = self.sheets.get_cell_count(self.report_config.spreadsheet_id)
+        leftover = None
+        if self.sheets.get_sheet_id_by_name(self.report_config.spreadsheet_id, staging_name, log_missing=False) is not None:
+            leftover = self.sheets.get_sheet_properties(self.report_config.spreadsheet_id, staging_name)
+        if leftover is not None:
+            leftover_grid = leftover.get('gridProperties', {})
+            cells -= leftover_grid.get('rowCount', 0) * leftover_grid.get('columnCount', 0)
+        staging_cells = staging_grid['rowCount'] * staging_grid['columnCount']
+        if cells + staging_cells > SPREADSHEET_CELL_LIMIT:
+            self.logger.warning(f"Staging tab '{staging_name}' would need {staging_cells:,} cells on top of {cells:,} used, "
+                                f"exceeding the {SPREADSHEET_CELL_LIMIT:,}-cell spreadsheet limit. Falling back to clear_first.")
+            return False
+        self.logger.info(f"Overwrite method is 'shadow_swap'. Loading into hidden tab '{staging_name}' and swapping it in at the end.")
+        if leftover is not None:
+            self.logger.warning(f"Replacing staging tab '{staging_name}' left over from an earlier run.")
+            requests.append({'deleteSheet': {'sheetId': leftover['sheetId']}})
+        requests.append({'addSheet': {'properties': {
+            'title': staging_name,
+            'hidden': True,
+            'gridProperties': staging_grid
+        }}})
+        replies = self.sheets.batch_update(self.report_config.spreadsheet_id, requests)
+        staging_id = (replies[-1] if replies else {}).get('addSheet', {}).get('properties', {}).get('sheetId')
+        if staging_id is None:
+            staging_id = self.sheets.get_sheet_id_by_name(self.report_config.spreadsheet_id, staging_name)
+        self._shadow = (live['sheetId'], staging_id)
+        self._writer = self._create_writer(start_row=2, sheet_name=staging_name)
+        return True
+
+    def _drop_shadow_sheet(self):
+        # Lần chạy lỗi: tab thật chưa bị động tới, chỉ cần bỏ tab ẩn (không xóa được thì lần sau sẽ thay nó)
+        _, staging_id = self._shadow
+        self._shadow = None
+        try:
+            self.sheets.batch_update(self.report_config.spreadsheet_id, [{'deleteSheet': {'sheetId': staging_id}}])
+            self.logger.info(f"Deleted staging tab '{self._staging_sheet_name()}' after the failed run.")
+        except Exception as e:
+            self.logger.error(f"Failed to delete staging tab '{self._staging_sheet_name()}': {e}")
+
+    def _swap_shadow_sheet(self):
+        # Một batchUpdate duy nhất (áp dụng nguyên khối): chép giá trị từ tab ẩn sang tab thật, dọn đuôi cũ, xóa tab ẩn.
+        # Chép thay vì đổi tên/đổi chỗ hai tab để giữ nguyên sheetId của tab thật mà công thức, biểu đồ, bộ lọc đang trỏ tới
+        live_id, staging_id = self._shadow
+        last_written_row = self._writer.next_row - 1
+        max_columns = self._writer.max_columns
+        properties = self.sheets.get_sheet_properties(self.report_config.spreadsheet_id, self.report_config.sheet_name)
+        grid_rows = properties.get('gridProperties', {}).get('rowCount', 0) if properties else 0
+        requests = []
+        if last_written_row > grid_rows:
+            requests.append({'appendDimension': {'sheetId': live_id, 'dimension': 'ROWS', 'length': last_written_row - grid_rows}})
+            grid_rows = last_written_row
+        if last_written_row >= 2 and max_columns:
+            start_col_index = column_to_number(self.report_config.update_column_letter) - 1
+            window = {'startRowIndex': 1, 'endRowIndex': last_written_row,
+                      'startColumnIndex': start_col_index, 'endColumnIndex': start_col_index + max_columns}
+            requests.append({'copyPaste': {
+                'source': dict(window, sheetId=staging_id),
+                'destination': dict(window, sheetId=live_id),
+                # Chỉ chép giá trị để giữ định dạng khác của tab thật (màu, cỡ chữ...); định dạng ngày được đặt lại theo cột bên dưới
+                'pasteType': 'PASTE_VALUES',
+                'pasteOrientation': 'NORMAL'
+            }})
+        requests.extend(self._tail_trim_requests(live_id, grid_rows, last_written_row, max_columns))
+        # Định dạng cột ngày (typed hoặc user_entered) đổi cùng lúc với dữ liệu
+        requests.extend(self._take_column_format_requests(live_id))
+        requests.append({'deleteSheet': {'sheetId': staging_id}})
+        self.logger.info(f"Swapping {max(last_written_row - 1, 0)} staged rows into '{self.report_config.sheet_name}' with {len(requests)} requests in one batchUpdate.")
+        self.sheets.batch_update(self.report_config.spreadsheet_id, requests)
+        self._shadow = None
+
+    def _start_incremental(self, period_start) -> IncrementalPlanner:
+        properties = self.sheets.get_sheet_properties(
+            self.report_config.spreadsheet_id,
+            self.report_config.sheet_name
+        )
+        if properties is None:
+            raise ValueError(f"Sheet '{self.report_config.sheet_name}' not found; incremental mode cannot continue.")
+        partition_index = column_to_number(self.report_config.partition_column) - column_to_number(self.report_config.update_column_letter)
+        if partition_index < 0:
+            raise ValueError(f"partition_column {self.report_config.partition_column} is left of update_column_letter {self.report_config.update_column_letter}.")
+        return IncrementalPlanner(
+            store=PartitionStateStore(os.path.join(self.app_config.state_dir, 'pipeline_state.db')),
+            report_name=self.report_config.name,
+            period=period_start.isoformat(),
+            sql_hash=hashlib.sha256(self.report_config.sql_query.encode('utf-8')).hexdigest(),
+            partition_index=partition_index,
+            spreadsheet_id=self.report_config.spreadsheet_id,
+            sheet_id=properties.get('sheetId'),
+            grid_rows=properties.get('gridProperties', {}).get('rowCount', 0),
+            logger=self.logger
+        )
+
+    def _load_incremental_batch(self, incremental: IncrementalPlanner, data: List[tuple]):
+        rows = self._transform(data)
+        # Chế độ full rewrite: ghi ngay theo thứ tự khối; chế độ delta: chỉ giữ lại các khối đã thay đổi
+        ordered_rows = incremental.add_batch(rows)
+        if ordered_rows:
+            self._write_chunks(chunk_data(ordered_rows, self.app_config.batch_rows))
+
+    def _apply_incremental_plan(self, incremental: IncrementalPlanner) -> bool:
+        plan = incremental.plan()
+        if plan is None:
+            return False
+        requests, writes = plan
+        if requests:
+            self.sheets.batch_update(self.report_config.spreadsheet_id, requests)
+            self._writer.reset_grid()
+        for (start_row, rows) in writes:
+            self._writer.seek(start_row)
+            for data_chunk in chunk_data(rows, self.app_config.batch_rows):
+                self._writer.write(data_chunk)
+        self._writer.flush()
+        return True
+
+    def _rewrite_incremental(self, incremental: IncrementalPlanner):
+        # Ghi lại toàn bộ trong cùng lượt chạy, không truy vấn lại DB; phần đuôi cũ được cắt ở _complete_sheet
+        self._writer.seek(2)
+        self._write_chunks(chunk_data(incremental.fall_back_to_full_rewrite(), self.app_config.batch_rows))
+
+    def _load_start_row(self) -> int:
+        if self._writer:
+            return self._writer.next_row
+        if self.report_config.load_strategy == 'overwrite':
+            return 2
+        return self.sheets.get_last_row(
+            self.report_config.spreadsheet_id,
+            self.report_config.sheet_name
+        ) + 1
+
+    def _create_writer(self, start_row: Optional[int] = None, sheet_name: Optional[str] = None) -> SheetRangeWriter:
+        if start_row is None:
+            start_row = self._load_start_row()
+        sheet_name = sheet_name or self.report_config.sheet_name
+        self.logger.info(f"Writing to '{sheet_name}' with coalesced batchUpdate starting at row {start_row}.")
+        return SheetRangeWriter(
+            client=self.sheets,
+            spreadsheet_id=self.report_config.spreadsheet_id,
+            sheet_name=sheet_name,
+            start_row=start_row,
+            start_column=self.report_config.update_column_letter,
+            max_payload_bytes=self.app_config.max_payload_bytes,
+            value_input_option=self._value_input_option()
+        )
+
+    def _prepare_sheet(self, incremental: Optional[IncrementalPlanner]) -> bool:
+        delta_load = incremental is not None and not incremental.full_rewrite
+        write_then_trim = (self.report_config.load_strategy == 'overwrite'
+                           and (self.report_config.overwrite_method == 'write_then_trim' or incremental is not None))
+
+        if delta_load:
+            self.logger.info("Incremental mode: skipping sheet clearing; only changed partitions will be rewritten.")
+        elif self._uses_shadow_sheet(incremental) and self._prepare_shadow_sheet():
+            return False
+        elif write_then_trim:
+            self.logger.info("Overwrite method is 'write_then_trim'. Writing from row 2 in place; leftover rows are trimmed afterwards.")
+        elif self.report_config.load_strategy == 'overwrite':
+            if self.report_config.clear_method == 'delete_rows':
+                self._delete_sheet_rows()
+            else:
+                self._clear_sheet_content()
+        elif self.report_config.load_strategy == 'append':
+            self.logger.info("Load strategy is 'append'. Skipping sheet clearing/deletion.")
+        else:
+            raise ValueError(f"Unknown load strategy: {self.report_config.load_strategy}")
+
+        if self.report_config.write_method == 'batch_update' or write_then_trim:
+            self._writer = self._create_writer()
+        return write_then_trim
+
+    def _uses_shadow_sheet(self, incremental: Optional[IncrementalPlanner]) -> bool:
+        # Incremental ghi lại từng phân vùng ngay trên tab thật nên không đi qua tab ẩn
+        return (self.report_config.load_strategy == 'overwrite'
+                and self.report_config.overwrite_method == 'shadow_swap'
+                and incremental is None)
+
+    def _abort_sheet(self):
+        if self._shadow:
+            self._drop_shadow_sheet()
+
+    def _complete_sheet(self, write_then_trim: bool):
+        if self._writer:
+            self._writer.flush()
+            if self._journal:
+                self._journal.durable_through(self._durable_row())
+        if self._shadow:
+            self._swap_shadow_sheet()
+        if write_then_trim:
+            self._trim_sheet_tail()
+
+    def _start_plan_tracker(self) -> Optional[QueryPlanTracker]:
+        if not self.app_config.capture_query_plans:
+            return None
+        return QueryPlanTracker(
+            store=QueryPlanStore(os.path.join(self.app_config.state_dir, 'pipeline_state.db')),
+            report_name=self.report_config.name,
+            sql_hash=hashlib.sha256(f"{self.report_config.sql_prelude or ''}\n{self.report_config.sql_query}".encode('utf-8')).hexdigest(),
+            logger=self.logger
+        )
+
+    def _start_journal(self, total_start: date, total_end: date) -> Optional[RunCheckpoint]:
+        # Dòng trong tab ẩn chưa phải dòng trên tab thật: shadow_swap chạy lại từ đầu thay vì --resume
+        if not self.app_config.run_journal or self._uses_shadow_sheet(None):
+            return None
+        return RunCheckpoint(
+            store=RunJournalStore(os.path.join(self.app_config.state_dir, 'pipeline_state.db')),
+            report_name=self.report_config.name,
+            period_start=total_start,
+            period_end=total_end,
+            sql_hash=hashlib.sha256(f"{self.report_config.sql_prelude or ''}\n{self.report_config.sql_query}".encode('utf-8')).hexdigest(),
+            load_strategy=self.report_config.load_strategy,
+            batch_rows=self.app_config.batch_rows,
+            logger=self.logger
+        )
+
+    def _prepare_resume(self, plan: ResumePlan) -> bool:
+        # Không xóa sheet: ghi tiếp bằng writer có vị trí tường minh từ sau lô cuối đã ghi xong, rồi dọn phần đuôi cũ
+        self._writer = self._create_writer(start_row=plan.next_row)
+        self._resume_window = plan.partial_window
+        self._resume_chunks = {c.chunk_index: c for c in plan.partial_chunks}
+        metrics.inc('resume_batches_skipped', len(plan.run.batches), report=self.report_config.name)
+        self._journal.resume()
+        return self.report_config.load_strategy == 'overwrite'
+
+    def run(self) -> bool:
+        # Mỗi lần chạy dựng lại bảng TEMP để không dùng dữ liệu cũ của phiên trước
+        self._prelude_key = self.run_key or uuid.uuid4().hex
+        self._plan_tracker = self._start_plan_tracker()
+        self._plans_captured = set()
         self.logger.info(f"--- Pipeline starting for report: {self.report_config.name} (Load Strategy: {self.report_config.load_strategy}, Clear Method: {self.report_config.clear_method}) ---")
 
         estimated_num_columns = 0
@@ -117,36 +786,116 @@ class ReportPipeline:
         try:
             (total_start, total_end) = get_report_date_range(self.report_config.date_range_strategy)
             self.logger.info(f"Total date range: {total_start} to {total_end}")
+            if self.shard_pools:
+                self.logger.info(f"Extracting from {len(self.shard_pools)} databases in parallel: {[pool.config.name for pool in self.shard_pools]}")
+                self._resolve_shard_order()
 
-            if self.report_config.load_strategy == 'overwrite':
-                if self.report_config.clear_method == 'delete_rows':
-                    self._delete_sheet_rows()
-                else:
-                    self._clear_sheet_content()
-            elif self.report_config.load_strategy == 'append':
-                self.logger.info("Load strategy is 'append'. Skipping sheet clearing/deletion.")
+            incremental = None
+            if self.report_config.incremental and self.report_config.load_strategy == 'overwrite':
+                incremental = self._start_incremental(total_start)
+            delta_load = incremental is not None and not incremental.full_rewrite
+
+            # Nhật ký chạy: ghi lại từng chunk / lô ngày đã nằm trên sheet để --resume chạy tiếp sau lỗi
+            resume = None
+            self._journal = self._start_journal(total_start, total_end) if incremental is None else None
+            if self._journal and self.app_config.resume:
+                resume = self._journal.plan_resume()
+            if resume:
+                write_then_trim = self._prepare_resume(resume)
+                batches_start = resume.resume_from
             else:
-                self.logger.error(f"Unknown load strategy: {self.report_config.load_strategy}. Aborting.")
-                return
+                write_then_trim = self._prepare_sheet(incremental)
+                batches_start = total_start
+                if self._journal:
+                    self._next_row = self._load_start_row()
+                    self._journal.start(self._next_row)
 
-            date_batches = generate_date_batches(
-                total_start,
-                total_end,
-                self.app_config.batch_days
-            )
+            if resume and resume.partial_window:
+                # Lô ghi dở chạy lại đúng cửa sổ ngày cũ để so khớp các chunk đã ghi, các lô sau chia như bình thường
+                batches_start = date.fromisoformat(resume.partial_window[1]) + timedelta(days=1)
 
-            first_data_batch = True
-            for (start_batch, end_batch) in date_batches:
-                (data, num_cols) = self._extract(start_batch, end_batch)
-                if first_data_batch and data:
-                     estimated_num_columns = num_cols
-                     first_data_batch = False
-                if data:
-                    self._load_and_transform(data)
-                else:
-                    self.logger.info(f"No data found for batch {start_batch} to {end_batch}. Skipping load.")
+            if self.app_config.adaptive_batching:
+                self._batcher = AdaptiveDateBatcher(
+                    store=BatchHistoryStore(os.path.join(self.app_config.state_dir, 'pipeline_state.db')),
+                    report_name=self.report_config.name,
+                    start_date=batches_start,
+                    end_date=total_end,
+                    initial_days=self.app_config.batch_days,
+                    target_rows=self.app_config.target_batch_rows,
+                    target_seconds=self.app_config.target_batch_seconds,
+                    max_days=self.app_config.max_batch_days,
+                    logger=self.logger
+                )
+                date_batches = iter(self._batcher)
+            else:
+                date_batches = generate_date_batches(
+                    batches_start,
+                    total_end,
+                    self.app_config.batch_days
+                )
+            if resume and resume.partial_window:
+                date_batches = chain([resume.partial_window], date_batches)
+
+            if self.report_config.extract_mode in ('stream', 'copy') and incremental is None:
+                if self.app_config.extract_workers > 1:
+                    self.logger.info(f"Extract mode is '{self.report_config.extract_mode}'. Date batches are streamed sequentially on one connection.")
+                for (start_batch, end_batch) in date_batches:
+                    (rows_written, num_cols) = self._stream_and_load(start_batch, end_batch)
+                    if rows_written:
+                        estimated_num_columns = estimated_num_columns or num_cols
+                    else:
+                        self.logger.info(f"No data found for batch {start_batch} to {end_batch}. Skipping load.")
+            else:
+                extracted_batches = self._iter_extracted_batches(date_batches)
+                if self.app_config.prefetch_batches > 0:
+                    # Trích xuất lô N+1 trong lúc đang ghi lô N lên Sheets
+                    extracted_batches = prefetch_iterable(
+                        extracted_batches,
+                        self.app_config.prefetch_batches,
+                        thread_name=f"prefetch-{self.report_config.name}"
+                    )
+                first_data_batch = True
+                for (start_batch, end_batch), (data, num_cols) in extracted_batches:
+                    if first_data_batch and data:
+                         estimated_num_columns = num_cols
+                         first_data_batch = False
+                    self._begin_batch(start_batch, end_batch)
+                    if data and incremental is not None:
+                        self._load_incremental_batch(incremental, data)
+                    elif data:
+                        self._load_and_transform(data)
+                    else:
+                        self.logger.info(f"No data found for batch {start_batch} to {end_batch}. Skipping load.")
+                    self._end_batch()
+
+            if self._batcher:
+                self._batcher.save()
+
+            if delta_load and not self._apply_incremental_plan(incremental):
+                self.logger.warning("Partition layout no longer matches the stored state. Rewriting the whole sheet from the extracted partitions.")
+                self._rewrite_incremental(incremental)
+                self._complete_sheet(True)
+            elif not delta_load:
+                self._complete_sheet(write_then_trim)
+            self._apply_column_formats()
+
+            if incremental is not None:
+                # Số dòng lưới được lưu sang lần chạy sau nên đọc lại từ API thay vì dùng metadata theo dõi cục bộ
+                properties = self.sheets.get_sheet_properties(
+                    self.report_config.spreadsheet_id,
+                    self.report_config.sheet_name,
+                    refresh=True
+                )
+                incremental.commit(properties.get('gridProperties', {}).get('rowCount', 0))
 
+            if self._journal:
+                self._journal.finish(True)
             self.logger.info(f"--- Pipeline for '{self.report_config.name}' completed successfully (approx. {estimated_num_columns} columns processed). ---")
+            return True
 
         except Exception as e:
-            self.logger.critical(f"FATAL ERROR in pipeline '{self.report_config.name}': {e}", exc_info=True)
\ No newline at end of file
+            self.logger.critical(f"FATAL ERROR in pipeline '{self.report_config.name}': {e}", exc_info=True)
+            if self._journal:
+                self._journal.finish(False)
+            self._abort_sheet()
+            return False
\ No newline at end of file
@@ -0,0 +1,78 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, List, Set, Tuple
+from ..config.settings import ReportConfig
+
+logger = logging.getLogger(__name__)
+
+class ReportScheduler:
+    def __init__(self, max_concurrent: int = 1):
+        self.max_concurrent = max(1, max_concurrent)
+
+    @staticmethod
+    def _target_keys(report: ReportConfig) -> Set[Tuple[str, str]]:
+        # Job của SOURCE_* ghi vào sheet của mọi báo cáo đích
+        return {(r.spreadsheet_id, r.sheet_name) for r in (report.targets or [report])}
+
+    @staticmethod
+    def _report_names(report: ReportConfig) -> List[str]:
+        return [report.name] + [t.name for t in report.targets]
+
+    def run(self, reports: List[ReportConfig], run_report: Callable[[ReportConfig], bool]) -> Dict[str, bool]:
+        selected = {name for r in reports for name in self._report_names(r)}
+        for report in reports:
+            skipped = [d for d in report.depends_on if d not in selected]
+            if skipped:
+                logger.warning(f"Report '{report.name}' depends on {skipped}, which are not part of this run. Ignoring those dependencies.")
+
+        pending: List[ReportConfig] = list(reports)
+        results: Dict[str, bool] = {}
+        busy_targets: Set[Tuple[str, str]] = set()
+        running = {}
+
+        logger.info(f"Scheduling {len(reports)} reports with up to {self.max_concurrent} running concurrently.")
+        with ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix="report") as executor:
+            while pending or running:
+                # Báo cáo phụ thuộc vào báo cáo đã lỗi thì bỏ qua
+                for report in list(pending):
+                    failed = [d for d in report.depends_on if results.get(d) is False]
+                    if failed:
+                        logger.error(f"Skipping report '{report.name}' because its dependencies failed: {failed}")
+                        self._record(results, report, False)
+                        pending.remove(report)
+
+                for report in list(pending):
+                    if len(running) >= self.max_concurrent:
+                        break
+                    if any(d in selected and d not in results for d in report.depends_on):
+                        continue
+                    # Hai báo cáo cùng ghi vào một sheet phải chạy tuần tự
+                    targets = self._target_keys(report)
+                    if targets & busy_targets:
+                        continue
+                    busy_targets |= targets
+                    pending.remove(report)
+                    running[executor.submit(run_report, report)] = report
+
+                if not running:
+                    if pending:
+                        logger.error(f"Unresolvable report dependencies (cycle?): {[r.name for r in pending]}. Skipping them.")
+                        for report in pending:
+                            self._record(results, report, False)
+                    break
+
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    report = running.pop(future)
+                    busy_targets -= self._target_keys(report)
+                    try:
+                        self._record(results, report, bool(future.result()))
+                    except Exception as e:
+                        logger.error(f"Report '{report.name}' raised an unhandled error: {e}", exc_info=True)
+                        self._record(results, report, False)
+
+        return results
+
+    def _record(self, results: Dict[str, bool], report: ReportConfig, ok: bool):
+        for name in self._report_names(report):
+            results[name] = ok
@@ -0,0 +1,140 @@
+import logging
+from datetime import date
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Tuple
+from ..config.settings import ReportConfig, AppConfig
+from ..connectors.postgres import PostgresConnector, PostgresConnectionPool
+from ..connectors.sheets import GoogleSheetsClient
+from ..utils.transform import parse_row_filter, build_row_filter, date_column_indices
+from .incremental import IncrementalPlanner
+from .report_pipeline import ReportPipeline
+
+logger = logging.getLogger(__name__)
+
+def group_shared_sources(reports: List[ReportConfig]) -> List[ReportConfig]:
+    # Các báo cáo cùng SOURCE_* gộp thành một job, đặt ở vị trí của báo cáo đầu tiên trong nhóm
+    jobs: List[ReportConfig] = []
+    groups = {}
+    for report in reports:
+        if report.source is None:
+            jobs.append(report)
+            continue
+        job = groups.get(report.source.name)
+        if job is None:
+            job = ReportConfig(
+                name=report.source.name,
+                sql_query=report.source.sql_query,
+                spreadsheet_id='',
+                sheet_name='',
+                update_column_letter='A',
+                date_range_strategy=report.source.date_range_strategy,
+                extract_mode=report.source.extract_mode,
+                sql_prelude=report.source.sql_prelude
+            )
+            groups[report.source.name] = job
+            jobs.append(job)
+        job.targets.append(report)
+        job.depends_on.extend(d for d in report.depends_on if d not in job.depends_on)
+
+    for job in groups.values():
+        target_names = {t.name for t in job.targets}
+        job.depends_on = [d for d in job.depends_on if d not in target_names]
+        logger.info(f"Source {job.name} is extracted once for reports: {sorted(target_names)}")
+    return jobs
+
+class FanOutTarget:
+    def __init__(self, pipeline: ReportPipeline):
+        self.pipeline = pipeline
+        self.indices: Optional[List[int]] = None
+        self.keep: Optional[Callable[[Sequence[Any]], bool]] = None
+        self.write_then_trim = False
+
+    def select(self, rows: List[List[Any]]) -> List[List[Any]]:
+        if self.keep:
+            rows = [row for row in rows if self.keep(row)]
+        if self.indices is not None:
+            indices = self.indices
+            rows = [[row[i] for i in indices] for row in rows]
+        return rows
+
+# Trích xuất SQL của một SOURCE_* một lần cho mỗi lô ngày rồi ghi cho từng báo cáo đích (chiếu cột + lọc dòng riêng)
+class SharedSourcePipeline(ReportPipeline):
+
+    def __init__(self,
+                 report_config: ReportConfig,
+                 app_config: AppConfig,
+                 db_connector: PostgresConnector,
+                 sheets_client: GoogleSheetsClient,
+                 db_pool: Optional[PostgresConnectionPool] = None,
+                 run_key: Optional[str] = None):
+        super().__init__(report_config, app_config, db_connector, sheets_client, db_pool, run_key=run_key)
+        self.targets = [
+            FanOutTarget(ReportPipeline(target, app_config, db_connector, sheets_client, db_pool, run_key=run_key))
+            for target in report_config.targets
+        ]
+
+    def _resolve_targets(self):
+        # Tên cột lấy từ kết quả thật của câu SQL nguồn (LIMIT 0), nên cấu hình sai báo lỗi trước khi đụng vào sheet
+        self._ensure_prelude(self.db)
+        today = date.today().isoformat()
+        column_names = [name.lower() for name in self.db.describe(self._prepare_query(today, today))]
+        column_index = {}
+        for index, name in enumerate(column_names):
+            column_index.setdefault(name, index)
+
+        for target in self.targets:
+            config = target.pipeline.report_config
+            missing = [c for c in config.columns if c.lower() not in column_index]
+            if missing:
+                raise ValueError(f"Report '{config.name}': columns {missing} are not returned by {self.report_config.name}. Available: {column_names}")
+            target.indices = [column_index[c.lower()] for c in config.columns] or None
+            if config.row_filter:
+                target.keep = build_row_filter(parse_row_filter(config.row_filter), column_index)
+            self.logger.info(
+                f"Target {config.name}: {len(target.indices or column_names)} columns"
+                f"{f', filter: {config.row_filter}' if config.row_filter else ''}."
+            )
+
+    def _start_journal(self, total_start: date, total_end: date) -> None:
+        # Mỗi lô ghi vào nhiều sheet: nhật ký chạy / --resume chưa hỗ trợ nguồn chung
+        if self.app_config.resume:
+            self.logger.warning("--resume is not supported for shared sources. Running in full.")
+        return None
+
+    def _prepare_sheet(self, incremental: Optional[IncrementalPlanner]) -> bool:
+        self._resolve_targets()
+        for target in self.targets:
+            target.write_then_trim = target.pipeline._prepare_sheet(None)
+        return False
+
+    def _complete_sheet(self, write_then_trim: bool):
+        for target in self.targets:
+            target.pipeline._complete_sheet(target.write_then_trim)
+
+    def _abort_sheet(self):
+        # Mỗi báo cáo đích dùng shadow_swap có tab ẩn riêng trong spreadsheet của nó
+        for target in self.targets:
+            target.pipeline._abort_sheet()
+
+    def _remember_column_types(self, column_types: Optional[List[int]], text_values: bool = False):
+        first = self._converters is None
+        super()._remember_column_types(column_types, text_values)
+        if not (first and column_types):
+            return
+        # Cột ngày của nguồn, đổi sang vị trí cột trong từng báo cáo đích (cho tab ẩn của shadow_swap)
+        date_columns = set(date_column_indices(column_types))
+        for target in self.targets:
+            indices = target.indices if target.indices is not None else range(len(column_types))
+            target.pipeline._note_date_columns([pos for pos, i in enumerate(indices) if i in date_columns])
+
+    def _write_chunks(self, chunks: Iterable[List[list]]) -> Tuple[int, int]:
+        rows_read = 0
+        num_columns = 0
+        for data_chunk in chunks:
+            if not data_chunk: continue
+            rows_read += len(data_chunk)
+            num_columns = num_columns or len(data_chunk[0])
+            for target in self.targets:
+                rows = target.select(data_chunk)
+                if rows:
+                    target.pipeline._write_chunks([rows])
+        return rows_read, num_columns
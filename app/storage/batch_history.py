@@ -0,0 +1,37 @@
+import logging
+from dataclasses import dataclass
+from typing import Optional
+from .sqlite import sqlite_session
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class BatchHistory:
+    batch_days: int
+    rows_per_day: float
+    seconds_per_day: float
+
+class BatchHistoryStore:
+    def __init__(self, path: str):
+        self.path = path
+        with sqlite_session(self.path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS batch_history ("
+                " report TEXT PRIMARY KEY, batch_days INTEGER NOT NULL,"
+                " rows_per_day REAL NOT NULL, seconds_per_day REAL NOT NULL)"
+            )
+
+    def load(self, report: str) -> Optional[BatchHistory]:
+        with sqlite_session(self.path) as conn:
+            row = conn.execute(
+                "SELECT batch_days, rows_per_day, seconds_per_day FROM batch_history WHERE report = ?", (report,)
+            ).fetchone()
+        return BatchHistory(*row) if row else None
+
+    def save(self, report: str, history: BatchHistory):
+        with sqlite_session(self.path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO batch_history (report, batch_days, rows_per_day, seconds_per_day) VALUES (?, ?, ?, ?)",
+                (report, history.batch_days, history.rows_per_day, history.seconds_per_day)
+            )
+        logger.debug(f"Saved batch history for report '{report}': {history}")
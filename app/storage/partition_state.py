@@ -0,0 +1,74 @@
+import logging
+from dataclasses import dataclass
+from typing import List, Optional
+from .sqlite import sqlite_session
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class PartitionState:
+    partition_key: str
+    start_row: int
+    row_count: int
+    content_hash: str
+
+@dataclass
+class ReportState:
+    period: str
+    sql_hash: str
+    grid_rows: int
+    partitions: List[PartitionState]
+    # Sheet đích "<spreadsheet_id>/<sheetId>" lúc lưu fingerprint
+    target: str = ''
+
+class PartitionStateStore:
+    def __init__(self, path: str):
+        self.path = path
+        with sqlite_session(self.path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS report_state ("
+                " report TEXT PRIMARY KEY, period TEXT NOT NULL, sql_hash TEXT NOT NULL, grid_rows INTEGER NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS partition_state ("
+                " report TEXT NOT NULL, partition_key TEXT NOT NULL, start_row INTEGER NOT NULL,"
+                " row_count INTEGER NOT NULL, content_hash TEXT NOT NULL,"
+                " PRIMARY KEY (report, partition_key))"
+            )
+            # Trạng thái tạo trước khi có cột target: để rỗng, lần chạy sau coi là không khớp và ghi lại toàn bộ
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(report_state)")}
+            if 'target' not in columns:
+                conn.execute("ALTER TABLE report_state ADD COLUMN target TEXT NOT NULL DEFAULT ''")
+
+    def load(self, report: str) -> Optional[ReportState]:
+        with sqlite_session(self.path) as conn:
+            row = conn.execute(
+                "SELECT period, sql_hash, grid_rows, target FROM report_state WHERE report = ?", (report,)
+            ).fetchone()
+            if row is None:
+                return None
+            partitions = [
+                PartitionState(*p) for p in conn.execute(
+                    "SELECT partition_key, start_row, row_count, content_hash FROM partition_state"
+                    " WHERE report = ? ORDER BY start_row", (report,)
+                )
+            ]
+        return ReportState(period=row[0], sql_hash=row[1], grid_rows=row[2], partitions=partitions, target=row[3])
+
+    def save(self, report: str, state: ReportState):
+        with sqlite_session(self.path) as conn:
+            conn.execute("DELETE FROM partition_state WHERE report = ?", (report,))
+            conn.execute(
+                "INSERT OR REPLACE INTO report_state (report, period, sql_hash, grid_rows, target) VALUES (?, ?, ?, ?, ?)",
+                (report, state.period, state.sql_hash, state.grid_rows, state.target)
+            )
+            conn.executemany(
+                "INSERT INTO partition_state (report, partition_key, start_row, row_count, content_hash) VALUES (?, ?, ?, ?, ?)",
+                [(report, p.partition_key, p.start_row, p.row_count, p.content_hash) for p in state.partitions]
+            )
+        logger.debug(f"Saved {len(state.partitions)} partition fingerprints for report '{report}'.")
+
+    def clear(self, report: str):
+        with sqlite_session(self.path) as conn:
+            conn.execute("DELETE FROM partition_state WHERE report = ?", (report,))
+            conn.execute("DELETE FROM report_state WHERE report = ?", (report,))
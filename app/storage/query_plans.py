@@ -0,0 +1,69 @@
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from .sqlite import sqlite_session
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class QueryPlanRecord:
+    report: str
+    database: str
+    captured_at: float
+    start_batch: str
+    end_batch: str
+    sql_hash: str
+    total_cost: float
+    execution_ms: float
+    actual_rows: int
+    shared_read_blocks: int
+    shared_hit_blocks: int
+    node_types: List[str] = field(default_factory=list)
+    plan: Optional[Any] = None
+
+class QueryPlanStore:
+    def __init__(self, path: str, keep_per_report: int = 50):
+        self.path = path
+        self.keep_per_report = keep_per_report
+        with sqlite_session(self.path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_plans ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, report TEXT NOT NULL, database TEXT NOT NULL,"
+                " captured_at REAL NOT NULL, start_batch TEXT NOT NULL, end_batch TEXT NOT NULL, sql_hash TEXT NOT NULL,"
+                " total_cost REAL NOT NULL, execution_ms REAL NOT NULL, actual_rows INTEGER NOT NULL,"
+                " shared_read_blocks INTEGER NOT NULL, shared_hit_blocks INTEGER NOT NULL,"
+                " node_types TEXT NOT NULL, plan_json TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS query_plans_report ON query_plans (report, database, captured_at)")
+
+    def latest(self, report: str, database: str) -> Optional[QueryPlanRecord]:
+        with sqlite_session(self.path) as conn:
+            row = conn.execute(
+                "SELECT captured_at, start_batch, end_batch, sql_hash, total_cost, execution_ms, actual_rows,"
+                " shared_read_blocks, shared_hit_blocks, node_types FROM query_plans"
+                " WHERE report = ? AND database = ? ORDER BY captured_at DESC, id DESC LIMIT 1",
+                (report, database)
+            ).fetchone()
+        if row is None:
+            return None
+        # Không nạp plan đầy đủ: chỉ cần bản tóm tắt để so sánh
+        return QueryPlanRecord(report, database, *row[:9], node_types=json.loads(row[9]))
+
+    def add(self, record: QueryPlanRecord):
+        with sqlite_session(self.path) as conn:
+            conn.execute(
+                "INSERT INTO query_plans (report, database, captured_at, start_batch, end_batch, sql_hash, total_cost,"
+                " execution_ms, actual_rows, shared_read_blocks, shared_hit_blocks, node_types, plan_json)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (record.report, record.database, record.captured_at, record.start_batch, record.end_batch, record.sql_hash,
+                 record.total_cost, record.execution_ms, record.actual_rows, record.shared_read_blocks, record.shared_hit_blocks,
+                 json.dumps(record.node_types, ensure_ascii=False), json.dumps(record.plan, ensure_ascii=False, default=str))
+            )
+            # Giữ lịch sử giới hạn cho mỗi báo cáo / DB
+            conn.execute(
+                "DELETE FROM query_plans WHERE report = ? AND database = ? AND id NOT IN ("
+                " SELECT id FROM query_plans WHERE report = ? AND database = ? ORDER BY captured_at DESC, id DESC LIMIT ?)",
+                (record.report, record.database, record.report, record.database, self.keep_per_report)
+            )
+        logger.debug(f"Stored query plan for report '{record.report}' on {record.database} (cost {record.total_cost:.0f}).")
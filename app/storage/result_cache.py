@@ -0,0 +1,95 @@
+import os
+import time
+import zlib
+import pickle
+import hashlib
+import logging
+import tempfile
+from typing import List, Optional, Tuple, Sequence
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b'ETLRC2'
+
+class ResultCache:
+    def __init__(self, directory: str, ttl_seconds: int, max_bytes: int):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(sql: str, start_batch: str, end_batch: str) -> str:
+        sql_hash = hashlib.sha256(sql.encode('utf-8')).hexdigest()
+        return hashlib.sha256(f"{sql_hash}:{start_batch}:{end_batch}".encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def get(self, key: str) -> Optional[Tuple[List[tuple], int, Optional[List[int]]]]:
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                self._remove(path)
+                return None
+            with open(path, 'rb') as f:
+                payload = f.read()
+        except FileNotFoundError:
+            return None
+        if not payload.startswith(_MAGIC):
+            logger.warning(f"Ignoring unreadable cache entry {path}.")
+            self._remove(path)
+            return None
+        try:
+            num_columns, column_types, rows = pickle.loads(zlib.decompress(payload[len(_MAGIC):]))
+        except (zlib.error, pickle.UnpicklingError, EOFError, ValueError) as e:
+            logger.warning(f"Ignoring corrupt cache entry {path}: {e}")
+            self._remove(path)
+            return None
+        return rows, num_columns, column_types
+
+    def put(self, key: str, rows: List[tuple], num_columns: int, column_types: Optional[Sequence[int]] = None):
+        column_types = list(column_types) if column_types is not None else None
+        payload = _MAGIC + zlib.compress(pickle.dumps((num_columns, column_types, rows), protocol=pickle.HIGHEST_PROTOCOL), 6)
+        # Ghi ra file tạm rồi đổi tên để luồng/tiến trình khác không đọc phải file ghi dở
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            self._remove(tmp_path)
+            raise
+        logger.debug(f"Cached {len(rows)} rows ({len(payload)} bytes) under {key[:12]}.")
+        self.evict()
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.bin'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.ttl_seconds:
+                self._remove(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        # Vượt dung lượng: xóa các mục cũ nhất trước
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            self._remove(path)
+            total_bytes -= size
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
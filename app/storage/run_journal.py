@@ -0,0 +1,114 @@
+import time
+import logging
+from dataclasses import dataclass, field
+from typing import List, Optional
+from .sqlite import sqlite_session
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class JournalChunk:
+    start_batch: str
+    end_batch: str
+    chunk_index: int
+    start_row: int
+    row_count: int
+    content_hash: str
+
+@dataclass
+class JournalBatch:
+    start_batch: str
+    end_batch: str
+    row_count: int
+    next_row: int
+
+@dataclass
+class JournalRun:
+    run_id: str
+    period: str
+    sql_hash: str
+    load_strategy: str
+    batch_rows: int
+    start_row: int
+    status: str
+    updated_at: float
+    batches: List[JournalBatch] = field(default_factory=list)
+    chunks: List[JournalChunk] = field(default_factory=list)
+
+class RunJournalStore:
+    def __init__(self, path: str):
+        self.path = path
+        with sqlite_session(self.path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS run_journal ("
+                " report TEXT PRIMARY KEY, run_id TEXT NOT NULL, period TEXT NOT NULL, sql_hash TEXT NOT NULL,"
+                " load_strategy TEXT NOT NULL, batch_rows INTEGER NOT NULL, start_row INTEGER NOT NULL,"
+                " status TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS run_journal_batch ("
+                " report TEXT NOT NULL, start_batch TEXT NOT NULL, end_batch TEXT NOT NULL,"
+                " row_count INTEGER NOT NULL, next_row INTEGER NOT NULL,"
+                " PRIMARY KEY (report, start_batch))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS run_journal_chunk ("
+                " report TEXT NOT NULL, start_batch TEXT NOT NULL, end_batch TEXT NOT NULL, chunk_index INTEGER NOT NULL,"
+                " start_row INTEGER NOT NULL, row_count INTEGER NOT NULL, content_hash TEXT NOT NULL,"
+                " PRIMARY KEY (report, start_batch, chunk_index))"
+            )
+
+    def load(self, report: str) -> Optional[JournalRun]:
+        with sqlite_session(self.path) as conn:
+            row = conn.execute(
+                "SELECT run_id, period, sql_hash, load_strategy, batch_rows, start_row, status, updated_at"
+                " FROM run_journal WHERE report = ?", (report,)
+            ).fetchone()
+            if row is None:
+                return None
+            run = JournalRun(*row)
+            run.batches = [
+                JournalBatch(*b) for b in conn.execute(
+                    "SELECT start_batch, end_batch, row_count, next_row FROM run_journal_batch"
+                    " WHERE report = ? ORDER BY start_batch", (report,)
+                )
+            ]
+            run.chunks = [
+                JournalChunk(*c) for c in conn.execute(
+                    "SELECT start_batch, end_batch, chunk_index, start_row, row_count, content_hash FROM run_journal_chunk"
+                    " WHERE report = ? ORDER BY start_batch, chunk_index", (report,)
+                )
+            ]
+        return run
+
+    def start(self, report: str, run: JournalRun):
+        # Chỉ giữ nhật ký của lần chạy gần nhất cho mỗi báo cáo
+        with sqlite_session(self.path) as conn:
+            conn.execute("DELETE FROM run_journal_chunk WHERE report = ?", (report,))
+            conn.execute("DELETE FROM run_journal_batch WHERE report = ?", (report,))
+            conn.execute(
+                "INSERT OR REPLACE INTO run_journal"
+                " (report, run_id, period, sql_hash, load_strategy, batch_rows, start_row, status, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (report, run.run_id, run.period, run.sql_hash, run.load_strategy, run.batch_rows, run.start_row, run.status, time.time())
+            )
+
+    def set_status(self, report: str, status: str):
+        with sqlite_session(self.path) as conn:
+            conn.execute(
+                "UPDATE run_journal SET status = ?, updated_at = ? WHERE report = ?", (status, time.time(), report)
+            )
+        logger.debug(f"Run journal of report '{report}' marked {status}.")
+
+    def commit(self, report: str, chunks: List[JournalChunk], batches: List[JournalBatch]):
+        with sqlite_session(self.path) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO run_journal_chunk"
+                " (report, start_batch, end_batch, chunk_index, start_row, row_count, content_hash) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(report, c.start_batch, c.end_batch, c.chunk_index, c.start_row, c.row_count, c.content_hash) for c in chunks]
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO run_journal_batch (report, start_batch, end_batch, row_count, next_row) VALUES (?, ?, ?, ?, ?)",
+                [(report, b.start_batch, b.end_batch, b.row_count, b.next_row) for b in batches]
+            )
+            conn.execute("UPDATE run_journal SET updated_at = ? WHERE report = ?", (time.time(), report))
@@ -0,0 +1,16 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+from typing import Iterator
+
+@contextmanager
+def sqlite_session(path: str) -> Iterator[sqlite3.Connection]:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
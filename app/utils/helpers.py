@@ -1,5 +1,7 @@
-from typing import List, Any, Iterator
-from datetime import date
+import queue
+import threading
+from typing import List, Any, Iterator, Iterable, Sequence
+from itertools import islice
 
 def number_to_column(number: int) -> str:
     column = ""
@@ -16,20 +18,71 @@ def column_to_number(column: str) -> int:
         number = number * 26 + (ord(char) - ord('A')) + 1
     return number
 
-def convert_dates_to_string(data: List[tuple]) -> List[List[Any]]:
-    processed_data = []
-    for record in data:
-        row = list(record)
-        for i, value in enumerate(row):
-            if isinstance(value, date):
-                row[i] = value.strftime("%Y-%m-%d")
-        processed_data.append(row)
-    return processed_data
-
 def chunk_data(data: List[Any], chunk_size: int) -> Iterator[List[Any]]:
     if chunk_size <= 0:
         yield data
         return
 
     for i in range(0, len(data), chunk_size):
-        yield data[i:i + chunk_size]
\ No newline at end of file
+        yield data[i:i + chunk_size]
+
+def chunk_iterable(data: Iterable[Any], chunk_size: int) -> Iterator[List[Any]]:
+    iterator = iter(data)
+    if chunk_size <= 0:
+        chunk = list(iterator)
+        if chunk:
+            yield chunk
+        return
+
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def sort_rows_nulls_last(rows: Iterable[Sequence[Any]], indices: Sequence[int]) -> List[Sequence[Any]]:
+    # Sắp theo các cột `indices` như ORDER BY ... ASC của Postgres (NULL đứng cuối); sort ổn định nên khóa bằng nhau giữ thứ tự đầu vào
+    return sorted(rows, key=lambda row: tuple((1, 0) if row[i] is None else (0, row[i]) for i in indices))
+
+def prefetch_iterable(data: Iterable[Any], depth: int, thread_name: str = 'prefetch') -> Iterator[Any]:
+    # Luồng nền đọc trước tối đa `depth` phần tử; hàng đợi đầy thì luồng nền chờ (backpressure)
+    buffer = queue.Queue(maxsize=max(1, depth))
+    stop = threading.Event()
+    finished = object()
+
+    def _put(entry) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce():
+        iterator = iter(data)
+        try:
+            for item in iterator:
+                if not _put((item, None)):
+                    return
+            _put((finished, None))
+        except BaseException as e:
+            _put((None, e))
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close:
+                close()
+
+    producer = threading.Thread(target=_produce, name=thread_name, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if error is not None:
+                raise error
+            if item is finished:
+                return
+            yield item
+    finally:
+        stop.set()
+        producer.join()
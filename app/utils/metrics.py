@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(key: LabelKey) -> str:
+    if not key:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in key) + '}'
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = 'etl'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters: Dict[str, Dict[LabelKey, float]] = {}
+            self._gauges: Dict[str, Dict[LabelKey, float]] = {}
+            self._timings: Dict[str, Dict[LabelKey, Dict[str, float]]] = {}
+            self.started_at = time.time()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            stats = self._timings.setdefault(name, {}).setdefault(key, {'count': 0, 'sum': 0.0, 'max': 0.0})
+            stats['count'] += 1
+            stats['sum'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+
+    def summary(self) -> Dict[str, Any]:
+        def _series(metric: Dict[LabelKey, Any]):
+            return [{'labels': dict(key), 'value': value} for key, value in sorted(metric.items())]
+
+        with self._lock:
+            return {
+                'started_at': self.started_at,
+                'finished_at': time.time(),
+                'counters': {name: _series(metric) for name, metric in sorted(self._counters.items())},
+                'gauges': {name: _series(metric) for name, metric in sorted(self._gauges.items())},
+                'timings': {name: _series(metric) for name, metric in sorted(self._timings.items())},
+            }
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, metric in sorted(self._counters.items()):
+                full_name = f"{self.prefix}_{name}_total"
+                lines.append(f"# TYPE {full_name} counter")
+                lines.extend(f"{full_name}{_format_labels(key)} {value}" for key, value in sorted(metric.items()))
+            for name, metric in sorted(self._gauges.items()):
+                full_name = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {full_name} gauge")
+                lines.extend(f"{full_name}{_format_labels(key)} {value}" for key, value in sorted(metric.items()))
+            for name, metric in sorted(self._timings.items()):
+                full_name = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {full_name} summary")
+                for key, stats in sorted(metric.items()):
+                    labels = _format_labels(key)
+                    lines.append(f"{full_name}_sum{labels} {stats['sum']}")
+                    lines.append(f"{full_name}_count{labels} {stats['count']}")
+                lines.append(f"# TYPE {full_name}_max gauge")
+                lines.extend(f"{full_name}_max{_format_labels(key)} {stats['max']}" for key, stats in sorted(metric.items()))
+            lines.append(f"# TYPE {self.prefix}_last_run_timestamp_seconds gauge")
+            lines.append(f"{self.prefix}_last_run_timestamp_seconds {time.time()}")
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path: str, **extra):
+        _atomic_write(path, json.dumps({**extra, **self.summary()}, ensure_ascii=False, indent=2))
+
+    def write_prometheus(self, path: str):
+        # node_exporter đọc textfile bất kỳ lúc nào nên phải ghi nguyên tử
+        _atomic_write(path, self.to_prometheus())
+
+def _atomic_write(path: str, content: str):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+# Bộ thu thập dùng chung cho cả lần chạy (pipeline, connector, Sheets client)
+metrics = MetricsRegistry()
@@ -0,0 +1,60 @@
+import time
+import logging
+import threading
+from typing import Dict, List
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    def __init__(self, per_minute: float, utilization: float = 0.9):
+        # Bucket đầy + lượng nạp trong 60s không vượt quá quota: capacity + rate * 60 <= per_minute
+        self.rate = per_minute * utilization / 60.0
+        self.capacity = max(1.0, per_minute * (1.0 - utilization))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        # Trừ token ngay (có thể âm) và trả về thời gian phải chờ, để các luồng xếp hàng công bằng
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            wait = max(0.0, -self._tokens / self.rate, self._paused_until - now)
+            return wait
+
+    def pause(self, seconds: float):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens = min(self._tokens, 0.0)
+            self._paused_until = max(self._paused_until, now + seconds)
+
+class SheetsQuotaScheduler:
+    def __init__(self,
+                 read_per_minute: int = 60,
+                 write_per_minute: int = 60,
+                 project_read_per_minute: int = 300,
+                 project_write_per_minute: int = 300,
+                 utilization: float = 0.9):
+        self._buckets: Dict[str, List[TokenBucket]] = {
+            'read': [TokenBucket(read_per_minute, utilization), TokenBucket(project_read_per_minute, utilization)],
+            'write': [TokenBucket(write_per_minute, utilization), TokenBucket(project_write_per_minute, utilization)],
+        }
+
+    def acquire(self, group: str):
+        wait = max(bucket.reserve() for bucket in self._buckets[group])
+        if wait > 0:
+            logger.debug(f"Pacing Sheets {group} request for {wait:.2f}s to stay under quota.")
+            time.sleep(wait)
+        metrics.observe('sheets_quota_wait_seconds', max(wait, 0.0), group=group)
+
+    def pause(self, group: str, seconds: float):
+        for bucket in self._buckets[group]:
+            bucket.pause(seconds)
@@ -0,0 +1,43 @@
+import re
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta
+from typing import Optional, Tuple
+
+# schedule của BRANCH_* cho --daemon: "every 15m" (s/m/h/d) hoặc "daily 02:30" (nhiều giờ cách nhau bởi dấu phẩy)
+_INTERVAL_RE = re.compile(r"^every\s+(\d+)\s*([smhd])$", re.IGNORECASE)
+_DAILY_RE = re.compile(r"^daily\s+(.+)$", re.IGNORECASE)
+_UNIT_SECONDS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+@dataclass(frozen=True)
+class ReportSchedule:
+    text: str
+    interval: Optional[timedelta] = None
+    times: Tuple[time, ...] = ()
+
+    def first_run(self, now: datetime) -> datetime:
+        # Lịch theo chu kỳ chạy ngay khi daemon khởi động; lịch theo giờ chờ tới giờ kế tiếp
+        return now if self.interval else self.next_after(now)
+
+    def next_after(self, moment: datetime) -> datetime:
+        if self.interval:
+            return moment + self.interval
+        candidates = [datetime.combine(moment.date() + timedelta(days=offset), at) for offset in (0, 1) for at in self.times]
+        return min(c for c in candidates if c > moment)
+
+def parse_schedule(text: str) -> ReportSchedule:
+    value = ' '.join(text.split())
+    match = _INTERVAL_RE.match(value)
+    if match:
+        seconds = int(match.group(1)) * _UNIT_SECONDS[match.group(2).lower()]
+        if seconds <= 0:
+            raise ValueError(f"Invalid schedule '{text}': interval must be positive.")
+        return ReportSchedule(text=value, interval=timedelta(seconds=seconds))
+    match = _DAILY_RE.match(value)
+    if match:
+        try:
+            times = tuple(sorted({time.fromisoformat(part.strip()) for part in match.group(1).split(',') if part.strip()}))
+        except ValueError:
+            times = ()
+        if times:
+            return ReportSchedule(text=value, times=times)
+    raise ValueError(f"Invalid schedule '{text}'. Use 'every <N>s|m|h|d' or 'daily HH:MM[, HH:MM...]'.")
@@ -0,0 +1,88 @@
+import re
+import hashlib
+from functools import lru_cache
+from typing import Dict, Optional, Tuple, List
+
+PRELUDE_MARKER = '-- @prelude'
+QUERY_MARKER = '-- @query'
+
+DATE_PLACEHOLDERS = ('date_start_scan_placeholder', 'date_end_scan_placeholder')
+# 'placeholder' hoặc DATE 'placeholder' -> $n / $n::date
+_PLACEHOLDER_RE = re.compile(r"(\bDATE\s+)?'(date_start_scan_placeholder|date_end_scan_placeholder)'", re.IGNORECASE)
+
+def split_sql_prelude(sql: str) -> Tuple[Optional[str], str]:
+    lines = sql.splitlines(keepends=True)
+    markers = [line.strip().lower() for line in lines]
+    if PRELUDE_MARKER not in markers:
+        return None, sql
+    if QUERY_MARKER not in markers:
+        raise ValueError(f"SQL file declares '{PRELUDE_MARKER}' but has no '{QUERY_MARKER}' section.")
+
+    prelude_start = markers.index(PRELUDE_MARKER) + 1
+    query_start = markers.index(QUERY_MARKER)
+    if query_start < prelude_start:
+        raise ValueError(f"'{QUERY_MARKER}' must come after '{PRELUDE_MARKER}'.")
+    prelude = ''.join(lines[prelude_start:query_start]).strip()
+    query = ''.join(lines[query_start + 1:])
+    return (prelude or None), query
+
+# Câu lệnh prelude thuộc về bảng TEMP nào: DROP / CREATE TEMP TABLE / CREATE INDEX ON / ANALYZE
+_PRELUDE_TABLE_RES = (
+    re.compile(r"^DROP\s+TABLE\s+(?:IF\s+EXISTS\s+)?(?:pg_temp\.)?(\w+)", re.IGNORECASE),
+    re.compile(r"^CREATE\s+TEMP(?:ORARY)?\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE),
+    re.compile(r"^CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:\w+\s+)?ON\s+(?:pg_temp\.)?(\w+)", re.IGNORECASE),
+    re.compile(r"^ANALYZE\s+(?:pg_temp\.)?(\w+)", re.IGNORECASE),
+)
+
+def _split_statements(sql: str) -> List[str]:
+    # Tách theo ';' ngoài chuỗi '...' / "..." và bỏ comment '--'; khoảng trắng được gộp để so sánh
+    statements, current, quote, i = [], [], None, 0
+    while i < len(sql):
+        char = sql[i]
+        if quote:
+            current.append(char)
+            if char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+            current.append(char)
+        elif sql.startswith('--', i):
+            end = sql.find('\n', i)
+            i = len(sql) if end < 0 else end
+            current.append(' ')
+            continue
+        elif char == ';':
+            statements.append(' '.join(''.join(current).split()))
+            current = []
+        else:
+            current.append(char)
+        i += 1
+    statements.append(' '.join(''.join(current).split()))
+    return [s for s in statements if s]
+
+@lru_cache(maxsize=64)
+def prelude_tables(prelude: str) -> Dict[str, str]:
+    # Bảng TEMP -> dấu vân tay các câu lệnh dựng nó. Hai prelude cùng dựng một bảng theo cùng định nghĩa
+    # (vd. etl_treatment_first) thì dùng chung bảng đã dựng trên phiên. Câu lệnh không gắn với bảng nào nằm dưới khóa ''
+    groups: Dict[str, List[str]] = {}
+    for statement in _split_statements(prelude):
+        match = next((m for m in (r.match(statement) for r in _PRELUDE_TABLE_RES) if m), None)
+        groups.setdefault(match.group(1).lower() if match else '', []).append(statement)
+    return {table: hashlib.sha1(';'.join(statements).encode('utf-8')).hexdigest()[:16] for table, statements in groups.items()}
+
+def to_prepared_query(sql: str) -> Optional[Tuple[str, List[str]]]:
+    # Mỗi lần xuất hiện là một tham số riêng để Postgres tự suy kiểu theo ngữ cảnh từng chỗ
+    params: List[str] = []
+
+    def _bind(match):
+        params.append(match.group(2).lower())
+        return f"${len(params)}::date" if match.group(1) else f"${len(params)}"
+
+    translated = _PLACEHOLDER_RE.sub(_bind, sql)
+    if any(placeholder in translated for placeholder in DATE_PLACEHOLDERS):
+        # Placeholder nằm trong chuỗi lớn hơn (vd. '%...%'), không thể bind an toàn
+        return None
+    return translated, params
+
+def prepared_statement_name(sql: str) -> str:
+    return f"etl_{hashlib.sha1(sql.encode('utf-8')).hexdigest()[:16]}"
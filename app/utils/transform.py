@@ -0,0 +1,272 @@
+import re
+import math
+from datetime import date
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# OID kiểu dữ liệu Postgres (pg_type) trong cursor.description[i].type_code
+BOOL_OID = 16
+TEXT_OID = 25
+DATE_OID = 1082
+DATETIME_OIDS = (1114, 1184)
+NUMERIC_OID = 1700
+# Các kiểu mà JSON/Sheets nhận trực tiếp: bool, int2/4/8, oid, float4/8, text, char, varchar, name
+PASSTHROUGH_OIDS = frozenset((16, 19, 20, 21, 23, 25, 26, 700, 701, 1042, 1043))
+INTEGER_OIDS = frozenset((20, 21, 23, 26))
+FLOAT_OIDS = frozenset((700, 701))
+
+# value_encoding = typed: ngày được ghi dạng số serial của Sheets (số ngày kể từ 1899-12-30), định dạng đặt theo cột
+SHEETS_DATE_PATTERN = 'yyyy-mm-dd'
+_SHEETS_EPOCH_ORDINAL = date(1899, 12, 30).toordinal()
+
+Converter = Optional[Callable[[Any], Any]]
+
+def _date_to_string(value: date) -> str:
+    return value.isoformat()
+
+def _datetime_to_string(value: date) -> str:
+    # Giữ nguyên hành vi cũ: timestamp chỉ ghi phần ngày (isoformat nhanh hơn strftime nhiều lần)
+    return value.isoformat()[:10]
+
+def _decimal_to_number(value: Decimal) -> Any:
+    return float(value) if value.is_finite() else str(value)
+
+def _convert_any(value: Any) -> Any:
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, Decimal):
+        return _decimal_to_number(value)
+    return value
+
+def build_converters(type_codes: Sequence[Optional[int]]) -> List[Converter]:
+    converters: List[Converter] = []
+    for type_code in type_codes:
+        if type_code in PASSTHROUGH_OIDS:
+            converters.append(None)
+        elif type_code == DATE_OID:
+            converters.append(_date_to_string)
+        elif type_code in DATETIME_OIDS:
+            converters.append(_datetime_to_string)
+        elif type_code == NUMERIC_OID:
+            converters.append(_decimal_to_number)
+        else:
+            # Kiểu chưa biết: kiểm tra từng ô
+            converters.append(_convert_any)
+    return converters
+
+def _date_to_serial(value: date) -> int:
+    # datetime cũng chỉ lấy phần ngày, giống chế độ user_entered
+    return value.toordinal() - _SHEETS_EPOCH_ORDINAL
+
+def _convert_any_typed(value: Any) -> Any:
+    if isinstance(value, date):
+        return _date_to_serial(value)
+    if isinstance(value, Decimal):
+        return _decimal_to_number(value)
+    return value
+
+def build_typed_converters(type_codes: Sequence[Optional[int]]) -> List[Converter]:
+    converters: List[Converter] = []
+    for type_code in type_codes:
+        if type_code in PASSTHROUGH_OIDS:
+            converters.append(None)
+        elif type_code == DATE_OID or type_code in DATETIME_OIDS:
+            converters.append(_date_to_serial)
+        elif type_code == NUMERIC_OID:
+            converters.append(_decimal_to_number)
+        else:
+            converters.append(_convert_any_typed)
+    return converters
+
+def date_column_indices(type_codes: Sequence[Optional[int]]) -> List[int]:
+    return [i for i, type_code in enumerate(type_codes) if type_code == DATE_OID or type_code in DATETIME_OIDS]
+
+def transform_rows(rows: Sequence[tuple], converters: Optional[List[Converter]]) -> List[List[Any]]:
+    if not rows:
+        return []
+    if converters is None:
+        converters = [_convert_any] * len(rows[0])
+    if not any(converters):
+        return list(map(list, rows))
+
+    # Chuyển theo cột: mỗi cột chỉ chọn converter một lần, bỏ qua các cột không cần đổi
+    columns = list(zip(*rows))
+    for index, convert in enumerate(converters):
+        if convert is not None:
+            column = columns[index]
+            if None in column:
+                columns[index] = [None if value is None else convert(value) for value in column]
+            else:
+                columns[index] = list(map(convert, column))
+    return list(map(list, zip(*columns)))
+
+_BOOL_TEXT = {'t': True, 'f': False}
+
+def _timestamp_text_to_date(value: str) -> str:
+    return value[:10]
+
+def _bool_text(value: str) -> Any:
+    return _BOOL_TEXT.get(value, value)
+
+def _date_text_to_serial(value: str) -> Any:
+    try:
+        return date.fromisoformat(value[:10]).toordinal() - _SHEETS_EPOCH_ORDINAL
+    except ValueError:
+        # infinity / -infinity
+        return value
+
+def _int_text(value: str) -> Any:
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+def _float_text(value: str) -> Any:
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    # NaN / Infinity không ghi được vào JSON: giữ dạng text như _decimal_to_number
+    return number if math.isfinite(number) else value
+
+def build_typed_text_converters(type_codes: Sequence[Optional[int]]) -> List[Converter]:
+    # COPY ... CSV + value_encoding = typed: số và ngày phải đổi từ text vì RAW không tự phân tích như USER_ENTERED
+    converters: List[Converter] = []
+    for type_code in type_codes:
+        if type_code == DATE_OID or type_code in DATETIME_OIDS:
+            converters.append(_date_text_to_serial)
+        elif type_code == BOOL_OID:
+            converters.append(_bool_text)
+        elif type_code in INTEGER_OIDS:
+            converters.append(_int_text)
+        elif type_code in FLOAT_OIDS or type_code == NUMERIC_OID:
+            converters.append(_float_text)
+        else:
+            converters.append(None)
+    return converters
+
+def build_text_converters(type_codes: Sequence[Optional[int]]) -> List[Converter]:
+    # Giá trị từ COPY ... CSV đã là text (DateStyle ISO): cắt timestamp về ngày, đổi t/f thành bool và số thành
+    # int/float như chế độ fetch, để Sheets không phân tích "1234.50" theo locale (vi_VN dùng dấu phẩy thập phân)
+    converters: List[Converter] = []
+    for type_code in type_codes:
+        if type_code in DATETIME_OIDS:
+            converters.append(_timestamp_text_to_date)
+        elif type_code == BOOL_OID:
+            converters.append(_bool_text)
+        elif type_code in INTEGER_OIDS:
+            converters.append(_int_text)
+        elif type_code in FLOAT_OIDS or type_code == NUMERIC_OID:
+            converters.append(_float_text)
+        else:
+            converters.append(None)
+    return converters
+
+# row_filter của báo cáo dùng nguồn chung: "cot = x and cot2 in ('a', 'b') and cot3 != 1"
+_FILTER_TOKEN_RE = re.compile(r"\s*(?:'((?:[^']|'')*)'|(!=|<>|=|\(|\)|,)|([^\s=!<>(),']+))")
+_FILTER_KEYWORD_LITERALS = {'null': None, 'true': True, 'false': False}
+
+FilterTerm = Tuple[str, bool, List[Any]]
+
+def _tokenize_filter(expression: str) -> List[Tuple[str, str]]:
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _FILTER_TOKEN_RE.match(expression, position)
+        if not match or match.end() == position:
+            raise ValueError(f"Invalid row_filter near: '{expression[position:]}'")
+        quoted, symbol, word = match.groups()
+        if quoted is not None:
+            tokens.append(('string', quoted.replace("''", "'")))
+        elif symbol is not None:
+            tokens.append(('symbol', symbol))
+        else:
+            tokens.append(('word', word))
+        position = match.end()
+    return tokens
+
+def _filter_literal(kind: str, text: str) -> Any:
+    # Chuỗi trong nháy đơn so sánh dạng text; số không nháy so sánh theo giá trị số
+    if kind == 'string':
+        return text
+    if text.lower() in _FILTER_KEYWORD_LITERALS:
+        return _FILTER_KEYWORD_LITERALS[text.lower()]
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+def parse_row_filter(expression: str) -> List[FilterTerm]:
+    tokens = _tokenize_filter(expression)
+    terms: List[FilterTerm] = []
+    position = 0
+
+    def take(expected_kind: Optional[str] = None) -> Tuple[str, str]:
+        nonlocal position
+        if position >= len(tokens):
+            raise ValueError(f"Incomplete row_filter: '{expression}'")
+        kind, text = tokens[position]
+        if expected_kind and kind != expected_kind:
+            raise ValueError(f"Invalid row_filter near '{text}': '{expression}'")
+        position += 1
+        return kind, text
+
+    while True:
+        _, column = take('word')
+        kind, operator = take()
+        if kind == 'word' and operator.lower() == 'not':
+            kind, operator = take('word')
+            operator = f"not {operator}"
+        operator = operator.lower()
+        if operator in ('in', 'not in'):
+            if take('symbol')[1] != '(':
+                raise ValueError(f"row_filter: expected '(' after {operator.upper()}: '{expression}'")
+            values = []
+            while True:
+                values.append(_filter_literal(*take()))
+                separator = take('symbol')[1]
+                if separator == ')':
+                    break
+                if separator != ',':
+                    raise ValueError(f"row_filter: expected ',' or ')' in list: '{expression}'")
+        elif operator in ('=', '!=', '<>'):
+            values = [_filter_literal(*take())]
+        else:
+            raise ValueError(f"Unsupported row_filter operator '{operator}': '{expression}'")
+        terms.append((column.lower(), operator in ('=', 'in'), values))
+        if position == len(tokens):
+            return terms
+        _, conjunction = take('word')
+        if conjunction.lower() != 'and':
+            raise ValueError(f"row_filter only supports AND between conditions: '{expression}'")
+
+def _filter_matches(value: Any, literal: Any) -> bool:
+    if literal is None:
+        return value is None or value == ''
+    if isinstance(literal, bool):
+        if isinstance(value, str):
+            return _BOOL_TEXT.get(value.lower()[:1]) is literal
+        return value is literal
+    if isinstance(literal, float):
+        if value is None or isinstance(value, bool):
+            return False
+        try:
+            return float(value) == literal
+        except (TypeError, ValueError):
+            return False
+    return value is not None and str(value) == literal
+
+def build_row_filter(terms: List[FilterTerm], column_index: Dict[str, int]) -> Callable[[Sequence[Any]], bool]:
+    missing = [column for column, _, _ in terms if column not in column_index]
+    if missing:
+        raise ValueError(f"row_filter columns {missing} are not in the query result.")
+    compiled = [(column_index[column], positive, values) for column, positive, values in terms]
+
+    def keep(row: Sequence[Any]) -> bool:
+        for index, positive, values in compiled:
+            value = row[index]
+            if any(_filter_matches(value, literal) for literal in values) != positive:
+                return False
+        return True
+    return keep
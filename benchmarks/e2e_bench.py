@@ -0,0 +1,263 @@
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import urllib.request
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List
+import httplib2
+from googleapiclient.discovery import build
+from app.config.settings import AppConfig, GoogleSheetsConfig, ReportConfig
+from app.connectors.sheets import GoogleSheetsClient
+from app.pipelines.report_pipeline import ReportPipeline
+from app.utils.dates import get_report_date_range
+from .fake_postgres import FakeConnectionPool, FakeQueryCost
+from .fake_sheets import FakeSheetsServer
+
+SPREADSHEET_ID = 'bench-spreadsheet'
+SHEET_NAME = 'Data'
+SYNTHETIC_SQL = "SELECT * FROM synthetic WHERE d >= 'date_start_scan_placeholder' AND d <= 'date_end_scan_placeholder'"
+DEFAULT_BASELINE = 'benchmarks/baselines.json'
+
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    'doanhthu_fetch_append': {'profile': 'doanhthu', 'extract_mode': 'fetch', 'write_method': 'append'},
+    'doanhthu_fetch_batch_update': {'profile': 'doanhthu', 'extract_mode': 'fetch', 'write_method': 'batch_update',
+                                    'overwrite_method': 'write_then_trim'},
+    'doanhthu_copy_batch_update': {'profile': 'doanhthu', 'extract_mode': 'copy', 'write_method': 'batch_update',
+                                   'overwrite_method': 'write_then_trim'},
+    'khachhang_stream_append': {'profile': 'khachhang', 'extract_mode': 'stream', 'write_method': 'append'},
+    # Lần chạy thứ hai của chế độ incremental: không có ngày nào thay đổi
+    'duyetthanhtoan_incremental': {'profile': 'duyetthanhtoan', 'extract_mode': 'fetch', 'write_method': 'batch_update',
+                                   'incremental': True, 'partition_column': 'A', 'runs': 2},
+}
+
+class StageProfiler:
+    def __init__(self, trace_memory: bool):
+        self.trace_memory = trace_memory
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._active = 0
+
+    @contextmanager
+    def stage(self, name: str):
+        base = 0
+        if self.trace_memory:
+            with self._lock:
+                # Các stage chạy chồng nhau (prefetch) dùng chung một bộ đếm peak nên số đo là cận trên
+                if self._active == 0:
+                    tracemalloc.reset_peak()
+                self._active += 1
+                base = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            peak = 0
+            if self.trace_memory:
+                with self._lock:
+                    peak = max(0, tracemalloc.get_traced_memory()[1] - base)
+                    self._active -= 1
+            with self._lock:
+                stats = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'peak_bytes': 0})
+                stats['calls'] += 1
+                stats['seconds'] += elapsed
+                stats['peak_bytes'] = max(stats['peak_bytes'], peak)
+
+    def wrap(self, name: str, func: Callable) -> Callable:
+        def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def wrap_iter(self, name: str, func: Callable) -> Callable:
+        def wrapper(*args, **kwargs) -> Iterator[Any]:
+            iterator = iter(func(*args, **kwargs))
+            while True:
+                with self.stage(name):
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                yield item
+        return wrapper
+
+def _control(base_url: str, path: str, payload: Any = None) -> Dict[str, Any]:
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    with urllib.request.urlopen(f"{base_url}{path}", data=data, timeout=30) as response:
+        return json.loads(response.read())
+
+def _instrument(pipeline: ReportPipeline, profiler: StageProfiler):
+    pipeline._query_batch = profiler.wrap('extract', pipeline._query_batch)
+    pipeline.db.iter_query = profiler.wrap_iter('extract', pipeline.db.iter_query)
+    pipeline.db.iter_copy = profiler.wrap_iter('extract', pipeline.db.iter_copy)
+    pipeline._transform = profiler.wrap('transform', pipeline._transform)
+    pipeline.sheets._execute_with_retry = profiler.wrap('load', pipeline.sheets._execute_with_retry)
+
+def run_scenario(name: str, args, server: FakeSheetsServer, trace_memory: bool) -> Dict[str, Any]:
+    scenario = dict(SCENARIOS[name])
+    profile = scenario.pop('profile')
+    runs = scenario.pop('runs', 1)
+    total_start, total_end = get_report_date_range('previous_month')
+    days = (total_end - total_start).days + 1
+    rows_per_day = max(1, args.rows // days)
+
+    _control(server.url, '/_reset', {
+        'spreadsheets': {SPREADSHEET_ID: [SHEET_NAME]},
+        'latency_ms': args.latency_ms,
+        'quota_per_minute': args.quota_per_minute,
+        'max_payload_bytes': args.max_payload_bytes,
+    })
+
+    client_quota = args.quota_per_minute or 1_000_000
+    sheets_client = GoogleSheetsClient(
+        GoogleSheetsConfig(
+            token_file='', client_secret_file='', scopes=[],
+            read_requests_per_minute=client_quota, write_requests_per_minute=client_quota,
+            project_read_requests_per_minute=1_000_000, project_write_requests_per_minute=1_000_000
+        ),
+        service_factory=lambda: build('sheets', 'v4', http=httplib2.Http(timeout=120), static_discovery=True,
+                                      client_options={'api_endpoint': server.url})
+    )
+    report_config = ReportConfig(
+        name=f"BENCH_{name.upper()}",
+        sql_query=SYNTHETIC_SQL,
+        spreadsheet_id=SPREADSHEET_ID,
+        sheet_name=SHEET_NAME,
+        update_column_letter='A',
+        date_range_strategy='previous_month',
+        load_strategy='overwrite',
+        clear_method='clear_content',
+        clear_end_column='AZ',
+        **scenario
+    )
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        app_config = AppConfig(
+            batch_days=args.batch_days,
+            batch_rows=args.batch_rows,
+            extract_workers=args.extract_workers,
+            max_payload_bytes=min(args.max_payload_bytes, 2_000_000),
+            state_dir=state_dir,
+            prepared_statements=True,
+            run_journal=True,
+            result_cache=False,
+            adaptive_batching=False,
+            prefetch_batches=args.prefetch
+        )
+        db_pool = FakeConnectionPool(profile, rows_per_day, FakeQueryCost(args.query_ms, args.ms_per_thousand_rows))
+        if trace_memory:
+            tracemalloc.start()
+        try:
+            for run in range(runs):
+                profiler = StageProfiler(trace_memory)
+                before = _control(server.url, '/_stats')['stats']
+                pipeline = ReportPipeline(report_config, app_config, db_pool.connector(), sheets_client, db_pool=db_pool)
+                _instrument(pipeline, profiler)
+                started = time.perf_counter()
+                ok = pipeline.run()
+                elapsed = time.perf_counter() - started
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+
+    snapshot = _control(server.url, '/_stats')
+    stats = snapshot['stats']
+    api_calls = sum(stats.get(k, 0) - before.get(k, 0) for k in ('read_requests', 'write_requests'))
+    sheet = snapshot['sheets'][f"{SPREADSHEET_ID}/{SHEET_NAME}"]
+    expected_rows = rows_per_day * days
+    return {
+        'ok': ok and sheet['last_row'] == expected_rows + 1,
+        'rows': expected_rows,
+        'sheet_rows': sheet['last_row'] - 1,
+        'seconds': elapsed,
+        'rows_per_sec': expected_rows / elapsed if elapsed else 0.0,
+        'api_calls': api_calls,
+        'http_429': stats.get('http_429', 0) - before.get('http_429', 0),
+        'stages': profiler.stages,
+    }
+
+def _check_regressions(key: str, result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    problems = []
+    if result['rows_per_sec'] < baseline['rows_per_sec'] * (1 - tolerance):
+        problems.append(f"{key}: {result['rows_per_sec']:,.0f} rows/s < baseline {baseline['rows_per_sec']:,.0f}")
+    if result['api_calls'] > baseline['api_calls'] * (1 + tolerance):
+        problems.append(f"{key}: {result['api_calls']} API calls > baseline {baseline['api_calls']}")
+    for stage, peak in baseline.get('peak_bytes', {}).items():
+        current = result.get('peak_bytes', {}).get(stage)
+        # 1 MB dư cho nhiễu của allocator
+        if current is not None and current > peak * (1 + tolerance) + 1024 * 1024:
+            problems.append(f"{key}: {stage} peak {current / 1e6:.1f} MB > baseline {peak / 1e6:.1f} MB")
+    return problems
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline end-to-end pipeline benchmark (fake Postgres + fake Sheets)")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help="Scenario to run. Can be used multiple times (default: all).")
+    parser.add_argument('--rows', type=int, default=5_000, help="Approximate rows per report run.")
+    parser.add_argument('--batch-days', type=int, default=5)
+    parser.add_argument('--batch-rows', type=int, default=1000)
+    parser.add_argument('--extract-workers', type=int, default=1)
+    parser.add_argument('--prefetch', type=int, default=1)
+    parser.add_argument('--query-ms', type=float, default=5.0, help="Fake DB latency per query.")
+    parser.add_argument('--ms-per-thousand-rows', type=float, default=5.0, help="Fake DB latency per 1000 rows returned.")
+    parser.add_argument('--latency-ms', type=float, default=5.0, help="Fake Sheets latency per request.")
+    parser.add_argument('--quota-per-minute', type=int, default=0, help="Fake Sheets read/write quota per minute (0 = unlimited).")
+    parser.add_argument('--max-payload-bytes', type=int, default=10 * 1024 * 1024, help="Fake Sheets request size limit.")
+    parser.add_argument('--no-memory', action='store_true', help="Skip the tracemalloc pass for per-stage peak memory.")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline JSON file to compare against.")
+    parser.add_argument('--update-baseline', action='store_true', help="Write the results as the new baseline.")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed relative regression before failing.")
+    parser.add_argument('--verbose', action='store_true', help="Show pipeline logs.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    try:
+        with open(args.baseline, encoding='utf-8') as f:
+            baselines = json.load(f)
+    except FileNotFoundError:
+        baselines = {}
+
+    failures: List[str] = []
+    with FakeSheetsServer() as server:
+        for name in args.scenario or sorted(SCENARIOS):
+            key = f"{name}@{args.rows}"
+            result = run_scenario(name, args, server, trace_memory=False)
+            if not args.no_memory:
+                memory = run_scenario(name, args, server, trace_memory=True)
+                result['peak_bytes'] = {stage: s['peak_bytes'] for stage, s in memory['stages'].items()}
+
+            print(f"\n{key}: {result['rows']:,} rows in {result['seconds']:.2f}s = {result['rows_per_sec']:,.0f} rows/s, "
+                  f"{result['api_calls']} API calls ({result['http_429']} x 429)")
+            for stage, stats in sorted(result['stages'].items()):
+                peak = result.get('peak_bytes', {}).get(stage)
+                peak_text = f", peak {peak / 1e6:7.1f} MB" if peak is not None else ''
+                print(f"    {stage:<10} {stats['calls']:6d} calls {stats['seconds']:8.2f}s{peak_text}")
+
+            if not result['ok']:
+                failures.append(f"{key}: pipeline failed or wrote {result['sheet_rows']} rows instead of {result['rows']}")
+            if args.update_baseline:
+                baselines[key] = {k: result[k] for k in ('rows_per_sec', 'api_calls')}
+                if 'peak_bytes' in result:
+                    baselines[key]['peak_bytes'] = result['peak_bytes']
+            elif key in baselines:
+                failures.extend(_check_regressions(key, result, baselines[key], args.tolerance))
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\nBaseline written to {args.baseline}.")
+
+    if failures:
+        print("\nREGRESSIONS:")
+        for failure in failures:
+            print(f"  - {failure}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+import re
+import time
+import random
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Kiểu cột (OID) mô phỏng kết quả cuối của các file sql/*.sql
+PROFILES: Dict[str, List[int]] = {
+    # vpi_doanhthu.sql / doanhthu_bsphu1.sql: 3 ngày, 27 text, năm sinh, 6 tiền, 3 text
+    'doanhthu': [1082] * 3 + [1043] * 10 + [23] + [1043] * 16 + [1700] * 6 + [1043] * 4,
+    # vpi_duyetthanhtoan.sql: 4 ngày, 9 text, 3 tiền, 1 text
+    'duyetthanhtoan': [1082] * 4 + [1043] * 9 + [1700] * 3 + [1043],
+    # vpi_khachhang.sql: ngày khám (timestamp), ngày ra viện, 16 text, ngày hẹn, 7 text
+    'khachhang': [1114, 1082] + [1043] * 16 + [1082] + [1043] * 7,
+}
+
+_DATE_RE = re.compile(r"'(\d{4}-\d{2}-\d{2})'")
+
+class FakeQueryCost:
+    def __init__(self, query_ms: float = 0.0, ms_per_thousand_rows: float = 0.0):
+        self.query_ms = query_ms
+        self.ms_per_thousand_rows = ms_per_thousand_rows
+
+    def wait(self, rows: int):
+        delay = (self.query_ms + self.ms_per_thousand_rows * rows / 1000.0) / 1000.0
+        if delay > 0:
+            time.sleep(delay)
+
+class FakePostgresConnector:
+    def __init__(self, profile: str, rows_per_day: int, cost: Optional[FakeQueryCost] = None, stats: Optional[Dict[str, int]] = None):
+        self.type_codes = PROFILES[profile]
+        self.rows_per_day = rows_per_day
+        self.cost = cost or FakeQueryCost()
+        self.stats = stats if stats is not None else {}
+        self.column_types: Optional[List[int]] = None
+        self._preludes = set()
+        self._prepared = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def _count(self, key: str):
+        self.stats[key] = self.stats.get(key, 0) + 1
+
+    def _batch_range(self, dates: Sequence[str]) -> Tuple[date, date]:
+        parsed = sorted(date.fromisoformat(d) for d in dates)
+        return parsed[0], parsed[-1]
+
+    def _generate(self, start: date, end: date) -> Iterator[tuple]:
+        day = start
+        while day <= end:
+            rng = random.Random(day.toordinal())
+            moment = datetime(day.year, day.month, day.day, 7, 0)
+            for i in range(self.rows_per_day):
+                row = []
+                for col, type_code in enumerate(self.type_codes):
+                    if type_code == 1082:
+                        row.append(day if col == 0 else day + timedelta(days=rng.randint(0, 3)))
+                    elif type_code == 1114:
+                        row.append(moment + timedelta(minutes=rng.randint(0, 600)))
+                    elif type_code == 1700:
+                        row.append(Decimal(rng.randint(0, 5_000_000)) / 100)
+                    elif type_code == 23:
+                        row.append(rng.randint(1940, 2020))
+                    elif col == 7 or (col > 20 and rng.random() < 0.3):
+                        row.append(None)
+                    else:
+                        row.append(f"V{col}-{rng.randint(0, 99999):05d}-{i}")
+                yield tuple(row)
+            day += timedelta(days=1)
+
+    def _rows_in(self, start: date, end: date) -> int:
+        return ((end - start).days + 1) * self.rows_per_day
+
+    def run_prelude(self, key: str, sql: str) -> bool:
+        if key in self._preludes:
+            return False
+        self._preludes.add(key)
+        self._count('prelude')
+        return True
+
+    def prepare(self, name: str, sql: str) -> bool:
+        if name in self._prepared:
+            return False
+        self._prepared.add(name)
+        self._count('prepare')
+        return True
+
+    def execute_prepared(self, name: str, sql: str, params: Sequence) -> Tuple[List[tuple], int]:
+        self.prepare(name, sql)
+        self._count('execute')
+        return self._fetch(*self._batch_range(params))
+
+    def execute_query(self, query: str) -> Tuple[List[tuple], int]:
+        self._count('query')
+        return self._fetch(*self._batch_range(_DATE_RE.findall(query)))
+
+    def _fetch(self, start: date, end: date) -> Tuple[List[tuple], int]:
+        self.cost.wait(self._rows_in(start, end))
+        self.column_types = list(self.type_codes)
+        return list(self._generate(start, end)), len(self.type_codes)
+
+    def iter_query(self, query: str, fetch_size: int) -> Iterator[tuple]:
+        self._count('stream')
+        start, end = self._batch_range(_DATE_RE.findall(query))
+        self.cost.wait(0)
+        self.column_types = list(self.type_codes)
+        fetched = 0
+        for row in self._generate(start, end):
+            fetched += 1
+            if fetched % fetch_size == 0:
+                self.cost.wait(fetch_size)
+            yield row
+
+    def iter_copy(self, query: str) -> Iterator[List[str]]:
+        self._count('copy')
+        start, end = self._batch_range(_DATE_RE.findall(query))
+        self.cost.wait(self._rows_in(start, end))
+        self.column_types = list(self.type_codes)
+        for row in self._generate(start, end):
+            # Giống output của COPY ... CSV: NULL thành chuỗi rỗng, timestamp dạng ISO có dấu cách
+            yield ['' if v is None else v.isoformat(sep=' ') if isinstance(v, datetime) else str(v) for v in row]
+
+class FakeConnectionPool:
+    def __init__(self, profile: str, rows_per_day: int, cost: Optional[FakeQueryCost] = None):
+        self.profile = profile
+        self.rows_per_day = rows_per_day
+        self.cost = cost
+        self.stats: Dict[str, int] = {}
+        self.connections = 0
+
+    def connector(self) -> FakePostgresConnector:
+        self.connections += 1
+        return FakePostgresConnector(self.profile, self.rows_per_day, self.cost, self.stats)
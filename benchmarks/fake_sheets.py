@@ -0,0 +1,343 @@
+import re
+import json
+import time
+import threading
+import multiprocessing
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, unquote, parse_qs
+
+_CELL_RE = re.compile(r"^([A-Za-z]*)(\d*)$")
+_PATH_RE = re.compile(r"^/v4/spreadsheets/([^/:]+)(?::(batchUpdate)|/values(?::(batchUpdate)|/([^:]+)(?::(append|clear))?))?$")
+
+def _column_number(letters: str) -> int:
+    number = 0
+    for char in letters.upper():
+        number = number * 26 + (ord(char) - ord('A')) + 1
+    return number
+
+def parse_a1(range_str: str) -> Tuple[str, Optional[int], Optional[int], Optional[int], Optional[int]]:
+    # Trả về (tên sheet, dòng đầu, dòng cuối, cột đầu, cột cuối), đánh số từ 1; None = không giới hạn
+    sheet, _, cells = range_str.rpartition('!')
+    if not sheet:
+        sheet, cells = cells, ''
+    if sheet.startswith("'") and sheet.endswith("'"):
+        sheet = sheet[1:-1].replace("''", "'")
+    if not cells:
+        return sheet, None, None, None, None
+    start, _, end = cells.partition(':')
+    end = end or start
+    start_col, start_row = _CELL_RE.match(start).groups()
+    end_col, end_row = _CELL_RE.match(end).groups()
+    return (
+        sheet,
+        int(start_row) if start_row else None,
+        int(end_row) if end_row else None,
+        _column_number(start_col) if start_col else None,
+        _column_number(end_col) if end_col else None,
+    )
+
+class FakeSheet:
+    def __init__(self, sheet_id: int, title: str, row_count: int = 1000, column_count: int = 26, hidden: bool = False, header: bool = True):
+        self.sheet_id = sheet_id
+        self.title = title
+        self.row_count = row_count
+        self.column_count = column_count
+        self.hidden = hidden
+        self.rows: List[List[Any]] = [[f"H{c + 1}" for c in range(8)]] if header else []  # dòng 1 là header
+
+    def properties(self) -> Dict[str, Any]:
+        return {
+            'sheetId': self.sheet_id,
+            'title': self.title,
+            'hidden': self.hidden,
+            'gridProperties': {'rowCount': self.row_count, 'columnCount': self.column_count, 'frozenRowCount': 1},
+        }
+
+    def read(self, start_row_index: int, end_row_index: int, start_col_index: int, end_col_index: int) -> List[List[Any]]:
+        return [
+            [row[c] if c < len(row) else None for c in range(start_col_index, end_col_index)]
+            for row in (self.rows[r] if r < len(self.rows) else [] for r in range(start_row_index, end_row_index))
+        ]
+
+    def last_row(self) -> int:
+        for index in range(len(self.rows) - 1, -1, -1):
+            if any(v not in (None, '') for v in self.rows[index]):
+                return index + 1
+        return 0
+
+    def write(self, first_row: int, first_col: int, values: List[List[Any]]):
+        last_row = first_row + len(values) - 1
+        if last_row > self.row_count:
+            raise FakeApiError(400, f"Range exceeds grid limits. Max rows: {self.row_count}", 'INVALID_ARGUMENT')
+        while len(self.rows) < last_row:
+            self.rows.append([])
+        for offset, values_row in enumerate(values):
+            row = self.rows[first_row - 1 + offset]
+            end = first_col - 1 + len(values_row)
+            if len(row) < end:
+                row.extend([None] * (end - len(row)))
+            row[first_col - 1:end] = values_row
+            self.column_count = max(self.column_count, end)
+
+    def clear(self, first_row: int, last_row: int, first_col: int, last_col: Optional[int]):
+        for index in range(first_row - 1, min(last_row, len(self.rows))):
+            row = self.rows[index]
+            stop = len(row) if last_col is None else min(last_col, len(row))
+            for col in range(first_col - 1, stop):
+                row[col] = None
+
+    def insert_rows(self, start_index: int, count: int):
+        self.rows[start_index:start_index] = [[] for _ in range(count)] if start_index <= len(self.rows) else []
+        self.row_count += count
+
+    def delete_rows(self, start_index: int, end_index: int):
+        if self.row_count - (end_index - start_index) < 2:
+            raise FakeApiError(400, "Sorry, it is not possible to delete all non-frozen rows.", 'INVALID_ARGUMENT')
+        del self.rows[start_index:end_index]
+        self.row_count -= end_index - start_index
+
+    def resize(self, row_count: int):
+        del self.rows[row_count:]
+        self.row_count = row_count
+
+class FakeApiError(Exception):
+    def __init__(self, code: int, message: str, status: str):
+        super().__init__(message)
+        self.code = code
+        self.status = status
+
+class FakeSheetsBackend:
+    def __init__(self, latency_ms: float = 0.0, quota_per_minute: int = 0, max_payload_bytes: int = 10 * 1024 * 1024):
+        self.latency_ms = latency_ms
+        self.quota_per_minute = quota_per_minute
+        self.max_payload_bytes = max_payload_bytes
+        self.spreadsheets: Dict[str, Dict[str, FakeSheet]] = {}
+        self.stats: Dict[str, int] = {}
+        self._recent = {'read': deque(), 'write': deque()}
+        self._lock = threading.Lock()
+
+    def reset(self, spreadsheets: Dict[str, List[str]], **settings):
+        with self._lock:
+            for key, value in settings.items():
+                setattr(self, key, value)
+            self.spreadsheets = {
+                spreadsheet_id: {title: FakeSheet(index, title) for index, title in enumerate(titles)}
+                for spreadsheet_id, titles in spreadsheets.items()
+            }
+            self.stats = {}
+            self._recent = {'read': deque(), 'write': deque()}
+
+    def _count(self, key: str, amount: int = 1):
+        self.stats[key] = self.stats.get(key, 0) + amount
+
+    def _admit(self, group: str):
+        # Cửa sổ trượt 60 giây như quota theo phút của Sheets API
+        if not self.quota_per_minute:
+            return
+        now = time.monotonic()
+        recent = self._recent[group]
+        while recent and now - recent[0] >= 60:
+            recent.popleft()
+        if len(recent) >= self.quota_per_minute:
+            self._count('http_429')
+            raise FakeApiError(429, f"Quota exceeded for quota metric '{group.title()} requests'", 'RESOURCE_EXHAUSTED')
+        recent.append(now)
+
+    def _sheet(self, spreadsheet_id: str, title: str) -> FakeSheet:
+        sheets = self.spreadsheets.get(spreadsheet_id)
+        if sheets is None:
+            raise FakeApiError(404, "Requested entity was not found.", 'NOT_FOUND')
+        if title not in sheets:
+            raise FakeApiError(400, f"Unable to parse range: {title}", 'INVALID_ARGUMENT')
+        return sheets[title]
+
+    def _sheet_by_id(self, spreadsheet_id: str, sheet_id: int) -> FakeSheet:
+        for sheet in self.spreadsheets.get(spreadsheet_id, {}).values():
+            if sheet.sheet_id == sheet_id:
+                return sheet
+        raise FakeApiError(400, f"No grid with id: {sheet_id}", 'INVALID_ARGUMENT')
+
+    def handle(self, method: str, path: str, query: Dict[str, List[str]], body: bytes) -> Dict[str, Any]:
+        match = _PATH_RE.match(path)
+        if not match:
+            raise FakeApiError(404, f"Unknown path {path}", 'NOT_FOUND')
+        spreadsheet_id, sheet_batch, values_batch, range_str, action = match.groups()
+        group = 'read' if method == 'GET' else 'write'
+        with self._lock:
+            self._count(f"{group}_requests")
+            self._count('bytes_received', len(body))
+            if len(body) > self.max_payload_bytes:
+                self._count('http_400_payload')
+                raise FakeApiError(400, f"Request payload size exceeds the limit: {self.max_payload_bytes} bytes.", 'INVALID_ARGUMENT')
+            self._admit(group)
+            payload = json.loads(body) if body else {}
+
+            if sheet_batch:
+                self._count('spreadsheets.batchUpdate')
+                return self._batch_update(spreadsheet_id, payload.get('requests', []))
+            if values_batch:
+                self._count('values.batchUpdate')
+                for value_range in payload.get('data', []):
+                    title, first_row, _, first_col, _ = parse_a1(value_range['range'])
+                    self._sheet(spreadsheet_id, title).write(first_row or 1, first_col or 1, value_range.get('values', []))
+                    self._count('rows_written', len(value_range.get('values', [])))
+                return {'spreadsheetId': spreadsheet_id}
+            if range_str is None:
+                self._count('spreadsheets.get')
+                return {'sheets': [{'properties': s.properties()} for s in self.spreadsheets.get(spreadsheet_id, {}).values()]}
+
+            title, first_row, last_row, first_col, last_col = parse_a1(unquote(range_str))
+            sheet = self._sheet(spreadsheet_id, title)
+            if action == 'append':
+                self._count('values.append')
+                values = payload.get('values', [])
+                start_row = sheet.last_row() + 1
+                if query.get('insertDataOption', ['OVERWRITE'])[0] == 'INSERT_ROWS':
+                    sheet.row_count = max(sheet.row_count, start_row - 1) + len(values)
+                sheet.write(start_row, first_col or 1, values)
+                self._count('rows_written', len(values))
+                updated_range = f"{title}!A{start_row}:A{start_row + len(values) - 1}"
+                return {'updates': {'updatedRange': updated_range, 'updatedRows': len(values)}}
+            if action == 'clear':
+                self._count('values.clear')
+                sheet.clear(first_row or 1, last_row or sheet.row_count, first_col or 1, last_col)
+                return {'clearedRange': range_str}
+            self._count('values.get')
+            last = min(sheet.last_row(), last_row or sheet.row_count)
+            col = (first_col or 1) - 1
+            values = [[row[col]] if len(row) > col and row[col] not in (None, '') else [] for row in sheet.rows[(first_row or 1) - 1:last]]
+            return {'values': values}
+
+    def _batch_update(self, spreadsheet_id: str, requests: List[Dict[str, Any]]) -> Dict[str, Any]:
+        replies = []
+        for request in requests:
+            kind, spec = next(iter(request.items()))
+            self._count(f"request.{kind}")
+            replies.append({})
+            if kind == 'addSheet':
+                properties = spec.get('properties', {})
+                sheets = self.spreadsheets.setdefault(spreadsheet_id, {})
+                if properties['title'] in sheets:
+                    raise FakeApiError(400, f"A sheet with the name \"{properties['title']}\" already exists.", 'INVALID_ARGUMENT')
+                grid = properties.get('gridProperties', {})
+                sheet = FakeSheet(
+                    properties.get('sheetId', max((s.sheet_id for s in sheets.values()), default=-1) + 1),
+                    properties['title'],
+                    grid.get('rowCount', 1000),
+                    grid.get('columnCount', 26),
+                    hidden=properties.get('hidden', False),
+                    header=False
+                )
+                sheets[sheet.title] = sheet
+                replies[-1] = {'addSheet': {'properties': sheet.properties()}}
+            elif kind == 'deleteSheet':
+                sheet = self._sheet_by_id(spreadsheet_id, spec['sheetId'])
+                del self.spreadsheets[spreadsheet_id][sheet.title]
+            elif kind == 'copyPaste':
+                source, destination = spec['source'], spec['destination']
+                values = self._sheet_by_id(spreadsheet_id, source['sheetId']).read(
+                    source['startRowIndex'], source['endRowIndex'], source['startColumnIndex'], source['endColumnIndex'])
+                self._sheet_by_id(spreadsheet_id, destination['sheetId']).write(
+                    destination['startRowIndex'] + 1, destination['startColumnIndex'] + 1, values)
+            elif kind == 'repeatCell':
+                self._sheet_by_id(spreadsheet_id, spec['range']['sheetId'])
+            elif kind == 'appendDimension':
+                self._sheet_by_id(spreadsheet_id, spec['sheetId']).row_count += spec['length']
+            elif kind == 'insertDimension':
+                r = spec['range']
+                self._sheet_by_id(spreadsheet_id, r['sheetId']).insert_rows(r['startIndex'], r['endIndex'] - r['startIndex'])
+            elif kind == 'deleteDimension':
+                r = spec['range']
+                self._sheet_by_id(spreadsheet_id, r['sheetId']).delete_rows(r['startIndex'], r['endIndex'])
+            elif kind == 'updateCells':
+                r = spec['range']
+                sheet = self._sheet_by_id(spreadsheet_id, r['sheetId'])
+                last_col = r.get('endColumnIndex')
+                sheet.clear(r.get('startRowIndex', 0) + 1, r.get('endRowIndex', sheet.row_count), r.get('startColumnIndex', 0) + 1, last_col)
+            elif kind == 'updateSheetProperties':
+                properties = spec['properties']
+                self._sheet_by_id(spreadsheet_id, properties['sheetId']).resize(properties['gridProperties']['rowCount'])
+            else:
+                raise FakeApiError(400, f"Unsupported request {kind}", 'INVALID_ARGUMENT')
+        return {'replies': replies}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'stats': dict(self.stats),
+                'sheets': {
+                    f"{sid}/{title}": {'last_row': sheet.last_row(), 'row_count': sheet.row_count}
+                    for sid, sheets in self.spreadsheets.items() for title, sheet in sheets.items()
+                },
+            }
+
+def _make_handler(backend: FakeSheetsBackend):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status: int, payload: Dict[str, Any]):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=UTF-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _dispatch(self, method: str):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+            url = urlsplit(self.path)
+            if url.path == '/_stats':
+                return self._reply(200, backend.snapshot())
+            if url.path == '/_reset':
+                payload = json.loads(body)
+                backend.reset(payload.pop('spreadsheets'), **payload)
+                return self._reply(200, {})
+            if backend.latency_ms:
+                time.sleep(backend.latency_ms / 1000.0)
+            try:
+                self._reply(200, backend.handle(method, url.path, parse_qs(url.query), body))
+            except FakeApiError as e:
+                self._reply(e.code, {'error': {'code': e.code, 'message': str(e), 'status': e.status}})
+
+        def do_GET(self):
+            self._dispatch('GET')
+
+        def do_POST(self):
+            self._dispatch('POST')
+
+    return Handler
+
+def serve(port_queue, host: str = '127.0.0.1'):
+    server = ThreadingHTTPServer((host, 0), _make_handler(FakeSheetsBackend()))
+    server.daemon_threads = True
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+class FakeSheetsServer:
+    # Chạy ở tiến trình riêng để CPU/bộ nhớ của server giả không lẫn vào số đo của pipeline
+    def __init__(self):
+        self._process = None
+        self.port = None
+
+    def __enter__(self):
+        context = multiprocessing.get_context('spawn')
+        port_queue = context.Queue()
+        self._process = context.Process(target=serve, args=(port_queue,), daemon=True)
+        self._process.start()
+        self.port = port_queue.get(timeout=30)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._process:
+            self._process.terminate()
+            self._process.join()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
@@ -1,34 +1,64 @@
+-- @prelude
+-- Chạy một lần cho mỗi phiên DB: các bảng TEMP không phụ thuộc khoảng ngày của lô
+DROP TABLE IF EXISTS pg_temp.etl_treatment_first;
+CREATE TEMP TABLE etl_treatment_first AS
+    SELECT * FROM (
+            SELECT
+                medicalrecordid,
+                 CASE
+                    WHEN LENGTH(yeucaukham) > 0 THEN do_roomid
+                    ELSE roomid
+                END AS roomid,
+                do_roomid,
+                CASE
+                    WHEN LENGTH(yeucaukham) > 0 THEN do_departmentid
+                    ELSE departmentid
+                END AS departmentid,
+                do_departmentid,
+                do_userid,
+                userid_phu1,
+                ROW_NUMBER() OVER (PARTITION BY medicalrecordid ORDER BY treatmentdate, LENGTH(yeucaukham) DESC) AS rownumber
+            FROM
+                tb_treatment
+    ) AS tb_temp
+    WHERE rownumber = 1;
+CREATE INDEX ON etl_treatment_first (medicalrecordid);
+ANALYZE etl_treatment_first;
+
+DROP TABLE IF EXISTS pg_temp.etl_pr_phau_thuat;
+CREATE TEMP TABLE etl_pr_phau_thuat AS
+    SELECT DISTINCT patientrecordid FROM tb_servicedata WHERE servicecode IN ('DV_0322', '12.0319.1190', '12.0320.1190', 'DV_0318', '10.0549.0494', '15.0151.2036', '10.0555.0494', 'DV_0310', 'DV_0306', 'DV_0314', '27.0273.0473', '13.0115.0650', 'DV_0313', '27.0187.2039', '10.0411.0584.2', 'DV_0336');
+CREATE INDEX ON etl_pr_phau_thuat (patientrecordid);
+ANALYZE etl_pr_phau_thuat;
+
+DROP TABLE IF EXISTS pg_temp.etl_pr_ngoai_phau;
+CREATE TEMP TABLE etl_pr_ngoai_phau AS
+    SELECT DISTINCT patientrecordid FROM tb_servicedata WHERE dm_servicesubgroupid = '100049';
+CREATE INDEX ON etl_pr_ngoai_phau (patientrecordid);
+ANALYZE etl_pr_ngoai_phau;
+
+DROP TABLE IF EXISTS pg_temp.etl_pr_tieu_hoa_do_room;
+CREATE TEMP TABLE etl_pr_tieu_hoa_do_room AS
+    SELECT DISTINCT patientrecordid FROM tb_servicedata WHERE do_roomid IN (65,110,270,271,272);
+CREATE INDEX ON etl_pr_tieu_hoa_do_room (patientrecordid);
+ANALYZE etl_pr_tieu_hoa_do_room;
+
+DROP TABLE IF EXISTS pg_temp.etl_pr_tieu_hoa_room;
+CREATE TEMP TABLE etl_pr_tieu_hoa_room AS
+    SELECT DISTINCT patientrecordid FROM tb_servicedata WHERE roomid IN (65,110,270,271,272);
+CREATE INDEX ON etl_pr_tieu_hoa_room (patientrecordid);
+ANALYZE etl_pr_tieu_hoa_room;
+
+-- @query
 WITH
-    tb_temp AS (
-        SELECT
-            medicalrecordid,
-             CASE
-                WHEN LENGTH(yeucaukham) > 0 THEN do_roomid
-                ELSE roomid
-            END AS roomid,
-            do_roomid,
-            CASE
-                WHEN LENGTH(yeucaukham) > 0 THEN do_departmentid
-                ELSE departmentid
-            END AS departmentid,
-            do_departmentid,
-            do_userid,
-            userid_phu1,
-            ROW_NUMBER() OVER (PARTITION BY medicalrecordid ORDER BY treatmentdate, LENGTH(yeucaukham) DESC) AS rownumber
-        FROM
-            tb_treatment
-    ),
-    
     treatment AS (
-        SELECT * 
-        FROM tb_temp 
-        WHERE rownumber = 1
+        SELECT * FROM etl_treatment_first
     ),
 
+
     -- Lọc lấy ra hóa đơn thu phiếu dịch vụ hợp lệ
     tempInvoicedv AS (
-        SELECT *
-        FROM tb_invoice
+        SELECT * FROM tb_invoice
         WHERE dm_invoice_typeid = 1  -- chỉ lấy loại phiếu thu tiền dịch vụ 3,4 là ứng, hoàn ứng
             AND huyphieu_status = 0  -- loại bỏ phiếu bị hủy
     ),
@@ -119,12 +149,11 @@ WITH
 				ELSE 'Chưa nộp'
 			END AS ThuTien,
             case
-                WHEN sv.patientrecordid IN (select patientrecordid from tb_servicedata where servicecode  IN ('DV_0322','12.0319.1190','12.0320.1190','DV_0318','10.0549.0494','15.0151.2036','10.0555.0494','DV_0310','DV_0306','DV_0314',
-                    '27.0273.0473','13.0115.0650','DV_0313','27.0187.2039','10.0411.0584.2','DV_0336') ) THEN 'Phẫu thuật'
-                when sv.patientrecordid IN (SELECT patientrecordid FROM tb_servicedata WHERE dm_servicesubgroupid ='100049') and p.patientrecorddate::date >= '2025-07-01'  then 'Ngoại phẫu' 
+                WHEN sv.patientrecordid IN (SELECT patientrecordid FROM etl_pr_phau_thuat) THEN 'Phẫu thuật'
+                when sv.patientrecordid IN (SELECT patientrecordid FROM etl_pr_ngoai_phau) and p.patientrecorddate::date >= '2025-07-01'  then 'Ngoại phẫu' 
                 WHEN p.dm_patientrecordtypeid = 2 THEN 'Nội trú'
-                WHEN sv.patientrecordid IN (select patientrecordid from tb_servicedata where do_roomid  IN (65,110,270,271,272)) THEN 'Tiêu hóa'
-                                WHEN sv.patientrecordid IN (select patientrecordid from tb_servicedata where roomid  IN (65,110,270,271,272)) THEN 'Tiêu hóa'
+                WHEN sv.patientrecordid IN (SELECT patientrecordid FROM etl_pr_tieu_hoa_do_room) THEN 'Tiêu hóa'
+                                WHEN sv.patientrecordid IN (SELECT patientrecordid FROM etl_pr_tieu_hoa_room) THEN 'Tiêu hóa'
                 ELSE 'Đa Khoa'
             END AS DaKhoaOrTieuHoa,
 			sv.lydomiengiam AS lydogiamgia
@@ -263,11 +292,10 @@ WITH
             END AS ThuTien,
             CASE
                 WHEN p.dm_patientrecordtypeid = 2 THEN 'Nội trú'
-                WHEN bill.patientrecordid IN (select patientrecordid from tb_servicedata where servicecode  IN ('DV_0322','12.0319.1190','12.0320.1190','DV_0318','10.0549.0494','15.0151.2036','10.0555.0494','DV_0310','DV_0306','DV_0314',
-	            '27.0273.0473','13.0115.0650','DV_0313','27.0187.2039','10.0411.0584.2','DV_0336') ) THEN 'Phẫu thuật'
-                when bill.patientrecordid  IN (SELECT patientrecordid FROM tb_servicedata WHERE dm_servicesubgroupid ='100049') and p.patientrecorddate::date >= '2025-07-01'  then 'Ngoại phẫu'
-                WHEN bill.patientrecordid IN (SELECT patientrecordid FROM tb_servicedata WHERE do_roomid IN (65,110,270,271,272)) THEN 'Tiêu hóa'
-                WHEN bill.patientrecordid IN (SELECT patientrecordid FROM tb_servicedata WHERE roomid IN (65,110,270,271,272)) THEN 'Tiêu hóa'
+                WHEN bill.patientrecordid IN (SELECT patientrecordid FROM etl_pr_phau_thuat) THEN 'Phẫu thuật'
+                when bill.patientrecordid  IN (SELECT patientrecordid FROM etl_pr_ngoai_phau) and p.patientrecorddate::date >= '2025-07-01'  then 'Ngoại phẫu'
+                WHEN bill.patientrecordid IN (SELECT patientrecordid FROM etl_pr_tieu_hoa_do_room) THEN 'Tiêu hóa'
+                WHEN bill.patientrecordid IN (SELECT patientrecordid FROM etl_pr_tieu_hoa_room) THEN 'Tiêu hóa'
                 ELSE 'Đa Khoa'
             END AS DaKhoaOrTieuHoa,
 			null AS lydogiamgia
@@ -1,34 +1,64 @@
+-- @prelude
+-- Chạy một lần cho mỗi phiên DB: các bảng TEMP không phụ thuộc khoảng ngày của lô
+DROP TABLE IF EXISTS pg_temp.etl_treatment_first;
+CREATE TEMP TABLE etl_treatment_first AS
+    SELECT * FROM (
+            SELECT
+                medicalrecordid,
+                CASE
+                    WHEN LENGTH(yeucaukham) > 0 THEN do_roomid
+                    ELSE roomid
+                END AS roomid,
+                do_roomid,
+                CASE
+                    WHEN LENGTH(yeucaukham) > 0 THEN do_departmentid
+                    ELSE departmentid
+                END AS departmentid,
+                do_departmentid,
+                do_userid,
+                userid_phu1,
+                ROW_NUMBER() OVER (PARTITION BY medicalrecordid ORDER BY treatmentdate, LENGTH(yeucaukham) DESC) AS rownumber
+            FROM
+                tb_treatment
+    ) AS tb_temp
+    WHERE rownumber = 1;
+CREATE INDEX ON etl_treatment_first (medicalrecordid);
+ANALYZE etl_treatment_first;
+
+DROP TABLE IF EXISTS pg_temp.etl_pr_tieu_hoa_do_room;
+CREATE TEMP TABLE etl_pr_tieu_hoa_do_room AS
+    SELECT DISTINCT patientrecordid FROM tb_servicedata WHERE do_roomid IN (65,110,270,271,272);
+CREATE INDEX ON etl_pr_tieu_hoa_do_room (patientrecordid);
+ANALYZE etl_pr_tieu_hoa_do_room;
+
+DROP TABLE IF EXISTS pg_temp.etl_pr_tieu_hoa_room;
+CREATE TEMP TABLE etl_pr_tieu_hoa_room AS
+    SELECT DISTINCT patientrecordid FROM tb_servicedata WHERE roomid IN (65,110,270,271,272);
+CREATE INDEX ON etl_pr_tieu_hoa_room (patientrecordid);
+ANALYZE etl_pr_tieu_hoa_room;
+
+DROP TABLE IF EXISTS pg_temp.etl_bill_tieu_hoa_do_room;
+CREATE TEMP TABLE etl_bill_tieu_hoa_do_room AS
+    SELECT DISTINCT patientrecordid FROM tb_medicinebill WHERE do_roomid IN (65,110,270,271,272);
+CREATE INDEX ON etl_bill_tieu_hoa_do_room (patientrecordid);
+ANALYZE etl_bill_tieu_hoa_do_room;
+
+DROP TABLE IF EXISTS pg_temp.etl_bill_tieu_hoa_room;
+CREATE TEMP TABLE etl_bill_tieu_hoa_room AS
+    SELECT DISTINCT patientrecordid FROM tb_medicinebill WHERE roomid IN (65,110,270,271,272);
+CREATE INDEX ON etl_bill_tieu_hoa_room (patientrecordid);
+ANALYZE etl_bill_tieu_hoa_room;
+
+-- @query
 WITH
-    tb_temp AS (
-        SELECT
-            medicalrecordid,
-            CASE
-                WHEN LENGTH(yeucaukham) > 0 THEN do_roomid
-                ELSE roomid
-            END AS roomid,
-            do_roomid,
-            CASE
-                WHEN LENGTH(yeucaukham) > 0 THEN do_departmentid
-                ELSE departmentid
-            END AS departmentid,
-            do_departmentid,
-            do_userid,
-            userid_phu1,
-            ROW_NUMBER() OVER (PARTITION BY medicalrecordid ORDER BY treatmentdate, LENGTH(yeucaukham) DESC) AS rownumber
-        FROM
-            tb_treatment
-    ),
-    
     treatment AS (
-        SELECT * FROM tb_temp 
-        WHERE rownumber = 1
+        SELECT * FROM etl_treatment_first
     ),
 
     tempInvoicedv AS (
-        SELECT *
-        FROM tb_invoice
-        WHERE dm_invoice_typeid = 1
-            AND huyphieu_status = 0
+        SELECT * FROM tb_invoice
+        WHERE dm_invoice_typeid = 1  -- chỉ lấy loại phiếu thu tiền dịch vụ 3,4 là ứng, hoàn ứng
+            AND huyphieu_status = 0  -- loại bỏ phiếu bị hủy
     ),
     
     servicefull AS (
@@ -116,8 +146,8 @@ WITH
             END AS ThuTien,
             CASE
                 WHEN p.dm_patientrecordtypeid = 2 THEN 'Nội trú'
-                WHEN sv.patientrecordid IN (select patientrecordid from tb_servicedata where do_roomid  IN (65,110,270,271,272)) THEN 'Tiêu hóa'
-                WHEN sv.patientrecordid IN (select patientrecordid from tb_servicedata where roomid  IN (65,110,270,271,272)) THEN 'Tiêu hóa'
+                WHEN sv.patientrecordid IN (SELECT patientrecordid FROM etl_pr_tieu_hoa_do_room) THEN 'Tiêu hóa'
+                WHEN sv.patientrecordid IN (SELECT patientrecordid FROM etl_pr_tieu_hoa_room) THEN 'Tiêu hóa'
                 ELSE 'Đa Khoa'
             END AS DaKhoaOrTieuHoa,
             sv.lydomiengiam AS lydogiamgia
@@ -259,8 +289,8 @@ WITH
             END AS ThuTien,
             CASE
                 WHEN p.dm_patientrecordtypeid = 2 THEN 'Nội trú'
-                WHEN bill.patientrecordid IN (SELECT patientrecordid FROM tb_medicinebill WHERE do_roomid IN (65,110,270,271,272)) THEN 'Tiêu hóa'
-                WHEN bill.patientrecordid IN (SELECT patientrecordid FROM tb_medicinebill WHERE roomid IN (65,110,270,271,272)) THEN 'Tiêu hóa'
+                WHEN bill.patientrecordid IN (SELECT patientrecordid FROM etl_bill_tieu_hoa_do_room) THEN 'Tiêu hóa'
+                WHEN bill.patientrecordid IN (SELECT patientrecordid FROM etl_bill_tieu_hoa_room) THEN 'Tiêu hóa'
                 ELSE 'Đa Khoa'
             END AS DaKhoaOrTieuHoa,
             null AS lydogiamgia
@@ -0,0 +1,74 @@
+import logging
+from datetime import date
+import pytest
+from app.pipelines.checkpoint import RunCheckpoint
+from app.pipelines.incremental import fingerprint_rows
+from app.storage.run_journal import RunJournalStore
+
+logger = logging.getLogger(__name__)
+
+FIRST = ('2026-10-01', '2026-10-05')
+SECOND = ('2026-10-06', '2026-10-10')
+
+@pytest.fixture
+def store(tmp_path):
+    return RunJournalStore(str(tmp_path / 'pipeline_state.db'))
+
+def make_checkpoint(store, period_end=date(2026, 10, 10), sql_hash='h1', load_strategy='overwrite', batch_rows=3):
+    return RunCheckpoint(store=store, report_name='R', period_start=date(2026, 10, 1), period_end=period_end,
+                         sql_hash=sql_hash, load_strategy=load_strategy, batch_rows=batch_rows, logger=logger)
+
+def interrupted_run(store):
+    # Lô đầu (10 dòng, dòng 2..11) đã ghi xong; lô hai mới có chunk 0 (dòng 12..14) chắc chắn nằm trên sheet
+    checkpoint = make_checkpoint(store)
+    checkpoint.start(start_row=2)
+    checkpoint.batch_written(FIRST, 10, next_row=12)
+    checkpoint.chunk_written(SECOND, 0, 12, [['x']] * 3)
+    checkpoint.chunk_written(SECOND, 1, 15, [['y']] * 2)
+    checkpoint.durable_through(14)
+    checkpoint.finish(False)
+
+def test_no_journal_means_full_run(store):
+    assert make_checkpoint(store).plan_resume() is None
+
+def test_resume_continues_after_last_durable_batch(store):
+    interrupted_run(store)
+    plan = make_checkpoint(store).plan_resume()
+    assert plan.resume_from == date(2026, 10, 6)
+    assert plan.next_row == 12
+    assert plan.partial_window == SECOND
+    assert [(c.chunk_index, c.start_row, c.row_count) for c in plan.partial_chunks] == [(0, 12, 3)]
+    assert plan.partial_chunks[0].content_hash == fingerprint_rows([['x']] * 3)
+
+def test_writes_beyond_durable_row_are_not_journaled(store):
+    checkpoint = make_checkpoint(store)
+    checkpoint.start(start_row=2)
+    checkpoint.batch_written(FIRST, 10, next_row=12)
+    checkpoint.durable_through(5)
+    checkpoint.finish(False)
+    plan = make_checkpoint(store).plan_resume()
+    assert plan.resume_from == date(2026, 10, 1)
+    assert plan.next_row == 2
+
+def test_changed_batch_rows_skips_partial_chunks(store):
+    interrupted_run(store)
+    plan = make_checkpoint(store, batch_rows=5).plan_resume()
+    assert plan.partial_window == SECOND
+    assert plan.partial_chunks == []
+
+@pytest.mark.parametrize('kwargs', [
+    {'period_end': date(2026, 10, 11)},
+    {'sql_hash': 'h2'},
+    {'load_strategy': 'append'},
+])
+def test_mismatched_run_is_not_resumed(store, kwargs):
+    interrupted_run(store)
+    assert make_checkpoint(store, **kwargs).plan_resume() is None
+
+def test_completed_run_is_not_resumed(store):
+    checkpoint = make_checkpoint(store)
+    checkpoint.start(start_row=2)
+    checkpoint.batch_written(FIRST, 10, next_row=12)
+    checkpoint.durable_through(11)
+    checkpoint.finish(True)
+    assert make_checkpoint(store).plan_resume() is None
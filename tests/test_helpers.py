@@ -0,0 +1,25 @@
+from app.utils.helpers import sort_rows_nulls_last
+
+def test_sort_keeps_global_order_across_shards():
+    vpi = [('VPI', '2026-10-01', 1), ('VPI', '2026-10-03', 2), ('VPI', None, 3)]
+    cn2 = [('CN2', '2026-10-02', 1), ('CN2', '2026-10-03', 1), ('CN2', None, 1)]
+    assert sort_rows_nulls_last(vpi + cn2, [1]) == [
+        ('VPI', '2026-10-01', 1), ('CN2', '2026-10-02', 1),
+        # Khóa bằng nhau: giữ thứ tự đầu vào (thứ tự databases)
+        ('VPI', '2026-10-03', 2), ('CN2', '2026-10-03', 1),
+        # NULL đứng cuối như ORDER BY ... ASC của Postgres
+        ('VPI', None, 3), ('CN2', None, 1),
+    ]
+
+def test_sort_does_not_assume_sorted_shards():
+    # Shard sắp theo cột khác (hoặc không sắp) vẫn ra đúng thứ tự shard_order_by
+    vpi = [('VPI', 3, 'a'), ('VPI', 1, 'b')]
+    cn2 = [('CN2', 2, 'c'), ('CN2', None, 'd'), ('CN2', 0, 'e')]
+    assert sort_rows_nulls_last(vpi + cn2, [1]) == [
+        ('CN2', 0, 'e'), ('VPI', 1, 'b'), ('CN2', 2, 'c'), ('VPI', 3, 'a'), ('CN2', None, 'd'),
+    ]
+
+def test_sort_on_several_keys_with_nulls():
+    rows = [('A', 1, None), ('A', 2, 'b'), ('B', 1, 'a'), ('B', None, 'a')]
+    assert sort_rows_nulls_last(rows, [1, 2]) == [('B', 1, 'a'), ('A', 1, None), ('A', 2, 'b'), ('B', None, 'a')]
+    assert sort_rows_nulls_last([], [1]) == []
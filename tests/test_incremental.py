@@ -0,0 +1,89 @@
+import logging
+import pytest
+from app.pipelines.incremental import IncrementalPlanner, fingerprint_rows
+from app.storage.partition_state import PartitionStateStore
+
+logger = logging.getLogger(__name__)
+
+def rows_for(*blocks):
+    # ('A', 2) -> 2 dòng có giá trị phân vùng 'A' ở cột đầu
+    return [[key, f"{key}-{i}"] for key, count in blocks for i in range(count)]
+
+def make_planner(store, grid_rows, spreadsheet_id='ss', sheet_id=7, period='2026-10-01..2026-10-31', sql_hash='h1'):
+    return IncrementalPlanner(store=store, report_name='R', period=period, sql_hash=sql_hash, partition_index=0,
+                              spreadsheet_id=spreadsheet_id, sheet_id=sheet_id, grid_rows=grid_rows, logger=logger)
+
+@pytest.fixture
+def store(tmp_path):
+    store = PartitionStateStore(str(tmp_path / 'pipeline_state.db'))
+    # Lần chạy đầu: A, B, C mỗi phân vùng 2 dòng ở dòng 2..7
+    planner = make_planner(store, grid_rows=7)
+    planner.add_batch(rows_for(('A', 2), ('B', 2), ('C', 2)))
+    planner.commit(7)
+    return store
+
+def test_first_run_is_full_rewrite_in_query_order(tmp_path):
+    planner = make_planner(PartitionStateStore(str(tmp_path / 'pipeline_state.db')), grid_rows=1)
+    assert planner.full_rewrite
+    assert planner.full_rewrite_reason == "no previous state"
+    rows = rows_for(('A', 1), ('B', 1), ('A', 1))
+    assert planner.add_batch(rows) == rows
+    # A xuất hiện lại sau B: khối thứ hai được đánh số riêng thay vì gộp (không đổi thứ tự dòng)
+    assert [b.partition_key for b in planner.blocks] == ['A', 'B', 'A#2']
+
+def test_unchanged_data_plans_nothing(store):
+    planner = make_planner(store, grid_rows=7)
+    assert not planner.full_rewrite
+    assert planner.add_batch(rows_for(('A', 2), ('B', 2), ('C', 2))) == []
+    assert planner.plan() == ([], [])
+
+def test_grown_partition_inserts_rows_after_its_old_block(store):
+    planner = make_planner(store, grid_rows=7)
+    planner.add_batch(rows_for(('A', 2), ('B', 3), ('C', 2)))
+    requests, writes = planner.plan()
+    assert requests == [{'insertDimension': {
+        'range': {'sheetId': 7, 'dimension': 'ROWS', 'startIndex': 5, 'endIndex': 6},
+        'inheritFromBefore': True
+    }}]
+    assert writes == [(4, rows_for(('B', 3)))]
+
+def test_removed_partition_deletes_its_rows(store):
+    planner = make_planner(store, grid_rows=7)
+    planner.add_batch(rows_for(('A', 2), ('C', 2)))
+    requests, writes = planner.plan()
+    assert requests == [{'deleteDimension': {'range': {'sheetId': 7, 'dimension': 'ROWS', 'startIndex': 3, 'endIndex': 5}}}]
+    assert writes == []
+
+def test_new_partition_at_tail_is_written_without_insert(store):
+    planner = make_planner(store, grid_rows=7)
+    planner.add_batch(rows_for(('A', 2), ('B', 2), ('C', 2), ('D', 1)))
+    requests, writes = planner.plan()
+    assert requests == []
+    assert writes == [(8, rows_for(('D', 1)))]
+
+def test_reordered_partitions_fall_back_to_full_rewrite(store):
+    planner = make_planner(store, grid_rows=7)
+    rows = rows_for(('C', 2), ('A', 2), ('B', 1))
+    planner.add_batch(rows)
+    assert planner.plan() is None
+    assert planner.fall_back_to_full_rewrite() == rows
+    assert planner.full_rewrite
+    assert all(block.rows is None for block in planner.blocks)
+
+def test_commit_records_block_layout(store):
+    state = store.load('R')
+    assert state.target == 'ss/7'
+    assert [(p.partition_key, p.start_row, p.row_count) for p in state.partitions] == [('A', 2, 2), ('B', 4, 2), ('C', 6, 2)]
+    assert state.partitions[0].content_hash == fingerprint_rows(rows_for(('A', 2)))
+
+@pytest.mark.parametrize('kwargs, reason', [
+    ({'spreadsheet_id': 'other'}, "target sheet changed"),
+    ({'sheet_id': 8}, "target sheet changed"),
+    ({'period': '2026-11-01..2026-11-30'}, "report period changed"),
+    ({'sql_hash': 'h2'}, "SQL query changed"),
+    ({'grid_rows': 9}, "modified outside the pipeline"),
+])
+def test_stale_state_forces_full_rewrite(store, kwargs, reason):
+    planner = make_planner(store, **dict({'grid_rows': 7}, **kwargs))
+    assert planner.full_rewrite
+    assert reason in planner.full_rewrite_reason
@@ -0,0 +1,54 @@
+import pytest
+from app.utils import rate_limit
+from app.utils.rate_limit import SheetsQuotaScheduler, TokenBucket
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, 'time', clock)
+    return clock
+
+def test_bucket_never_exceeds_quota_per_minute(clock):
+    bucket = TokenBucket(60, utilization=0.9)
+    assert bucket.capacity + bucket.rate * 60 == pytest.approx(60)
+
+# 12 request/phút, dùng 50%: bucket 6 token, nạp 0.1 token/giây
+def test_burst_then_paced(clock):
+    bucket = TokenBucket(12, utilization=0.5)
+    assert [bucket.reserve() for _ in range(6)] == [0.0] * 6
+    # Hết token: mỗi request sau phải chờ thêm 1 / rate giây, xếp hàng theo thứ tự gọi
+    assert bucket.reserve() == pytest.approx(10)
+    assert bucket.reserve() == pytest.approx(20)
+
+def test_refill_is_capped_at_capacity(clock):
+    bucket = TokenBucket(12, utilization=0.5)
+    bucket.reserve()
+    clock.now += 3600
+    assert [bucket.reserve() for _ in range(6)] == [0.0] * 6
+    assert bucket.reserve() == pytest.approx(10)
+
+def test_pause_delays_until_it_elapses(clock):
+    bucket = TokenBucket(12, utilization=0.5)
+    bucket.pause(30)
+    assert bucket.reserve() == pytest.approx(30)
+    clock.now += 30
+    assert bucket.reserve() == 0.0
+
+def test_scheduler_waits_for_slowest_bucket(clock):
+    # Quota của user (12/phút) chặt hơn quota của project (6000/phút)
+    scheduler = SheetsQuotaScheduler(read_per_minute=12, project_read_per_minute=6000, utilization=0.5)
+    for _ in range(7):
+        scheduler.acquire('read')
+    assert clock.slept == [pytest.approx(10)]
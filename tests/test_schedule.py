@@ -0,0 +1,35 @@
+from datetime import datetime, time, timedelta
+import pytest
+from app.utils.schedule import parse_schedule
+
+def test_interval_runs_at_start_then_every_period():
+    schedule = parse_schedule(' Every  15M ')
+    assert schedule.text == 'Every 15M'
+    assert schedule.interval == timedelta(minutes=15)
+    now = datetime(2026, 10, 18, 9, 0)
+    assert schedule.first_run(now) == now
+    assert schedule.next_after(now) == datetime(2026, 10, 18, 9, 15)
+
+@pytest.mark.parametrize('text, seconds', [('every 30s', 30), ('every 2h', 7200), ('every 1d', 86400)])
+def test_interval_units(text, seconds):
+    assert parse_schedule(text).interval == timedelta(seconds=seconds)
+
+def test_daily_times_are_sorted_and_deduplicated():
+    schedule = parse_schedule('daily 14:00, 02:30,14:00')
+    assert schedule.interval is None
+    assert schedule.times == (time(2, 30), time(14, 0))
+
+@pytest.mark.parametrize('moment, expected', [
+    (datetime(2026, 10, 18, 1, 0), datetime(2026, 10, 18, 2, 30)),
+    (datetime(2026, 10, 18, 2, 30), datetime(2026, 10, 18, 14, 0)),
+    (datetime(2026, 10, 18, 15, 0), datetime(2026, 10, 19, 2, 30)),
+])
+def test_daily_next_run(moment, expected):
+    schedule = parse_schedule('daily 02:30, 14:00')
+    assert schedule.next_after(moment) == expected
+    assert schedule.first_run(moment) == expected
+
+@pytest.mark.parametrize('text', ['every 0m', 'every 5w', 'every m', 'daily', 'daily 25:00', 'daily ,', 'hourly', ''])
+def test_invalid_schedules_raise(text):
+    with pytest.raises(ValueError):
+        parse_schedule(text)
@@ -0,0 +1,24 @@
+import pytest
+from app.connectors.sheets import _split_a1, SheetMetadataCache
+
+@pytest.mark.parametrize('range_str, expected', [
+    ('Sheet1!B2:Z10', ('Sheet1', 2, 10)),
+    ('Sheet1!A5', ('Sheet1', 1, 5)),
+    ("'Doanh thu ''VPI'''!C3:D", ("Doanh thu 'VPI'", 3, None)),
+    ('Sheet1!A:A', ('Sheet1', 1, None)),
+    ('Sheet1!2:40', ('Sheet1', None, 40)),
+    ('Sheet1', ('Sheet1', None, None)),
+    ('Sheet1!not a range', ('Sheet1', None, None)),
+])
+def test_split_a1(range_str, expected):
+    assert _split_a1(range_str) == expected
+
+
+def test_row_bound_uses_known_last_row_then_grid():
+    cache = SheetMetadataCache()
+    assert cache.row_bound('ss', 'A') is None
+    cache.store('ss', [{'sheetId': 0, 'title': 'A', 'gridProperties': {'rowCount': 1000, 'columnCount': 26}}])
+    assert cache.row_bound('ss', 'A') == 1000
+    cache.set_last_row('ss', 'A', 42)
+    assert cache.row_bound('ss', 'A') == 42
+    assert cache.row_bound('ss', 'B') is None
@@ -0,0 +1,33 @@
+from app.utils.sql import prelude_tables
+
+DOANHTHU = """
+-- bảng tạm dùng chung
+DROP TABLE IF EXISTS pg_temp.etl_treatment_first;
+CREATE TEMP TABLE etl_treatment_first AS SELECT medicalrecordid FROM tb_treatment WHERE note <> ';';
+CREATE INDEX ON etl_treatment_first (medicalrecordid);
+ANALYZE etl_treatment_first;
+DROP TABLE IF EXISTS pg_temp.etl_pr_phau_thuat;
+CREATE TEMP TABLE etl_pr_phau_thuat AS SELECT patientrecordid FROM tb_servicedata;
+"""
+
+DUYET = """
+DROP TABLE IF EXISTS pg_temp.etl_treatment_first;
+CREATE TEMP TABLE etl_treatment_first AS
+    SELECT medicalrecordid   FROM tb_treatment WHERE note <> ';';  -- khác khoảng trắng và comment
+CREATE INDEX ON etl_treatment_first (medicalrecordid);
+ANALYZE etl_treatment_first;
+SET LOCAL work_mem = '64MB';
+"""
+
+def test_tables_are_fingerprinted_by_their_own_statements():
+    doanhthu, duyet = prelude_tables(DOANHTHU), prelude_tables(DUYET)
+    assert list(doanhthu) == ['etl_treatment_first', 'etl_pr_phau_thuat']
+    # Cùng định nghĩa (chỉ khác khoảng trắng / comment): dùng chung bảng đã dựng
+    assert doanhthu['etl_treatment_first'] == duyet['etl_treatment_first']
+    # Câu lệnh không gắn với bảng nào
+    assert set(duyet) == {'etl_treatment_first', ''}
+
+def test_changed_definition_changes_fingerprint():
+    changed = DOANHTHU.replace("SELECT patientrecordid FROM tb_servicedata", "SELECT patientrecordid FROM tb_servicedata WHERE 1 = 1")
+    assert prelude_tables(changed)['etl_pr_phau_thuat'] != prelude_tables(DOANHTHU)['etl_pr_phau_thuat']
+    assert prelude_tables(changed)['etl_treatment_first'] == prelude_tables(DOANHTHU)['etl_treatment_first']
@@ -0,0 +1,55 @@
+from datetime import date, datetime
+from decimal import Decimal
+from app.utils.transform import (build_converters, build_text_converters, build_typed_converters,
+                                 build_typed_text_converters, date_column_indices, transform_rows)
+
+# int4, date, timestamp, numeric, text, kiểu lạ (OID không có trong bảng)
+TYPES = [23, 1082, 1114, 1700, 25, 99999]
+ROWS = [
+    (1, date(2026, 10, 18), datetime(2026, 10, 18, 23, 59), Decimal('1.50'), 'x', date(2026, 1, 2)),
+    (None, None, None, Decimal('NaN'), None, Decimal('2')),
+]
+
+def test_user_entered_converters():
+    assert transform_rows(ROWS, build_converters(TYPES)) == [
+        [1, '2026-10-18', '2026-10-18', 1.5, 'x', '2026-01-02'],
+        [None, None, None, 'NaN', None, 2.0],
+    ]
+
+def test_typed_converters_write_date_serials():
+    assert transform_rows(ROWS, build_typed_converters(TYPES)) == [
+        [1, 46313, 46313, 1.5, 'x', 46024],
+        [None, None, None, 'NaN', None, 2.0],
+    ]
+    assert transform_rows([(date(1899, 12, 31),)], build_typed_converters([1082])) == [[1]]
+    assert date_column_indices(TYPES) == [1, 2]
+
+def test_unknown_types_and_passthrough():
+    assert transform_rows([], build_converters(TYPES)) == []
+    assert transform_rows([(1, 'a')], build_converters([23, 25])) == [[1, 'a']]
+    # Không có thông tin kiểu: kiểm tra từng ô
+    assert transform_rows([(date(2026, 10, 18), Decimal('3'))], None) == [['2026-10-18', 3.0]]
+
+def test_copy_text_converters_match_fetch_mode():
+    converters = build_text_converters([1184, 16, 1082, 23, 1700, 701, 25])
+    rows = [
+        ('2026-10-18 12:34:56+07', 't', '2026-10-18', '5', '1234.50', '0.25', '007'),
+        (None, 'f', None, 'big', 'NaN', 'Infinity', None),
+    ]
+    assert transform_rows(rows, converters) == [
+        ['2026-10-18', True, '2026-10-18', 5, 1234.5, 0.25, '007'],
+        [None, False, None, 'big', 'NaN', 'Infinity', None],
+    ]
+    # Cùng giá trị ở chế độ fetch (psycopg2 trả về Decimal)
+    assert transform_rows([(Decimal('1234.50'),)], build_converters([1700])) == [[1234.5]]
+
+def test_typed_copy_text_converters():
+    converters = build_typed_text_converters([1082, 1114, 16, 20, 701, 1700, 25])
+    rows = [
+        ('2026-10-18', '2026-10-18 12:00:00', 'f', '42', '1.25', 'NaN', '007'),
+        ('infinity', None, 'x', 'big', 'Infinity', '3', None),
+    ]
+    assert transform_rows(rows, converters) == [
+        [46313, 46313, False, 42, 1.25, 'NaN', '007'],
+        ['infinity', None, 'x', 'big', 'Infinity', 3.0, None],
+    ]